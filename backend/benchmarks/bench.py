@@ -0,0 +1,383 @@
+"""
+Suite di benchmark del simulatore: scaling del motore e throughput delle API.
+
+Uso (dalla cartella `backend`):
+
+    python benchmarks/bench.py run [--quick] [--cases rooms_10,api_get_run] [--out risultati.json]
+    python benchmarks/bench.py run --compare benchmarks/baseline.json
+    python benchmarks/bench.py compare benchmarks/baseline.json risultati.json [--threshold 0.2]
+    python benchmarks/bench.py listing [--sizes 1000,10000,50000] [--mongo-url mongodb://localhost:27017]
+
+Casi motore (`scenarios.ENGINE_CASES`): ogni caso gira in un processo nuovo (picco RSS
+non sporcato dai casi precedenti) e riporta eventi/s, tick/s, picco RSS e byte di log per
+evento, migliore di `--repeat` esecuzioni. Casi API: l'app FastAPI viene pilotata via ASGI
+in processo (`tests.asgi`), con `tests.memory_db.MemoryDatabase` al posto di MongoDB e una run già salvata dal
+codice del worker, con `--concurrency` richieste concorrenti; riporta richieste/s e latenza p95 della
+migliore di `--repeat` passate.
+
+`listing` misura la latenza dei listing paginati (`GET /scenarios`, `GET /scenarios/{id}/runs`,
+prima pagina e pagina a metà collection) mentre le collection crescono fino a ogni valore di
+`--sizes` run (un decimo di scenari, metà delle run sullo stesso scenario), con gli indici di
+`main.INDEXES`; su `MemoryDatabase` o, con `--mongo-url`, su un database temporaneo di MongoDB.
+Con indici e cursori la latenza resta piatta: riporta il rapporto tra la p50 alla dimensione
+massima e alla minima.
+
+`compare` esce con codice 1 se una metrica peggiora oltre la soglia rispetto alla baseline
+(default per metrica in `METRIC_THRESHOLDS`; `--threshold` le sostituisce tutte). La baseline
+versionata è stata misurata sulla macchina indicata in `meta`: va rigenerata con
+`run --out benchmarks/baseline.json` quando si cambia macchina di riferimento.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.scenarios import ENGINE_CASES, QUICK_CASES, generate_scenario
+from tests.asgi import asgi_request
+from tests.memory_db import MemoryDatabase, SyncDatabase
+
+# Direzione di ogni metrica: +1 più alto è meglio, -1 più basso è meglio
+METRIC_DIRECTIONS = {
+    "events_per_s": 1,
+    "ticks_per_s": 1,
+    "peak_rss_mb": -1,
+    "log_bytes_per_event": -1,
+    "requests_per_s": 1,
+    "p95_ms": -1,
+}
+# Peggioramento relativo tollerato: i tempi sono rumorosi, memoria e byte quasi deterministici
+METRIC_THRESHOLDS = {
+    "events_per_s": 0.20,
+    "ticks_per_s": 0.20,
+    "peak_rss_mb": 0.10,
+    "log_bytes_per_event": 0.05,
+    "requests_per_s": 0.35,
+    "p95_ms": 0.50,
+}
+
+API_CASES = ("api_health", "api_list_scenarios", "api_get_run", "api_run_events", "api_timeseries", "api_state", "api_run_cached")
+QUICK_API_CASES = ("api_get_run", "api_timeseries", "api_run_cached")
+API_SCENARIO = dict(rooms=50, staff=12, patients=80, max_ticks=1000)
+
+
+# --- Motore ---
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024 # byte su macOS, KiB su Linux
+
+
+def engine_case(params: dict, backend: str = "SIMPY", repeat: int = 1) -> Dict[str, float]:
+    """Esegue un caso motore (nel processo corrente) e ne ritorna le metriche."""
+    from src.engine.heap_engine import create_engine
+
+    scenario = generate_scenario(**params)
+    best = None
+    for _ in range(repeat):
+        engine = create_engine(scenario, "FULL", backend)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            log = engine.run()
+            wall = time.perf_counter() - start
+        if best is None or wall < best[0]:
+            best = (wall, len(log), log.nbytes())
+        del engine, log
+    wall, events, nbytes = best
+    return {
+        "wall_s": round(wall, 4),
+        "events": events,
+        "events_per_s": round(events / wall, 1),
+        "ticks_per_s": round(params["max_ticks"] / wall, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "log_bytes_per_event": round(nbytes / max(1, events), 2),
+    }
+
+
+def run_engine_cases(names: List[str], backend: str, repeat: int) -> Dict[str, dict]:
+    results = {}
+    spawn = multiprocessing.get_context("spawn")
+    for name in names:
+        # Un processo nuovo per caso: ru_maxrss è il picco dell'intero processo
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            results[name] = pool.submit(engine_case, ENGINE_CASES[name], backend, repeat).result()
+        print(f"{name:>20}: {results[name]}", flush=True)
+    return results
+
+
+# --- API ---
+
+def _populate_api_db(db: MemoryDatabase) -> dict:
+    """Scenario, run completata (salvata dal codice del worker) e voce di cache: ritorna gli id."""
+    from src import jobs, main
+    from src.engine.heap_engine import create_engine
+    from src.run_cache import run_cache_key
+
+    scenario = generate_scenario(**API_SCENARIO)
+    sync_db = SyncDatabase(db)
+    scenario_id = str(sync_db.scenarios.insert_one(dict(scenario)).inserted_id)
+    stored = {**scenario, "scenario_id": scenario_id}
+    cache_key = run_cache_key(stored, "FULL")
+    run_id = str(sync_db.simulation_runs.insert_one({
+        "scenario_id": scenario_id, "status": "RUNNING", "log_level": "FULL", "engine": "SIMPY", "cache_key": cache_key,
+    }).inserted_id)
+    with contextlib.redirect_stdout(io.StringIO()):
+        jobs._simulate_and_store(create_engine(stored), run_id, sync_db, {}, {})
+    asyncio.run(main._store_in_cache(cache_key, run_id))
+    return {"scenario_id": scenario_id, "run_id": run_id, "max_ticks": API_SCENARIO["max_ticks"]}
+
+
+def _api_requests(ids: dict) -> Dict[str, tuple]:
+    run, ticks = ids["run_id"], ids["max_ticks"]
+    return {
+        "api_health": ("GET", "/health", ""),
+        "api_list_scenarios": ("GET", "/scenarios", ""),
+        "api_get_run": ("GET", f"/runs/{run}", ""),
+        "api_run_events": ("GET", f"/runs/{run}/events", f"from_tick={ticks // 2}&to_tick={ticks // 2 + 100}&types=MOVE,INFECTION"),
+        "api_timeseries": ("GET", f"/runs/{run}/timeseries", "resolution=200"),
+        "api_state": ("GET", f"/runs/{run}/state", f"tick={ticks * 3 // 4 + 7}"),
+        "api_run_cached": ("POST", f"/scenarios/{ids['scenario_id']}/run", ""),
+    }
+
+
+async def _load(app, request: tuple, total: int, concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    queue = iter(range(total))
+
+    async def client():
+        for _ in queue:
+            start = time.perf_counter()
+            status, _ = await asgi_request(app, *request)
+            latencies.append(time.perf_counter() - start)
+            if not 200 <= status < 300:
+                raise RuntimeError(f"{request[0]} {request[1]}: HTTP {status}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "requests_per_s": round(total / wall, 1),
+        "p50_ms": round(1000 * latencies[len(latencies) // 2], 3),
+        "p95_ms": round(1000 * latencies[int(len(latencies) * 0.95)], 3),
+    }
+
+
+def run_api_cases(names: List[str], requests: int, concurrency: int, repeat: int = 1) -> Dict[str, dict]:
+    from src import main
+
+    db = MemoryDatabase()
+    main.db = db
+    ids = _populate_api_db(db)
+    catalog = _api_requests(ids)
+    results = {}
+    for name in names:
+        asyncio.run(_load(main.app, catalog[name], max(1, requests // 10), concurrency)) # riscaldamento
+        runs = [asyncio.run(_load(main.app, catalog[name], requests, concurrency)) for _ in range(repeat)]
+        results[name] = max(runs, key=lambda r: r["requests_per_s"])
+        print(f"{name:>20}: {results[name]}", flush=True)
+    return results
+
+
+# --- Listing al crescere delle collection ---
+
+LISTING_SIZES = (1000, 10000, 50000)
+LISTING_PAGE = 50
+LISTING_BATCH = 1000
+
+
+def _listing_run(scenario_id: str, i: int) -> dict:
+    """Header di run completata come quello scritto dal worker (niente eventi: stanno nei chunk)."""
+    return {
+        "scenario_id": scenario_id, "scenario_name": "listing", "status": "COMPLETED", "log_level": "COUNTERS",
+        "engine": "SIMPY", "cache_key": f"{i:064x}", "timestamp": f"2026-01-01T00:00:00.{i:06d}+00:00",
+        "ticks_simulated": 1000, "event_log_size": 0, "summary": {"infections": i % 17, "attack_rate": (i % 17) / 80},
+        "stats": {"wall_s": 1.0, "storage": {"checkpoints": 0.01}},
+    }
+
+
+async def _middle_id(collection, query: dict, count: int) -> str:
+    docs = await collection.find(query, {"_id": 1}).sort("_id", -1).skip(count // 2).limit(1).to_list(1)
+    return str(docs[0]["_id"])
+
+
+async def listing_load(db, sizes: List[int], requests: int, concurrency: int) -> Dict[str, dict]:
+    """Latenze dei listing paginati dopo aver fatto crescere scenari e run fino a ogni dimensione."""
+    from src import main
+
+    main.db = db
+    await main.ensure_indexes(db)
+    scenario = generate_scenario(rooms=5, staff=2, patients=5, max_ticks=10)
+    scenario_ids: List[str] = []
+    runs = hot_runs = 0
+    results = {}
+    for size in sorted(sizes):
+        docs = [{**scenario, "scenario_meta": {**scenario["scenario_meta"], "name": f"listing_{i}"}} for i in range(len(scenario_ids), max(1, size // 10))]
+        for start in range(0, len(docs), LISTING_BATCH):
+            res = await db.scenarios.insert_many(docs[start:start + LISTING_BATCH])
+            scenario_ids.extend(str(i) for i in res.inserted_ids)
+        hot = scenario_ids[0]
+        while runs < size:
+            batch = [_listing_run(hot if i % 2 == 0 else scenario_ids[i % len(scenario_ids)], i) for i in range(runs, min(size, runs + LISTING_BATCH))]
+            await db.simulation_runs.insert_many(batch)
+            hot_runs += sum(r["scenario_id"] == hot for r in batch)
+            runs += len(batch)
+
+        middle_scenario = await _middle_id(db.scenarios, {}, len(scenario_ids))
+        middle_run = await _middle_id(db.simulation_runs, {"scenario_id": hot}, hot_runs)
+        page = f"limit={LISTING_PAGE}"
+        catalog = {
+            "scenarios_first": ("GET", "/scenarios", page),
+            "scenarios_middle": ("GET", "/scenarios", f"{page}&cursor={middle_scenario}"),
+            "runs_first": ("GET", f"/scenarios/{hot}/runs", page),
+            "runs_middle": ("GET", f"/scenarios/{hot}/runs", f"{page}&cursor={middle_run}"),
+        }
+        for name, request in catalog.items():
+            await _load(main.app, request, max(1, requests // 10), concurrency) # riscaldamento
+            results[f"{name}@{size}"] = {"runs": runs, "scenarios": len(scenario_ids), **await _load(main.app, request, requests, concurrency)}
+            print(f"{name + '@' + str(size):>28}: {results[f'{name}@{size}']}", flush=True)
+    smallest, largest = min(sizes), max(sizes)
+    for name in ("scenarios_first", "scenarios_middle", "runs_first", "runs_middle"):
+        ratio = results[f"{name}@{largest}"]["p50_ms"] / results[f"{name}@{smallest}"]["p50_ms"]
+        results[f"{name}@{largest}"]["p50_growth"] = round(ratio, 2)
+        print(f"{name:>28}: p50 x{ratio:.2f} da {smallest} a {largest} run", flush=True)
+    return results
+
+
+async def _listing_on_mongo(url: str, sizes: List[int], requests: int, concurrency: int) -> Dict[str, dict]:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(url)
+    name = f"hai_listing_bench_{os.getpid()}"
+    try:
+        return await listing_load(client[name], sizes, requests, concurrency)
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+
+# --- Baseline e confronto ---
+
+def compare(baseline: dict, current: dict, threshold: Optional[float] = None) -> List[str]:
+    """Metriche peggiorate oltre soglia rispetto alla baseline (casi assenti in uno dei due ignorati)."""
+    regressions = []
+    for name, metrics in current["cases"].items():
+        base = baseline["cases"].get(name)
+        if base is None:
+            continue
+        for metric, direction in METRIC_DIRECTIONS.items():
+            if metric not in metrics or not base.get(metric):
+                continue
+            change = (metrics[metric] - base[metric]) / base[metric] * direction
+            limit = METRIC_THRESHOLDS[metric] if threshold is None else threshold
+            if change < -limit:
+                regressions.append(f"{name}.{metric}: {base[metric]} -> {metrics[metric]} ({change:+.1%}, soglia {limit:.0%})")
+    return regressions
+
+
+def _meta(args) -> dict:
+    from src.engine.simulator import ENGINE_VERSION
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "engine_version": ENGINE_VERSION,
+        "backend": getattr(args, "backend", None),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _report(regressions: List[str]) -> int:
+    if regressions:
+        print("REGRESSIONI:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("Nessuna regressione oltre soglia.")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del simulatore HAI")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="esegue i benchmark")
+    run.add_argument("--quick", action="store_true", help="solo il sottoinsieme rapido (CI)")
+    run.add_argument("--cases", help="elenco di casi separati da virgola")
+    run.add_argument("--backend", default="SIMPY", choices=["SIMPY", "HEAP", "PARTITIONED"])
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--requests", type=int, default=500, help="richieste per caso API")
+    run.add_argument("--concurrency", type=int, default=32)
+    run.add_argument("--out", help="file JSON dei risultati")
+    run.add_argument("--compare", help="baseline JSON con cui confrontare i risultati")
+    run.add_argument("--threshold", type=float)
+
+    cmp_parser = sub.add_parser("compare", help="confronta due file di risultati")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("current")
+    cmp_parser.add_argument("--threshold", type=float)
+
+    listing = sub.add_parser("listing", help="latenza dei listing paginati al crescere delle collection")
+    listing.add_argument("--sizes", default=",".join(map(str, LISTING_SIZES)), help="numero di run, separati da virgola")
+    listing.add_argument("--requests", type=int, default=200)
+    listing.add_argument("--concurrency", type=int, default=8)
+    listing.add_argument("--mongo-url", help="MongoDB locale al posto del database in memoria")
+    listing.add_argument("--out", help="file JSON dei risultati")
+
+    args = parser.parse_args(argv)
+    if args.command == "listing":
+        sizes = [int(n) for n in args.sizes.split(",")]
+        if args.mongo_url:
+            cases = asyncio.run(_listing_on_mongo(args.mongo_url, sizes, args.requests, args.concurrency))
+        else:
+            cases = asyncio.run(listing_load(MemoryDatabase(), sizes, args.requests, args.concurrency))
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump({"meta": {**_meta(args), "store": "mongo" if args.mongo_url else "memory"}, "cases": cases}, f, indent=2)
+                f.write("\n")
+        return 0
+    if args.command == "compare":
+        with open(args.baseline) as f, open(args.current) as g:
+            return _report(compare(json.load(f), json.load(g), args.threshold))
+
+    if args.cases:
+        names = args.cases.split(",")
+        unknown = [n for n in names if n not in ENGINE_CASES and n not in API_CASES]
+        if unknown:
+            parser.error(f"casi sconosciuti: {', '.join(unknown)}")
+    else:
+        names = list(QUICK_CASES + QUICK_API_CASES) if args.quick else list(ENGINE_CASES) + list(API_CASES)
+
+    cases = run_engine_cases([n for n in names if n in ENGINE_CASES], args.backend, args.repeat)
+    api_names = [n for n in names if n in API_CASES]
+    if api_names:
+        cases.update(run_api_cases(api_names, args.requests, args.concurrency, args.repeat))
+    results = {"meta": _meta(args), "cases": cases}
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            return _report(compare(json.load(f), results, args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
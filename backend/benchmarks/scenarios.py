@@ -0,0 +1,64 @@
+"""
+Scenari sintetici per i benchmark: ospedale a reparti da 25 stanze doppie, infermieri
+assegnati ai reparti, medici e OSS su tutto l'ospedale, un cleaner ogni 10 operatori.
+"""
+from typing import Dict, List
+
+WARD_ROOMS = 25
+
+
+def generate_scenario(rooms: int, staff: int, patients: int, max_ticks: int, seed: int = 42, decay_mode: str = "STEPWISE") -> dict:
+    """Scenario valido per `ScenarioInput` con le dimensioni richieste (pazienti al più 2 per stanza)."""
+    wards = []
+    for w in range(0, rooms, WARD_ROOMS):
+        wards.append({"id": f"W{len(wards) + 1:03d}", "rooms": min(WARD_ROOMS, rooms - w), "room_type": "DOUBLE"})
+    room_ids = [f"{w['id']}_R_{i:02d}" for w in wards for i in range(1, w["rooms"] + 1)]
+
+    cleaners = max(1, staff // 10)
+    doctors = max(0, (staff - cleaners) // 5)
+    nurses = max(0, staff - cleaners - doctors)
+    staffing: List[Dict] = []
+    # Infermieri distribuiti sui reparti (il resto ai primi)
+    for k, ward in enumerate(wards):
+        count = nurses // len(wards) + (1 if k < nurses % len(wards) else 0)
+        if count:
+            staffing.append({"role": "NURSE", "count": count, "ward": ward["id"], "compliance_modifier": 0.9})
+    if doctors:
+        staffing.append({"role": "DOC", "count": doctors, "compliance_modifier": 0.8})
+    staffing.append({"role": "CLEANER", "count": cleaners, "cleaning_efficacy": 0.85})
+
+    patients = min(patients, 2 * len(room_ids))
+    patient_list = []
+    for i in range(patients):
+        room = room_ids[(i // 2) if patients > len(room_ids) else i]
+        infected = i % 50 == 0 # 2% di casi indice
+        patient_list.append({
+            "id": f"P_{i:05d}",
+            "room": room,
+            "state": "INFECTED" if infected else "SUSCEPTIBLE",
+            "susceptibility": 0.5 + 0.4 * ((i * 7919) % 100) / 100.0,
+            "viral_load": 10000.0 if infected else 0.0,
+        })
+
+    return {
+        "scenario_meta": {"name": f"bench_{rooms}r_{staff}s_{patients}p_{max_ticks}t", "seed": seed},
+        "hospital": {"rooms": 0, "wards": wards},
+        "staffing": staffing,
+        "patients": patient_list,
+        "pathogen": {"transmission_prob": 0.3},
+        "hygiene": {"base_compliance": 0.6},
+        "simulation": {"max_ticks": max_ticks, "tick_unit_minutes": 10, "decay_mode": decay_mode},
+    }
+
+
+# Griglia dei casi motore: (stanze, staff, pazienti, tick); "quick" è il sottoinsieme per la CI
+ENGINE_CASES = {
+    "rooms_10": dict(rooms=10, staff=2, patients=15, max_ticks=20000),
+    "rooms_100": dict(rooms=100, staff=20, patients=150, max_ticks=2000),
+    "rooms_1000": dict(rooms=1000, staff=100, patients=1500, max_ticks=1000),
+    "rooms_5000": dict(rooms=5000, staff=500, patients=7500, max_ticks=500),
+    "staff_500": dict(rooms=100, staff=500, patients=150, max_ticks=500),
+    "ticks_20000": dict(rooms=25, staff=10, patients=40, max_ticks=20000),
+    "rooms_5000_lazy": dict(rooms=5000, staff=500, patients=7500, max_ticks=500, decay_mode="LAZY"),
+}
+QUICK_CASES = ("rooms_10", "rooms_100", "staff_500")
@@ -0,0 +1,79 @@
+"""
+Archiviazione dei checkpoint del motore.
+
+Durante una run il worker salva lo stato completo del motore (vedi
+`HAISimulatorEngine.checkpoint`) al tick iniziale e ogni `RUN_CHECKPOINT_TICKS` tick,
+come JSON compresso con zlib nella collection `run_checkpoints`, indicizzata su
+`(run_id, tick)`. Un fork (`POST /runs/{id}/fork`) riparte dal checkpoint più vicino
+prima del tick richiesto e paga solo i tick successivi.
+
+Con lo stesso formato il worker salva anche i fotogrammi di stato (vedi
+`HAISimulatorEngine.keyframe`) ogni `RUN_KEYFRAME_TICKS` tick nella collection
+`run_keyframes`: `GET /runs/{id}/state?tick=` parte dal fotogramma più vicino e applica
+solo il delta di eventi successivo (`apply_event_delta`). Un intervallo più corto costa
+spazio e fa applicare meno eventi per richiesta.
+"""
+import json
+import os
+import zlib
+from typing import Iterable, Optional
+
+from bson import Binary
+
+RUN_CHECKPOINT_TICKS = int(os.getenv("RUN_CHECKPOINT_TICKS", "144")) # 1 giorno con tick da 10 minuti
+CHECKPOINT_COLLECTION = "run_checkpoints"
+CHECKPOINT_INDEX = [("run_id", 1), ("tick", 1)]
+RUN_KEYFRAME_TICKS = int(os.getenv("RUN_KEYFRAME_TICKS", "36")) # 6 ore con tick da 10 minuti
+KEYFRAME_COLLECTION = "run_keyframes"
+
+
+def encode_checkpoint(state: dict) -> bytes:
+    return zlib.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def decode_checkpoint(data: bytes) -> dict:
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+def checkpoint_doc(run_id: str, state: dict) -> dict:
+    data = encode_checkpoint(state)
+    return {"run_id": run_id, "tick": state["tick"], "size": len(data), "data": Binary(data)}
+
+
+def checkpoint_query(run_id: str, tick: Optional[float] = None) -> dict:
+    """Filtro dei checkpoint di una run fino al tick indicato (da ordinare per `tick` decrescente)."""
+    query = {"run_id": run_id}
+    if tick is not None:
+        query["tick"] = {"$lte": tick}
+    return query
+
+
+def apply_event_delta(keyframe: dict, events: Iterable[dict], tick: float) -> dict:
+    """
+    Stato al tick `tick` (eventi di `tick` inclusi) dal fotogramma e dagli eventi successivi:
+    MOVE aggiorna la stanza dell'operatore, INFECTION stato e carica del paziente.
+    Le altre cariche restano quelle del fotogramma (gli eventi non le riportano).
+    """
+    patients = {pid: list(p) for pid, p in keyframe["patients"].items()}
+    staff = {sid: list(s) for sid, s in keyframe["staff"].items()}
+    applied = 0
+    for e in events:
+        if e["t"] < keyframe["tick"] or e["t"] > tick:
+            continue
+        kind = e["type"]
+        if kind == "MOVE" and e["agent_id"] in staff:
+            staff[e["agent_id"]][0] = e["room"]
+        elif kind == "INFECTION" and e["target"] in patients:
+            patients[e["target"]][1] = "INFECTED"
+            patients[e["target"]][2] = 10000.0
+        else:
+            continue
+        applied += 1
+    return {
+        "tick": tick,
+        "keyframe_tick": keyframe["tick"],
+        "events_applied": applied,
+        "rooms": [{"id": rid, "load": load} for rid, load in keyframe["rooms"].items()],
+        "patients": [{"id": pid, "room": room, "state": state, "load": load} for pid, (room, state, load) in patients.items()],
+        "staff": [{"id": sid, "room": room, "load": load} for sid, (room, load) in staff.items()],
+    }
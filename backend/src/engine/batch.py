@@ -0,0 +1,212 @@
+import numpy as np
+from typing import Dict, Optional
+
+from .simulator import HAISimulatorEngine
+
+# Codici di stato clinico usati negli array (int8) dei pazienti
+STATE_CODES = {"SUSCEPTIBLE": 0, "COLONIZED": 1, "INFECTED": 2, "RECOVERED": 3}
+
+
+class BatchSimulatorEngine:
+    """
+    Motore Monte Carlo vettoriale: esegue `replicates` repliche indipendenti dello
+    stesso scenario in parallelo, tenendo le cariche di stanze, mani e pazienti in
+    matrici NumPy (repliche x entità).
+
+    Ogni tick applica in un unico passo vettoriale (su tutte le repliche e tutti gli
+    operatori in visita) il decadimento, le estrazioni di igiene, lo scambio di carica
+    di `_cross_contaminate` e le pulizie. Rispetto al motore SimPy scalare l'ordine
+    intra-tick è fissato (decadimento, visite, pulizie) e due operatori che entrano
+    nella stessa stanza nello stesso tick leggono la carica di inizio tick: le
+    statistiche coincidono entro la tolleranza Monte Carlo, non i singoli eventi.
+    """
+
+    def __init__(self, scenario_dict: dict, replicates: int = 1000, seed: Optional[int] = None):
+        # Il layout (stanze, pazienti, staff) è costruito dal motore scalare,
+        # così entrambe le modalità condividono la stessa logica di inizializzazione.
+        template = HAISimulatorEngine(scenario_dict)
+        self.scenario = scenario_dict
+        self.replicates = replicates
+        self.max_ticks = template.max_ticks
+        self.tick_unit_m = template.tick_unit_m
+
+        self.trans_prob = template.trans_prob
+        self.base_compliance = template.base_compliance
+        self.gel_reduction = template.gel_reduction
+        self.iso_modifier = template.iso_modifier
+
+        # Fattori di decadimento a scalini (gli stessi di `_decay_process`)
+        self.surface_decay_factor = template.surface_decay_factor
+        self.hands_decay_factor = template.hands_decay_factor
+
+        if seed is None:
+            seed = self.scenario["scenario_meta"].get("seed", 42)
+        self.rng = np.random.default_rng(seed)
+
+        # Layout statico (vettori per entità)
+        room_ids = list(template.rooms.keys())
+        room_index = {rid: i for i, rid in enumerate(room_ids)}
+        self.room_ids = room_ids
+        self.room_is_iso = np.array([template.rooms[rid].type == "ISOLATION" for rid in room_ids])
+
+        patients = list(template.patients.values())
+        self.patient_ids = [p.id for p in patients]
+        self.susceptibility = np.array([p.susceptibility for p in patients], dtype=np.float64)
+
+        # Occupanti di ogni stanza (stanze x posti, -1 = posto vuoto), dall'indice del motore scalare
+        patient_index = {p.id: j for j, p in enumerate(patients)}
+        max_occupancy = max((len(occ) for occ in template.room_patients.values()), default=0)
+        self.room_patients = np.full((len(room_ids), max(1, max_occupancy)), -1, dtype=np.int64)
+        for rid, occ in template.room_patients.items():
+            for k, p in enumerate(occ):
+                self.room_patients[room_index[rid], k] = patient_index[p.id]
+
+        staff = template.staff_agents
+        self.staff_ids = [s.id for s in staff]
+        self.is_cleaner = np.array([s.role == "CLEANER" for s in staff], dtype=bool)
+        self.compliance_mod = np.array([s.compliance_modifier for s in staff], dtype=np.float64)
+        self.cleaning_eff = np.array([s.cleaning_efficacy or 0.85 for s in staff], dtype=np.float64)
+
+        # Stanze visitabili da ogni operatore: intervallo contiguo [start, start + size)
+        # (le stanze di un reparto sono consecutive nell'ordine del motore scalare)
+        self.staff_room_start = np.zeros(len(staff), dtype=np.int64)
+        self.staff_room_count = np.full(len(staff), len(room_ids), dtype=np.int64)
+        for k, s in enumerate(staff):
+            if s.ward is not None:
+                ward_rooms = template.wards[s.ward]
+                self.staff_room_start[k] = room_index[ward_rooms[0]] if ward_rooms else 0
+                self.staff_room_count[k] = len(ward_rooms)
+
+        # Stato dinamico (repliche x entità)
+        r = replicates
+        self.room_load = np.tile(np.array([template.rooms[rid].load for rid in room_ids], dtype=np.float64), (r, 1))
+        self.hand_load = np.zeros((r, len(staff)), dtype=np.float64)
+        self.patient_load = np.tile(np.array([p.load for p in patients], dtype=np.float64), (r, 1))
+        self.patient_state = np.tile(np.array([STATE_CODES[p.state] for p in patients], dtype=np.int8), (r, 1))
+
+        # Contatori per replica
+        self.infections = np.zeros(r, dtype=np.int64)
+        self.hygiene_success = np.zeros(r, dtype=np.int64)
+        self.hygiene_fail = np.zeros(r, dtype=np.int64)
+        self.visits = np.zeros(r, dtype=np.int64)
+        self.cleanings = np.zeros(r, dtype=np.int64)
+        self.initial_susceptible = (self.patient_state == STATE_CODES["SUSCEPTIBLE"]).sum(axis=1)
+
+    def _decay_step(self):
+        """Decadimento a scalini di superfici e mani su tutte le repliche."""
+        rl = self.room_load
+        rl[rl > 0.01] *= self.surface_decay_factor
+        hl = self.hand_load
+        hl[hl > 0.01] *= self.hands_decay_factor
+
+    def _hygiene_draw(self, p: np.ndarray, hands: np.ndarray, rep: np.ndarray) -> np.ndarray:
+        """Estrazione vettoriale di `_hand_hygiene_check`: ritorna le mani dopo l'eventuale gel."""
+        success = self.rng.random(p.shape[0]) < p
+        np.add.at(self.hygiene_success, rep, success)
+        np.add.at(self.hygiene_fail, rep, ~success)
+        return np.where(success, hands * (1.0 - self.gel_reduction), hands)
+
+    def _visit_step(self, rep: np.ndarray, staff: np.ndarray):
+        """Esegue in blocco le visite delle coppie (replica, operatore) schedulate al tick corrente."""
+        rooms = self.staff_room_start[staff] + self.rng.integers(0, self.staff_room_count[staff])
+        np.add.at(self.visits, rep, 1)
+
+        # CLEANER LOGIC: Pulizia
+        cleaner = self.is_cleaner[staff]
+        if cleaner.any():
+            c_rep, c_room = rep[cleaner], rooms[cleaner]
+            np.multiply.at(self.room_load, (c_rep, c_room), 1.0 - self.cleaning_eff[staff[cleaner]])
+            np.add.at(self.cleanings, c_rep, 1)
+
+        clinical = ~cleaner
+        if not clinical.any():
+            return
+        rep, staff, rooms = rep[clinical], staff[clinical], rooms[clinical]
+
+        target_prob = self.base_compliance * self.compliance_mod[staff]
+        target_prob = np.where(self.room_is_iso[rooms], target_prob * self.iso_modifier, target_prob)
+        target_prob = np.minimum(target_prob, 0.99)
+
+        # Momento OMS 1: Prima del contatto (Ingresso)
+        hands = self._hygiene_draw(target_prob, self.hand_load[rep, staff], rep)
+
+        # 1. Contatto Ambiente <-> Mani
+        room_pickup = self.room_load[rep, rooms] * 0.10
+        hands_drop = hands * 0.05
+        hands = hands + room_pickup - hands_drop
+        np.add.at(self.room_load, (rep, rooms), hands_drop - room_pickup)
+        np.maximum(self.room_load, 0.0, out=self.room_load)
+
+        # 2. Contatto Paziente <-> Mani, un posto letto alla volta
+        for slot in range(self.room_patients.shape[1]):
+            pat = self.room_patients[rooms, slot]
+            has_pat = pat >= 0
+            if not has_pat.any():
+                continue
+            p_rep, p_idx = rep[has_pat], pat[has_pat]
+            pat_pickup = self.patient_load[p_rep, p_idx] * 0.15
+            pat_drop = hands[has_pat] * 0.10
+            hands[has_pat] += pat_pickup - pat_drop
+            np.add.at(self.patient_load, (p_rep, p_idx), pat_drop - pat_pickup)
+
+            # 3. Check Infezione (Suscettibile -> Infetto)
+            at_risk = (self.patient_state[p_rep, p_idx] == STATE_CODES["SUSCEPTIBLE"]) & (pat_drop > 10.0)
+            risk = np.minimum(1.0, (pat_drop / 1000.0) * self.trans_prob * self.susceptibility[p_idx])
+            infected = at_risk & (self.rng.random(p_rep.shape[0]) < risk)
+            if infected.any():
+                # Più contatti nello stesso tick possono infettare lo stesso paziente: conta una volta sola
+                flat = np.unique(p_rep[infected] * len(self.patient_ids) + p_idx[infected])
+                i_rep, i_idx = np.divmod(flat, len(self.patient_ids))
+                self.patient_state[i_rep, i_idx] = STATE_CODES["INFECTED"]
+                self.patient_load[i_rep, i_idx] = 10000.0
+                np.add.at(self.infections, i_rep, 1)
+
+        # Momento OMS 2: Dopo il contatto (Uscita)
+        self.hand_load[rep, staff] = self._hygiene_draw(target_prob, hands, rep)
+
+    def run(self) -> Dict[str, np.ndarray]:
+        """Esegue tutte le repliche e ritorna gli esiti aggregati (un array per metrica, uno slot per replica)."""
+        r, n_staff = self.hand_load.shape
+        # Primo task di ogni operatore: 1-3 tick come in `agent_process`
+        next_visit = self.rng.integers(1, 4, size=(r, n_staff))
+
+        for t in range(1, self.max_ticks):
+            self._decay_step()
+            rep, staff = np.nonzero(next_visit == t)
+            if rep.shape[0] == 0:
+                continue
+            self._visit_step(rep, staff)
+            next_visit[rep, staff] = t + self.rng.integers(1, 4, size=rep.shape[0])
+
+        return self.outcomes()
+
+    def outcomes(self) -> Dict[str, np.ndarray]:
+        susceptible = np.maximum(self.initial_susceptible, 1)
+        return {
+            "infections": self.infections.copy(),
+            "attack_rate": np.where(self.initial_susceptible > 0, self.infections / susceptible, 0.0),
+            "final_infected": (self.patient_state == STATE_CODES["INFECTED"]).sum(axis=1),
+            "hygiene_success": self.hygiene_success.copy(),
+            "hygiene_fail": self.hygiene_fail.copy(),
+            "visits": self.visits.copy(),
+            "cleanings": self.cleanings.copy(),
+            "mean_room_load": self.room_load.mean(axis=1),
+            "max_room_load": self.room_load.max(axis=1),
+            "mean_hand_load": self.hand_load.mean(axis=1) if self.hand_load.shape[1] else np.zeros(self.replicates),
+        }
+
+
+def summarize_outcomes(outcomes: Dict[str, np.ndarray]) -> Dict[str, dict]:
+    """Media, deviazione standard e semi-ampiezza dell'intervallo di confidenza al 95% per ogni metrica."""
+    summary = {}
+    for name, values in outcomes.items():
+        values = np.asarray(values, dtype=np.float64)
+        n = values.shape[0]
+        std = float(values.std(ddof=1)) if n > 1 else 0.0
+        summary[name] = {
+            "mean": float(values.mean()) if n else 0.0,
+            "std": std,
+            "ci95_half_width": 1.96 * std / np.sqrt(n) if n > 1 else float("inf"),
+            "n": n,
+        }
+    return summary
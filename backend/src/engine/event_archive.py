@@ -0,0 +1,255 @@
+"""
+Formato binario versionato dell'EventLog (archivio `.hailog`).
+
+Il log è diviso in blocchi autosufficienti, uno per chunk di `event_store`:
+
+    blocco = u32 lunghezza header | header JSON | colonne   (tutto compresso con il codec)
+
+- header: numero di eventi, `t` del primo evento, modo della colonna tempi, tabella locale
+  delle stringhe (solo gli id usati nel blocco: agenti, stanze, pazienti, esiti) ed `extras`
+  (START, END, eventi custom) indicizzati per posizione nel blocco;
+- colonne: tempi (delta interi `u32` se tutti i tick sono interi, altrimenti `f64`), tipo
+  evento `u8`, agente/stanza/paziente/esito come codici della tabella locale (`i16` o `i32`,
+  -1 = assente).
+
+Il file archivio concatena i blocchi dopo un'intestazione fissa e termina con un indice:
+
+    MAGIC | u16 versione | blocchi... | footer (JSON zlib) | u64 offset footer | u32 len footer | MAGIC
+
+Il footer contiene versione, codec, tabella dei tipi evento e, per ogni blocco, offset,
+dimensione, numero di eventi e finestra di tick: un lettore su `mmap` decomprime solo i
+blocchi che intersecano l'intervallo richiesto. `zstd` è usato se il pacchetto `zstandard`
+è installato, altrimenti `zlib` (formato gzip/deflate).
+"""
+import json
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, Optional
+
+import numpy as np
+
+from .eventlog import KIND_NAMES, NO_ID, EventLog
+
+try:
+    import zstandard
+except ImportError: # dipendenza opzionale
+    zstandard = None
+
+ARCHIVE_VERSION = 1
+MAGIC = b"HAIEVLOG"
+_PREAMBLE = struct.Struct("<8sH")
+_TRAILER = struct.Struct("<QI8s")
+_U32 = struct.Struct("<I")
+DEFAULT_CODEC = "zstd" if zstandard is not None else "zlib"
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zlib":
+        return zlib.compress(data, 6)
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"Codec non disponibile: {codec}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Codec non disponibile: {codec}")
+
+
+def codec_available(codec: str) -> bool:
+    return codec == "zlib" or (codec == "zstd" and zstandard is not None)
+
+
+def recode(data: bytes, source: str, target: str) -> bytes:
+    """Ricomprime un blocco da `source` a `target` (invariato se coincidono)."""
+    return data if source == target else compress(decompress(data, source), target)
+
+
+# --- Blocchi ---
+
+def encode_block(event_log: EventLog, start: int, stop: int, codec: str = DEFAULT_CODEC) -> bytes:
+    """Codifica gli eventi `[start, stop)` del log in un blocco compresso autosufficiente."""
+    t = np.frombuffer(event_log.t, dtype=np.float64)[start:stop]
+    ids = np.stack([
+        np.frombuffer(col, dtype=np.int32)[start:stop]
+        for col in (event_log.agent, event_log.room, event_log.patient, event_log.result)
+    ])
+    # Dizionario locale: solo le stringhe usate nel blocco, codici 0..k-1 (NO_ID resta -1)
+    used, codes = np.unique(ids, return_inverse=True)
+    codes = codes.reshape(ids.shape)
+    if used.size and used[0] == NO_ID:
+        codes -= 1
+        used = used[1:]
+    id_dtype = "<i2" if used.size < 2 ** 15 else "<i4"
+
+    deltas = np.diff(t, prepend=t[0])
+    integral = bool(np.all(t == np.floor(t))) and bool(np.all((deltas >= 0) & (deltas < 2 ** 32)))
+    header = {
+        "n": stop - start,
+        "t0": float(t[0]),
+        "t_mode": "delta_u32" if integral else "f64",
+        "id_dtype": id_dtype,
+        "strings": [event_log.strings[c] for c in used.tolist()],
+        "extras": {str(i - start): e for i, e in event_log.extras.items() if start <= i < stop},
+    }
+    head = json.dumps(header, separators=(",", ":")).encode()
+    parts = [
+        _U32.pack(len(head)), head,
+        (deltas.astype("<u4") if integral else t.astype("<f8")).tobytes(),
+        event_log.kind[start:stop].tobytes(),
+        codes.astype(id_dtype).tobytes(),
+    ]
+    return compress(b"".join(parts), codec)
+
+
+def decode_block(data: bytes, codec: str = DEFAULT_CODEC) -> EventLog:
+    """Blocco → EventLog con la sola tabella locale (la lettura produce i dict standard)."""
+    raw = decompress(bytes(data), codec)
+    (head_len,) = _U32.unpack_from(raw)
+    offset = _U32.size + head_len
+    header = json.loads(raw[_U32.size:offset])
+    n = header["n"]
+
+    if header["t_mode"] == "delta_u32":
+        deltas = np.frombuffer(raw, dtype="<u4", count=n, offset=offset)
+        t = header["t0"] + np.cumsum(deltas, dtype=np.float64)
+        offset += 4 * n
+    else:
+        t = np.frombuffer(raw, dtype="<f8", count=n, offset=offset)
+        offset += 8 * n
+    kind = raw[offset:offset + n]
+    offset += n
+    codes = np.frombuffer(raw, dtype=header["id_dtype"], count=4 * n, offset=offset).astype(np.int32).reshape(4, n)
+
+    log = EventLog()
+    log.t = array("d", t.tobytes())
+    log.kind = array("B", kind)
+    log.agent, log.room, log.patient, log.result = (array("i", row.tobytes()) for row in codes)
+    log.strings = header["strings"]
+    log.extras = {int(i): e for i, e in header["extras"].items()}
+    log._bind()
+    return log
+
+
+def block_events(data: bytes, codec: str = DEFAULT_CODEC) -> Iterator[dict]:
+    return iter(decode_block(data, codec))
+
+
+# --- File archivio ---
+
+class ArchiveWriter:
+    """
+    Produce i byte di un archivio un pezzo alla volta (intestazione, blocchi, footer), così da
+    poterlo scrivere su file o inviare in streaming senza tenerlo tutto in memoria.
+    `upper` (esclusivo) limita gli eventi letti da un blocco: serve ai fork, che riusano i
+    blocchi della run madre fino al tick di fork.
+    """
+
+    def __init__(self, codec: str = DEFAULT_CODEC):
+        self.codec = codec
+        self.offset = 0
+        self.blocks: List[dict] = []
+
+    def header(self) -> bytes:
+        data = _PREAMBLE.pack(MAGIC, ARCHIVE_VERSION)
+        self.offset += len(data)
+        return data
+
+    def block(self, data: bytes, n: int, t_start: float, t_end: float, upper: Optional[float] = None) -> bytes:
+        entry = {"offset": self.offset, "size": len(data), "n": n, "t_start": t_start, "t_end": t_end}
+        if upper is not None:
+            entry["upper"] = upper
+        self.blocks.append(entry)
+        self.offset += len(data)
+        return bytes(data)
+
+    def footer(self, meta: Optional[dict] = None) -> bytes:
+        footer = zlib.compress(json.dumps({
+            "version": ARCHIVE_VERSION,
+            "codec": self.codec,
+            "kinds": KIND_NAMES,
+            "events": sum(b["n"] for b in self.blocks),
+            "blocks": self.blocks,
+            "meta": meta or {},
+        }, separators=(",", ":")).encode())
+        return footer + _TRAILER.pack(self.offset, len(footer), MAGIC)
+
+
+def write_archive(fp: BinaryIO, chunks, codec: str = DEFAULT_CODEC, meta: Optional[dict] = None) -> int:
+    """Scrive su `fp` l'archivio dei chunk (`block`, `n`, `t_start`, `t_end`); ritorna i byte scritti."""
+    writer = ArchiveWriter(codec)
+    fp.write(writer.header())
+    for c in chunks:
+        fp.write(writer.block(c["block"], c["n"], c["t_start"], c["t_end"]))
+    tail = writer.footer(meta)
+    fp.write(tail)
+    return writer.offset + len(tail)
+
+
+class EventArchive:
+    """Lettore di un archivio su `bytes` o `mmap`: decomprime solo i blocchi richiesti."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        if len(buffer) < _PREAMBLE.size + _TRAILER.size:
+            raise ValueError("Archivio troppo corto")
+        magic, version = _PREAMBLE.unpack_from(buffer, 0)
+        footer_offset, footer_len, tail_magic = _TRAILER.unpack_from(buffer, len(buffer) - _TRAILER.size)
+        if magic != MAGIC or tail_magic != MAGIC:
+            raise ValueError("Non è un archivio EventLog")
+        if version > ARCHIVE_VERSION:
+            raise ValueError(f"Versione archivio non supportata: {version}")
+        footer = json.loads(zlib.decompress(buffer[footer_offset:footer_offset + footer_len]))
+        if footer["kinds"] != KIND_NAMES:
+            raise ValueError("Tabella dei tipi evento incompatibile")
+        self.version = version
+        self.codec = footer["codec"]
+        self.blocks: List[dict] = footer["blocks"]
+        self.meta: dict = footer["meta"]
+        self.n_events: int = footer["events"]
+
+    def iter_events(self, from_tick: Optional[float] = None, to_tick: Optional[float] = None, types: Optional[set] = None) -> Iterator[dict]:
+        for b in self.blocks:
+            if from_tick is not None and b["t_end"] <= from_tick:
+                continue
+            if to_tick is not None and b["t_start"] > to_tick:
+                continue
+            upper = b.get("upper")
+            for e in block_events(self.buffer[b["offset"]:b["offset"] + b["size"]], self.codec):
+                if upper is not None and e["t"] >= upper:
+                    break
+                if from_tick is not None and e["t"] < from_tick:
+                    continue
+                if to_tick is not None and e["t"] > to_tick:
+                    break
+                if types and e["type"] not in types:
+                    continue
+                yield e
+
+    def __iter__(self) -> Iterator[dict]:
+        return self.iter_events()
+
+    def iter_jsonl(self, **filters) -> Iterator[str]:
+        """Decodifica in streaming verso JSON Lines (una riga per evento, come `/runs/{id}/events`)."""
+        for e in self.iter_events(**filters):
+            yield json.dumps(e) + "\n"
+
+
+@contextmanager
+def open_archive(path: str) -> Iterator[EventArchive]:
+    """Apre un archivio su file tramite `mmap` (le pagine dei blocchi non letti restano su disco)."""
+    with open(path, "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield EventArchive(mapped)
+
+
+if __name__ == "__main__":
+    # python -m src.engine.event_archive run.hailog > run.jsonl
+    with open_archive(sys.argv[1]) as archive:
+        sys.stdout.writelines(archive.iter_jsonl())
@@ -0,0 +1,207 @@
+from array import array
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+# Codici dei tipi di evento (colonna `kind`)
+START, END, MOVE, CLEANING, HYGIENE, INFECTION, CUSTOM = range(7)
+KIND_NAMES = ["START", "END", "MOVE", "CLEANING", "HYGIENE", "INFECTION", None]
+KIND_CODES = {name: code for code, name in enumerate(KIND_NAMES) if name is not None}
+
+NO_ID = -1
+
+
+class EventLog:
+    """
+    EventLog colonnare: un array tipizzato per colonna (`t`, tipo evento, agente,
+    stanza, paziente, esito) e stringhe internate una sola volta nella tabella `strings`.
+
+    La colonna `result` contiene un codice il cui significato dipende dal tipo:
+    esito per HYGIENE (`WASH_IN_SUCCESS`...), meccanismo per INFECTION, ruolo per MOVE.
+    Il messaggio leggibile (`msg`) viene formattato solo quando l'evento è letto come
+    dict, quindi iterare il log produce esattamente gli stessi dict della versione a
+    lista. Gli eventi non previsti dalle colonne (START, END, eventi custom) tengono
+    messaggio e campi extra in `extras`.
+    """
+
+    def __init__(self):
+        self.t = array("d")
+        self.kind = array("B")
+        self.agent = array("i")
+        self.room = array("i")
+        self.patient = array("i")
+        self.result = array("i")
+        self.strings: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self.extras: Dict[int, dict] = {}
+        self._bind()
+
+    def _bind(self):
+        # Append pre-legati: evitano il lookup degli attributi nel hot path
+        self._t = self.t.append
+        self._kind = self.kind.append
+        self._agent = self.agent.append
+        self._room = self.room.append
+        self._patient = self.patient.append
+        self._result = self.result.append
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_t", "_kind", "_agent", "_room", "_patient", "_result"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._bind()
+
+    def intern(self, value: Optional[str]) -> int:
+        """Codice intero della stringa nella tabella `strings` (NO_ID per None)."""
+        if value is None:
+            return NO_ID
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.strings)
+            self._codes[value] = code
+            self.strings.append(value)
+        return code
+
+    # --- Scrittura (hot path del motore: id già internati con `intern`) ---
+
+    def add_move(self, t: float, agent: int, room: int, role: int):
+        self._t(t)
+        self._kind(MOVE)
+        self._agent(agent)
+        self._room(room)
+        self._patient(NO_ID)
+        self._result(role)
+
+    def add_cleaning(self, t: float, agent: int, room: int):
+        self._t(t)
+        self._kind(CLEANING)
+        self._agent(agent)
+        self._room(room)
+        self._patient(NO_ID)
+        self._result(NO_ID)
+
+    def add_hygiene(self, t: float, agent: int, room: int, result: int):
+        self._t(t)
+        self._kind(HYGIENE)
+        self._agent(agent)
+        self._room(room)
+        self._patient(NO_ID)
+        self._result(result)
+
+    def add_infection(self, t: float, source: int, patient: int, mechanism: int):
+        self._t(t)
+        self._kind(INFECTION)
+        self._agent(source)
+        self._room(NO_ID)
+        self._patient(patient)
+        self._result(mechanism)
+
+    def add(self, t: float, event_type: str, message: str, **kwargs):
+        """Evento generico (START, END o custom): messaggio e campi restano in `extras`."""
+        kind = KIND_CODES.get(event_type, CUSTOM)
+        if kind not in (START, END):
+            kind = CUSTOM
+        self.extras[len(self.t)] = {"type": event_type, "msg": message, **kwargs}
+        self._t(t)
+        self._kind(kind)
+        self._agent(NO_ID)
+        self._room(NO_ID)
+        self._patient(NO_ID)
+        self._result(NO_ID)
+
+    def extend(self, t, kind, agent, room, patient, result):
+        """
+        Accoda in blocco eventi colonnari già codificati con questa tabella di stringhe
+        (array NumPy o `array` per colonna, senza `extras`): unione dei log delle partizioni.
+        """
+        for col, values, dtype in (
+            (self.t, t, "<f8"), (self.kind, kind, "u1"), (self.agent, agent, "<i4"),
+            (self.room, room, "<i4"), (self.patient, patient, "<i4"), (self.result, result, "<i4"),
+        ):
+            col.frombytes(np.asarray(values, dtype=dtype).tobytes())
+
+    # --- Lettura (formattazione lazy) ---
+
+    def type_of(self, i: int) -> str:
+        kind = self.kind[i]
+        if kind == CUSTOM:
+            return self.extras[i]["type"]
+        return KIND_NAMES[kind]
+
+    def event(self, i: int) -> dict:
+        """Ricostruisce l'evento `i` nel formato dict storico (`t`, `type`, `msg`, campi)."""
+        s = self.strings
+        t = self.t[i]
+        # Tick interi restano interi, come il `round(env.now, 2)` della versione a dict
+        t = int(t) if t.is_integer() else round(t, 2)
+        kind = self.kind[i]
+        if kind == MOVE:
+            agent, room = s[self.agent[i]], s[self.room[i]]
+            return {"t": t, "type": "MOVE", "msg": f"{s[self.result[i]]} {agent} visiting {room}", "agent_id": agent, "room": room}
+        if kind == HYGIENE:
+            return {"t": t, "type": "HYGIENE", "msg": s[self.result[i]], "agent_id": s[self.agent[i]], "room": s[self.room[i]]}
+        if kind == CLEANING:
+            agent, room = s[self.agent[i]], s[self.room[i]]
+            return {"t": t, "type": "CLEANING", "msg": f"{agent} cleaned {room}", "agent_id": agent, "room": room}
+        if kind == INFECTION:
+            source, target = s[self.agent[i]], s[self.patient[i]]
+            return {
+                "t": t, "type": "INFECTION", "msg": f"Patient {target} infected by {source}",
+                "source": source, "target": target, "mechanism": s[self.result[i]],
+            }
+        extra = self.extras[i]
+        return {"t": t, "type": extra["type"], "msg": extra["msg"], **{k: v for k, v in extra.items() if k not in ("type", "msg")}}
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    def __iter__(self) -> Iterator[dict]:
+        for i in range(len(self.t)):
+            yield self.event(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.event(i) for i in range(*index.indices(len(self.t)))]
+        if index < 0:
+            index += len(self.t)
+        if not 0 <= index < len(self.t):
+            raise IndexError("EventLog index out of range")
+        return self.event(index)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (EventLog, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def to_list(self) -> List[dict]:
+        return list(self)
+
+    def count_by_type(self) -> Dict[str, int]:
+        """Conteggio eventi per tipo leggendo solo la colonna `kind`."""
+        counts: Dict[str, int] = {}
+        for code in range(len(KIND_NAMES)):
+            n = self.kind.count(code)
+            if n and code != CUSTOM:
+                counts[KIND_NAMES[code]] = n
+        for i, extra in self.extras.items():
+            if self.kind[i] == CUSTOM:
+                counts[extra["type"]] = counts.get(extra["type"], 0) + 1
+        return counts
+
+    def count_results(self, kind_name: str) -> Dict[str, int]:
+        """Conteggio per valore della colonna `result` tra gli eventi di un tipo (es. esiti HYGIENE)."""
+        code = KIND_CODES[kind_name]
+        counts: Dict[str, int] = {}
+        for k, r in zip(self.kind, self.result):
+            if k == code and r != NO_ID:
+                value = self.strings[r]
+                counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    def nbytes(self) -> int:
+        """Byte occupati dalle colonne (tabella stringhe ed extras esclusi)."""
+        return sum(col.itemsize * len(col) for col in (self.t, self.kind, self.agent, self.room, self.patient, self.result))
@@ -0,0 +1,86 @@
+"""
+Backend di simulazione a coda di priorità (`heapq`), come descritto in
+`Spec-kit/03_architettura_e_simulazione.md`.
+
+Le visite dello staff sono schedulate direttamente su un min-heap di tuple
+`(tempo, seq, agente)`, senza generatori né oggetti `Timeout` di SimPy. `seq` replica
+l'id progressivo con cui SimPy ordina gli eventi simultanei, quindi a parità di seed
+e scenario la sequenza di eventi è identica a quella del backend SimPy.
+"""
+import heapq
+from typing import Callable, List, Tuple
+
+from .simulator import DECAY, HAISimulatorEngine
+
+ENGINE_BACKENDS = ("SIMPY", "HEAP", "PARTITIONED")
+
+
+class HeapClock:
+    """Orologio minimale al posto di `simpy.Environment`: il motore legge solo `now`."""
+    __slots__ = ("now",)
+
+    def __init__(self, initial_time: float = 0):
+        self.now = initial_time
+
+
+class HeapSimulatorEngine(HAISimulatorEngine):
+    """Stessa interfaccia e stessa logica di `HAISimulatorEngine`, scheduling su heap."""
+    engine_label = "Heap"
+
+    def __init__(self, scenario_dict: dict, log_level: str = "FULL"):
+        self._heap: List[Tuple[float, int, int]] = []
+        self._visits: List[Callable[[], None]] = []
+        super().__init__(scenario_dict, log_level=log_level)
+
+    def _make_clock(self, initial_time: float):
+        return HeapClock(initial_time)
+
+    def _schedule(self):
+        # Le visite leggono il clock corrente: si costruiscono dopo un eventuale `restore`
+        self._visits = [self._make_visit(agent) for agent in self.staff_agents]
+        super()._schedule()
+
+    def _schedule_entry(self, t: float, who: int):
+        heapq.heappush(self._heap, (t, self._seq, who))
+        self._seq += 1
+
+    def _pending_schedule(self) -> List[Tuple[float, int]]:
+        return [(t, who) for t, _, who in sorted(self._heap, key=lambda entry: entry[1])]
+
+    def _advance(self, until: float):
+        """Processa gli eventi con tempo < `until` (come `env.run(until=...)`) e porta il clock a `until`."""
+        heap = self._heap
+        pop = heapq.heappop
+        push = heapq.heappush
+        clock = self.env
+        visits = self._visits
+        randint = self.rng.randint
+        decay_step = self._decay_step
+        seq = self._seq
+        while heap and heap[0][0] < until:
+            t, _, who = pop(heap)
+            clock.now = t
+            if who == DECAY:
+                decay_step()
+                push(heap, (t + 1.0, seq, DECAY))
+            else:
+                visits[who]()
+                # Delay fino al prossimo task (1-3 tick / 10-30 min)
+                push(heap, (t + randint(1, 3), seq, who))
+            seq += 1
+        self._seq = seq
+        if until > clock.now:
+            clock.now = until
+
+
+def create_engine(scenario_dict: dict, log_level: str = "FULL", backend: str = "SIMPY") -> HAISimulatorEngine:
+    """Istanzia il motore del backend richiesto (SIMPY, HEAP o PARTITIONED)."""
+    if backend == "SIMPY":
+        return HAISimulatorEngine(scenario_dict, log_level=log_level)
+    if backend == "HEAP":
+        return HeapSimulatorEngine(scenario_dict, log_level=log_level)
+    if backend == "PARTITIONED":
+        # Import locale: `partition` dipende da questo modulo (HeapClock)
+        from .partition import PartitionedEngine
+        return PartitionedEngine(scenario_dict, log_level=log_level)
+    raise ValueError(f"Backend non valido: {backend} (ammessi: {', '.join(ENGINE_BACKENDS)})")
@@ -0,0 +1,118 @@
+"""
+Strumentazione del motore: timer per fase e contatori del hot path.
+
+`EngineProfiler` non aggiunge controlli nel codice del motore: all'inizio di `run()`
+sostituisce sull'istanza (motore ed EventLog) i metodi del hot path con versioni
+cronometrate, che rimuove a fine run, e il generatore casuale con uno che conta le
+estrazioni (stessa sequenza). Senza profiler il motore esegue il codice non strumentato.
+
+I tempi delle fasi sono inclusivi: `visit` comprende `hygiene`, `cross_contaminate`,
+`log` e (in LAZY/EXACT) `decay`.
+"""
+import random
+import time
+from typing import Callable, Dict
+
+# Fasi cronometrate e metodi dell'istanza che le misurano
+PHASES = ("visit", "hygiene", "cross_contaminate", "decay", "log", "snapshot")
+_ENGINE_METHODS = {
+    "_hand_hygiene_check": "hygiene",
+    "_cross_contaminate": "cross_contaminate",
+    "_decay_step": "decay",
+    "_decay_entity": "decay",
+    "checkpoint": "snapshot",
+    "keyframe": "snapshot",
+    "_sample_series": "snapshot",
+}
+_LOG_METHODS = ("add_move", "add_cleaning", "add_hygiene", "add_infection", "add")
+
+
+class CountingRandom(random.Random):
+    """`random.Random` che conta le estrazioni del motore (stessa sequenza di valori)."""
+
+    def __init__(self, state):
+        super().__init__()
+        self.setstate(state)
+        self.draws = 0
+
+    def random(self) -> float:
+        self.draws += 1
+        return super().random()
+
+    # Ridefinito per mantenere `_randbelow` basato su getrandbits (sottoclassi che ridefiniscono
+    # solo `random` passano a `_randbelow_without_getrandbits` e cambiano la sequenza di interi)
+    def getrandbits(self, k: int) -> int:
+        return super().getrandbits(k)
+
+    def randint(self, a: int, b: int) -> int:
+        self.draws += 1
+        return super().randint(a, b)
+
+    def choice(self, seq):
+        self.draws += 1
+        return super().choice(seq)
+
+
+class EngineProfiler:
+    """Timer per fase, chiamate e contatori di una run; `stats()` ne dà il riepilogo serializzabile."""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self.calls: Dict[str, int] = dict.fromkeys(PHASES, 0)
+        self.counters: Dict[str, int] = {"decay_steps": 0, "decay_entity_updates": 0, "rng_draws": 0}
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self._rng = None
+        self._started = None
+
+    def _timed(self, phase: str, fn: Callable) -> Callable:
+        seconds, calls = self.seconds, self.calls
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                seconds[phase] += clock() - start
+                calls[phase] += 1
+        return timed
+
+    def install(self, engine):
+        """Strumenta l'istanza (prima della schedule: le visite vengono costruite già cronometrate)."""
+        for name, phase in _ENGINE_METHODS.items():
+            setattr(engine, name, self._timed(phase, getattr(engine, name)))
+        make_visit = engine._make_visit
+        engine._make_visit = lambda agent: self._timed("visit", make_visit(agent))
+        for name in _LOG_METHODS:
+            setattr(engine.event_log, name, self._timed("log", getattr(engine.event_log, name)))
+        self._rng = engine.rng = CountingRandom(engine.rng.getstate())
+        self._started = (time.perf_counter(), time.process_time())
+
+    def uninstall(self, engine):
+        """Ripristina i metodi originali e chiude i tempi della run."""
+        wall, cpu = self._started
+        self.wall_s += time.perf_counter() - wall
+        self.cpu_s += time.process_time() - cpu
+        for name in list(_ENGINE_METHODS) + ["_make_visit"]:
+            engine.__dict__.pop(name, None)
+        for name in _LOG_METHODS:
+            engine.event_log.__dict__.pop(name, None)
+        # Il generatore contatore resta installato: le visite già costruite lo hanno catturato
+        self.counters["rng_draws"] = self._rng.draws
+
+    def stats(self, engine) -> dict:
+        """Riepilogo della run: tempi, fasi, contatori del motore ed eventi per tipo."""
+        decay = self.calls["decay"]
+        # `_decay_step` e `_decay_entity` condividono la fase: in STEPWISE ogni chiamata è un tick
+        if engine._lazy_decay:
+            self.counters["decay_entity_updates"] = decay
+        else:
+            self.counters["decay_steps"] = decay
+        return {
+            "wall_s": round(self.wall_s, 6),
+            "cpu_s": round(self.cpu_s, 6),
+            "phases": {p: {"calls": self.calls[p], "seconds": round(self.seconds[p], 6)} for p in PHASES},
+            "counters": {"visits": engine.counters["visits"], **self.counters},
+            "events_by_type": engine.event_log.count_by_type(),
+        }
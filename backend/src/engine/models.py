@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from typing import Any, Dict, List, Optional, Literal
 
 class RoomConfig(BaseModel):
     id: str
@@ -19,6 +19,7 @@ class StaffConfig(BaseModel):
     count: int = 1
     compliance_modifier: float = 1.0
     cleaning_efficacy: Optional[float] = None
+    ward: Optional[str] = None # Reparto assegnato (None = tutto l'ospedale)
 
 class PathogenConfig(BaseModel):
     type: str = "MRSA"
@@ -31,18 +32,39 @@ class HygieneConfig(BaseModel):
     isolation_modifier: float = 1.5
     gel_log_reduction: float = 0.99
 
+# Metriche del frame live (vedi `HAISimulatorEngine.frame`) ammesse nelle soglie di arresto
+StopMetric = Literal[
+    "susceptible", "colonized", "infected", "visits", "cleanings", "hygiene_success", "hygiene_fail",
+    "infections", "mean_room_load", "max_room_load", "mean_hand_load",
+]
+
 class SimulationConfig(BaseModel):
     max_ticks: int = 1000
     tick_unit_minutes: int = 10
+    # STEPWISE: sweep globale a ogni tick; LAZY/EXACT: decadimento applicato al contatto
+    decay_mode: Literal["STEPWISE", "LAZY", "EXACT"] = "STEPWISE"
+    # Arresto anticipato, controllato ogni `stop_check_ticks`: `early_stop` allo stato assorbente
+    # (nessuna infezione più possibile), `stop_when` quando una metrica raggiunge la soglia
+    early_stop: bool = False
+    stop_when: Dict[StopMetric, float] = {}
+    stop_check_ticks: int = Field(default=50, ge=1)
 
 class ScenarioMeta(BaseModel):
     name: str
     seed: int = 42
     description: str = ""
 
+class WardConfig(BaseModel):
+    """Reparto: blocco di stanze `<id>_R_<nn>` dello stesso tipo."""
+    id: str
+    rooms: int = Field(ge=0)
+    room_type: Literal["SINGLE", "DOUBLE"] = "SINGLE"
+    isolation_ids: List[str] = []
+
 class HospitalConfig(BaseModel):
-    rooms: int
+    rooms: int = 0
     isolation_ids: List[str] = []
+    wards: List[WardConfig] = []
 
 class ScenarioInput(BaseModel):
     """
@@ -55,3 +77,99 @@ class ScenarioInput(BaseModel):
     pathogen: PathogenConfig
     hygiene: HygieneConfig
     simulation: SimulationConfig
+
+class ForkRequest(BaseModel):
+    """
+    Modifiche di scenario per un fork da checkpoint, per path puntato come nelle sweep
+    (es. `{"staffing.CLEANER.count": 2}`).
+    """
+    overrides: Dict[str, Any] = {}
+
+class SweepRequest(BaseModel):
+    """
+    Richiesta di sweep: scenario base (inline o salvato), griglia di parametri
+    per path puntato (es. `hygiene.base_compliance`) e repliche per cella.
+    """
+    scenario_id: Optional[str] = None
+    base_scenario: Optional[ScenarioInput] = None
+    grid: Dict[str, List[Any]] = {}
+    replicates: int = Field(default=10, ge=1)
+    max_workers: Optional[int] = Field(default=None, ge=1)
+    # Arresto sequenziale (vedi `sweep.StoppingRule`): con `precision` le repliche di ogni cella
+    # partono da `replicates` e crescono finché la semiampiezza dell'IC di `target_metric` non la raggiunge
+    precision: Optional[float] = Field(default=None, gt=0)
+    target_metric: str = "attack_rate"
+    confidence: float = Field(default=0.95, gt=0, lt=1)
+    max_replicates: int = Field(default=1000, ge=2)
+    crn: bool = False # Numeri casuali comuni tra le celle (backend PARTITIONED, vedi `sweep.cell_tasks`)
+
+class ParameterRange(BaseModel):
+    """Intervallo di un parametro di scenario (path puntato come nelle sweep) per l'analisi di sensibilità."""
+    path: str
+    low: float
+    high: float
+    integer: bool = False # Valori interi in [low, high] (es. `staffing.CLEANER.count`)
+
+class SensitivityRequest(BaseModel):
+    """
+    Analisi di sensibilità globale (vedi `sensitivity.run_sensitivity`): campionamento Latin
+    hypercube dei `parameters`, indici SOBOL o MORRIS su `metric`, numeri casuali comuni con `crn`.
+    """
+    scenario_id: Optional[str] = None
+    base_scenario: Optional[ScenarioInput] = None
+    parameters: List[ParameterRange]
+    method: Literal["SOBOL", "MORRIS"] = "SOBOL"
+    samples: int = Field(default=32, ge=2)
+    replicates: int = Field(default=2, ge=1)
+    metric: str = "attack_rate"
+    crn: bool = True
+    seed: int = 0 # Seed del campionamento (i seed delle run derivano dallo scenario)
+    morris_delta: float = Field(default=0.5, gt=0, lt=1)
+    max_workers: Optional[int] = Field(default=None, ge=1)
+
+class ComparisonRequest(BaseModel):
+    """
+    Confronto tra interventi (vedi `sensitivity.compare_arms`): bracci come override di scenario,
+    il primo è il riferimento (es. `{"base": {}, "cleaner": {"staffing.CLEANER.count": 2}}`).
+    """
+    scenario_id: Optional[str] = None
+    base_scenario: Optional[ScenarioInput] = None
+    arms: Dict[str, Dict[str, Any]]
+    replicates: int = Field(default=10, ge=2)
+    metric: str = "attack_rate"
+    crn: bool = True
+    confidence: float = Field(default=0.95, gt=0, lt=1)
+    max_workers: Optional[int] = Field(default=None, ge=1)
+
+LogLevel = Literal["FULL", "EPIDEMIC_ONLY", "COUNTERS"]
+
+# Backend di scheduling: SIMPY e HEAP danno la stessa sequenza di eventi a parità di seed (vedi
+# `heap_engine`), PARTITIONED usa stream per operatore e dà una sequenza propria (vedi `partition`)
+EngineBackend = Literal["SIMPY", "HEAP", "PARTITIONED"]
+
+class RunSummary(BaseModel):
+    """
+    Riepilogo compatto di una run, calcolato dai contatori interni del motore
+    (disponibile a ogni livello di log, unico output nei livelli ridotti).
+    """
+    log_level: LogLevel
+    ticks_simulated: float
+    visits: int
+    cleanings: int
+    hygiene_success: int
+    hygiene_fail: int
+    hygiene_success_rate: float
+    infections: int
+    infection_ticks: List[float]
+    attack_rate: float
+    final_states: Dict[str, int]
+    mean_room_load: float
+    max_room_load: float
+    peak_room_load: float
+    mean_hand_load: float
+    peak_hand_load: float
+    events_logged: int
+    stop_reason: Optional[str] = None # Motivo dell'arresto anticipato (None: run fino a `max_ticks`)
+
+# Profilazione opzionale di una run: timer di fase del motore o cattura cProfile scaricabile
+ProfileMode = Literal["PHASES", "CPROFILE"]
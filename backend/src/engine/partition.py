@@ -0,0 +1,640 @@
+"""
+Esecuzione partizionata per reparti (backend PARTITIONED).
+
+Una run dei backend SIMPY/HEAP gira su un solo core e tutte le estrazioni passano da un unico
+`random.Random(seed)`: il risultato dipende dall'ordine globale delle estrazioni e la run non si
+può dividere tra processi. In questa modalità:
+
+- ogni operatore ha un proprio stream casuale (`EntityStream`) con chiave derivata da seed dello
+  scenario e id dell'operatore tramite `numpy.random.SeedSequence`. Lo stream è a contatore: le estrazioni della
+  visita k sono una funzione di (operatore, k), quindi un operatore che cambia processo porta con
+  sé solo il numero di visita, non lo stato di un generatore;
+- le stanze sono divise in partizioni (`plan_partitions`: un reparto non viene mai spezzato, le
+  stanze fuori reparto sono distribuite una alla volta) e ogni partizione gira in un processo
+  (`PartitionWorker`) con le proprie stanze, i loro pazienti e gli operatori presenti;
+- l'ordine dentro un tick è canonico: decadimento a scalini, poi le visite in ordine di indice
+  dell'operatore. Tutte le visite a una stanza avvengono nel processo che la possiede, quindi
+  nello stesso ordine qualunque sia la divisione;
+- il coordinatore (`PartitionedEngine`) fa avanzare i processi fino alla prossima barriera: il
+  primo tick in cui un operatore deve visitare una stanza di un'altra partizione (il percorso di
+  ogni operatore è noto in anticipo dal suo stream) o una fermata di avanzamento, serie o
+  fotogrammi. Alla barriera raccoglie gli operatori in uscita, con la carica sulle mani, e li
+  consegna alla partizione di destinazione; alle fermate raccoglie anche eventi e cariche.
+
+Log, contatori e stato finale sono identici bit per bit per qualunque numero di partizioni e di
+processi: gli eventi di ogni fermata sono uniti in ordine (tick, indice dell'operatore). La
+sequenza non coincide con quella dei backend SIMPY/HEAP (stream e ordine intra-tick diversi): è
+lo stesso modello stocastico, non la stessa run. Non supportati: checkpoint (quindi fork) e
+grafo di provenienza, i cui id dipenderebbero dall'ordine globale.
+"""
+import hashlib
+import math
+import multiprocessing
+import os
+import struct
+import traceback
+from array import array
+from collections import Counter, deque
+from heapq import heappop, heappush
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .eventlog import NO_ID, EventLog
+from .heap_engine import HeapClock
+from .simulator import HAISimulatorEngine
+from .timeseries import TimeSeries
+
+# Processi per run PARTITIONED (al più uno per reparto o stanza condivisa)
+PARTITION_WORKERS = int(os.getenv("PARTITION_WORKERS", str(os.cpu_count() or 1)))
+NEVER = math.inf
+
+_WORDS = struct.Struct("<8Q")
+_COUNTER = struct.Struct("<QI")
+_UNIT = 2.0 ** -53
+_LOG_COLUMNS = (("t", "d"), ("kind", "B"), ("agent", "i"), ("room", "i"), ("patient", "i"), ("result", "i"))
+
+
+def entity_keys(seed: int, ids: Sequence[str]) -> List[bytes]:
+    """
+    Chiavi di stream indipendenti per le entità `ids`, da seed dello scenario e id (`SeedSequence`
+    con lo `spawn_key` ricavato dall'id): aggiungere o togliere operatori non cambia gli stream
+    degli altri, la base dei numeri casuali comuni tra scenari (vedi `sensitivity`).
+    Il seed con segno è letto come intero a 64 bit senza segno: `s` e `-s` restano distinti.
+    """
+    return [
+        np.random.SeedSequence(seed & (2**64 - 1), spawn_key=(int.from_bytes(hashlib.blake2b(i.encode("utf-8"), digest_size=8).digest(), "little"),))
+        .generate_state(4).tobytes()
+        for i in ids
+    ]
+
+
+class EntityStream:
+    """
+    Stream casuale a contatore di un operatore: le estrazioni della visita k sono le parole a
+    64 bit di BLAKE2b(k) con la chiave dell'operatore. Parola 0: stanza (`choice`); parola 1:
+    intervallo dalla visita precedente (1-3 tick, `gap`); le successive, in ordine, per
+    `random()` (igiene e infezioni), con blocchi aggiuntivi se non bastano.
+    """
+    __slots__ = ("key", "visit", "block", "target", "words", "pos")
+
+    def __init__(self, key: bytes):
+        self.key = key
+        self.visit = 0
+        self.block = 0
+        self.target = 0
+        self.words: Tuple[int, ...] = ()
+        self.pos = 0
+
+    def draws(self, visit: int, block: int = 0) -> Tuple[int, ...]:
+        return _WORDS.unpack(hashlib.blake2b(_COUNTER.pack(visit, block), digest_size=64, key=self.key).digest())
+
+    @staticmethod
+    def gap(words: Tuple[int, ...]) -> int:
+        return 1 + words[1] % 3
+
+    def begin(self, visit: int, words: Tuple[int, ...]):
+        """Posiziona lo stream sulla visita `visit` (parole già calcolate con `draws`)."""
+        self.visit, self.block, self.target, self.words, self.pos = visit, 0, words[0], words, 2
+
+    def random(self) -> float:
+        if self.pos == 8:
+            self.block += 1
+            self.words, self.pos = self.draws(self.visit, self.block), 0
+        word = self.words[self.pos]
+        self.pos += 1
+        return (word >> 11) * _UNIT
+
+    def choice(self, seq):
+        return seq[self.target % len(seq)]
+
+
+def plan_partitions(engine: HAISimulatorEngine, partitions: int) -> Dict[str, int]:
+    """
+    Stanza -> partizione. I reparti, dal più pesante (stanze più staff assegnato), vanno alla
+    partizione più scarica; poi le stanze fuori reparto, una alla volta.
+    """
+    ward_staff = Counter(s.ward for s in engine.staff_agents if s.ward is not None)
+    weight = [0] * partitions
+    owner: Dict[str, int] = {}
+    for wid, rooms in sorted(engine.wards.items(), key=lambda item: -(len(item[1]) + ward_staff[item[0]])):
+        part = weight.index(min(weight))
+        owner.update(dict.fromkeys(rooms, part))
+        weight[part] += len(rooms) + ward_staff[wid]
+    for rid in engine.rooms:
+        if rid not in owner:
+            part = weight.index(min(weight))
+            owner[rid] = part
+            weight[part] += 1
+    return owner
+
+
+def _scenario_seed(scenario_dict: dict) -> int:
+    return scenario_dict["scenario_meta"].get("seed", 42)
+
+
+class PartitionWorker(HAISimulatorEngine):
+    """
+    Motore di una partizione: costruisce l'intero ospedale dallo scenario ma simula solo le
+    stanze di `part` (con i loro pazienti) e gli operatori presenti (`residents`), a finestre
+    fino alla barriera indicata dal coordinatore.
+    """
+    engine_label = "Partition"
+
+    def __init__(self, scenario_dict: dict, log_level: str, owner: Dict[str, int], part: int):
+        super().__init__(scenario_dict, log_level=log_level)
+        self.part = part
+        self.provenance = None
+        # Log della partizione senza START: lo scrive il coordinatore
+        self.event_log = EventLog()
+        self._intern_codes()
+        self._strings_sent = 0
+
+        self.owned_rooms = [r for rid, r in self.rooms.items() if owner[rid] == part]
+        self.owned_patients = [p for p in self.patients.values() if owner[p.room_id] == part]
+        self.residents: Dict[int, object] = {}
+        self.streams = [EntityStream(key) for key in entity_keys(_scenario_seed(scenario_dict), [a.id for a in self.staff_agents])]
+        self.visits = [self._make_visit(agent, stream) for agent, stream in zip(self.staff_agents, self.streams)]
+        # Partizione di ogni stanza tra cui l'operatore sceglie (stessa lista di `_make_visit`),
+        # condivisa tra gli operatori dello stesso reparto; solo gli operatori "mobili" migrano
+        choices: Dict[Optional[str], List[int]] = {}
+        self.choice_owner: List[List[int]] = []
+        self.mobile: List[bool] = []
+        for agent in self.staff_agents:
+            if agent.ward not in choices:
+                room_ids = self.wards[agent.ward] if agent.ward is not None else list(self.rooms.keys())
+                choices[agent.ward] = [owner[rid] for rid in room_ids]
+            self.choice_owner.append(choices[agent.ward])
+            self.mobile.append(len(set(choices[agent.ward])) > 1)
+
+        # Visite pendenti già calcolate per operatore: (visita, tick, parole dello stream)
+        self.routes = [deque() for _ in self.staff_agents]
+        self.tails: List[Optional[tuple]] = [None] * len(self.staff_agents) # ultima visita calcolata
+        self.departures: Dict[int, float] = {} # operatore mobile -> tick della prima visita fuori partizione
+        self._heap: List[Tuple[float, int]] = []
+        self._decayed = 0 # Ultimo tick di decadimento a scalini applicato
+
+    def _make_clock(self, initial_time: float):
+        return HeapClock(initial_time)
+
+    def _route(self, s: int, i: int) -> Tuple[int, float, Tuple[int, ...]]:
+        """i-esima visita pendente dell'operatore `s` (0 = la prossima), calcolata se serve."""
+        route = self.routes[s]
+        while len(route) <= i:
+            visit, wake, _ = self.tails[s]
+            words = self.streams[s].draws(visit + 1)
+            self.tails[s] = entry = (visit + 1, wake + EntityStream.gap(words), words)
+            route.append(entry)
+        return route[i]
+
+    def _owner(self, s: int, words: Tuple[int, ...]) -> int:
+        owners = self.choice_owner[s]
+        return owners[words[0] % len(owners)]
+
+    def _departure(self, s: int, part: int) -> float:
+        """Tick della prima visita pendente di `s` fuori da `part` (NEVER se non cade prima di `max_ticks`)."""
+        if not self.mobile[s]:
+            return NEVER
+        i = 0
+        while True:
+            _, wake, words = self._route(s, i)
+            if wake >= self.max_ticks:
+                return NEVER
+            if self._owner(s, words) != part:
+                return wake
+            i += 1
+
+    def admit(self, entries: List[tuple]):
+        """Operatori in arrivo: (indice, carica, ultimo aggiornamento, stanza, visita pendente, tick)."""
+        for s, load, last_update, room_id, visit, wake in entries:
+            agent = self.staff_agents[s]
+            agent.load, agent.last_update, agent.room_id = load, last_update, room_id
+            self.tails[s] = entry = (visit, wake, self.streams[s].draws(visit))
+            self.routes[s] = deque([entry])
+            self.residents[s] = agent
+            if wake < self.max_ticks:
+                heappush(self._heap, (wake, s))
+            if self.mobile[s]:
+                self.departures[s] = self._departure(s, self.part)
+
+    def _decay_to(self, tick: float):
+        while self._decayed < tick:
+            self._decayed += 1
+            self._decay_step()
+
+    def _decay_step(self):
+        """Un tick di decadimento a scalini sulle stanze della partizione e sulle mani presenti."""
+        surface_decay_factor = self.surface_decay_factor
+        for r in self.owned_rooms:
+            if r.load > 0.01:
+                r.load *= surface_decay_factor
+        hands_decay_factor = self.hands_decay_factor
+        for s in self.residents.values():
+            if s.load > 0.01:
+                s.load *= hands_decay_factor
+
+    def advance(self, until: float, entries: List[tuple], report: bool = False, keyframe: bool = False) -> dict:
+        """
+        Ammette gli operatori in arrivo e simula i tick < `until`. Ritorna i contatori, gli
+        operatori in uscita `(destinazione, stato, prossima uscita)`, la prima uscita degli
+        operatori che restano e, con `report`, eventi e cariche (più lo stato con `keyframe`).
+        """
+        self.admit(entries)
+        heap = self._heap
+        clock = self.env
+        stepwise = not self._lazy_decay
+        visits, streams, routes = self.visits, self.streams, self.routes
+        leaving = []
+        while heap and heap[0][0] < until:
+            wake, s = heappop(heap)
+            if stepwise:
+                self._decay_to(wake)
+            clock.now = wake
+            visit, _, words = routes[s].popleft()
+            # Igiene e infezioni leggono `self.rng`: durante la visita è lo stream dell'operatore
+            stream = self.rng = streams[s]
+            stream.begin(visit, words)
+            visits[s]()
+            _, wake, words = self._route(s, 0)
+            if wake >= self.max_ticks:
+                continue
+            if self._owner(s, words) == self.part:
+                heappush(heap, (wake, s))
+            else:
+                leaving.append(s)
+        if stepwise:
+            self._decay_to(until - 1)
+        clock.now = until
+
+        reply = {"counters": dict(self.counters)}
+        if report:
+            reply["events"] = self._ship_events()
+            reply["snapshot"] = self._snapshot(keyframe)
+        emigrants = []
+        for s in leaving:
+            agent = self.residents.pop(s)
+            self.departures.pop(s, None)
+            visit, wake, words = self.routes[s][0]
+            dest = self._owner(s, words)
+            emigrants.append((dest, (s, agent.load, agent.last_update, agent.room_id, visit, wake), self._departure(s, dest)))
+            self.routes[s], self.tails[s] = deque(), None
+        reply["emigrants"] = emigrants
+        reply["departure"] = min(self.departures.values(), default=NEVER)
+        return reply
+
+    def _ship_events(self) -> tuple:
+        """Eventi dall'ultima fermata (colonne) e stringhe internate nel frattempo; il log riparte vuoto."""
+        log = self.event_log
+        strings = log.strings[self._strings_sent:]
+        self._strings_sent = len(log.strings)
+        columns = tuple(getattr(log, name) for name, _ in _LOG_COLUMNS)
+        for name, typecode in _LOG_COLUMNS:
+            setattr(log, name, array(typecode))
+        log._bind()
+        return (strings, *columns)
+
+    def _snapshot(self, keyframe: bool) -> dict:
+        """Cariche al tick corrente di stanze della partizione e mani presenti (decadute in LAZY/EXACT)."""
+        now = self.env.now
+        f, h = self.surface_decay_factor, self.surface_half_life_ticks
+        snapshot = {"rooms": array("d", (self._decayed_load(r, now, f, h) for r in self.owned_rooms))}
+        f, h = self.hands_decay_factor, self.hands_half_life_ticks
+        snapshot["hands"] = {s: self._decayed_load(agent, now, f, h) for s, agent in self.residents.items()}
+        snapshot["patients_load"] = array("d", (p.load for p in self.owned_patients))
+        if keyframe:
+            snapshot["staff_rooms"] = {s: agent.room_id for s, agent in self.residents.items()}
+            snapshot["patients"] = {p.id: [p.room_id, p.state, p.load] for p in self.owned_patients}
+        return snapshot
+
+    def finish(self) -> dict:
+        """Stato finale delle entità della partizione, tick delle infezioni e picchi di carica."""
+        return {
+            "rooms": {r.id: (r.load, r.last_update) for r in self.owned_rooms},
+            "patients": {p.id: (p.state, p.load) for p in self.owned_patients},
+            "staff": {s: (agent.load, agent.last_update, agent.room_id) for s, agent in self.residents.items()},
+            "infection_ticks": self.infection_ticks,
+            "peaks": (self.peak_room_load, self.peak_hand_load),
+        }
+
+
+def _serve(worker: PartitionWorker, message: tuple):
+    command, *args = message
+    if command == "advance":
+        return worker.advance(*args)
+    if command == "finish":
+        return worker.finish()
+    raise ValueError(f"Comando di partizione sconosciuto: {command}")
+
+
+def _partition_process(conn, scenario_dict: dict, log_level: str, owner: Dict[str, int], part: int):
+    """Corpo del processo di una partizione: esegue i comandi del coordinatore fino a `finish`."""
+    try:
+        worker = PartitionWorker(scenario_dict, log_level, owner, part)
+        while True:
+            message = conn.recv()
+            conn.send(("ok", _serve(worker, message)))
+            if message[0] == "finish":
+                break
+    except EOFError:
+        pass # Coordinatore chiuso (run cancellata o fallita)
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class _LocalPartition:
+    """Partizione eseguita nel processo del coordinatore (una sola partizione, test)."""
+
+    def __init__(self, *args):
+        self.worker = PartitionWorker(*args)
+        self._reply = None
+
+    def send(self, message: tuple):
+        self._reply = _serve(self.worker, message)
+
+    def recv(self):
+        return self._reply
+
+    def close(self):
+        pass
+
+
+class _ProcessPartition:
+    """Partizione in un processo dedicato, pilotata su una `Pipe`."""
+
+    def __init__(self, ctx, *args):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_partition_process, args=(child, *args), daemon=True)
+        self.process.start()
+        child.close()
+
+    def send(self, message: tuple):
+        self.conn.send(message)
+
+    def recv(self):
+        try:
+            status, payload = self.conn.recv()
+        except (EOFError, OSError):
+            raise RuntimeError(f"Processo di partizione terminato (exit code {self.process.exitcode})")
+        if status == "error":
+            raise RuntimeError(f"Errore nel processo di partizione:\n{payload}")
+        return payload
+
+    def close(self):
+        self.conn.close()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+class PartitionedEngine(HAISimulatorEngine):
+    """
+    Coordinatore della run partizionata: stessa interfaccia di `HAISimulatorEngine` (log,
+    riepilogo, callback di `run`), con le visite simulate da `workers` partizioni. Con
+    `processes` (default se `workers` > 1) ogni partizione gira in un processo `spawn`.
+    """
+    engine_label = "Partitioned"
+
+    def __init__(self, scenario_dict: dict, log_level: str = "FULL", workers: Optional[int] = None, processes: Optional[bool] = None):
+        super().__init__(scenario_dict, log_level=log_level)
+        # Grafo di provenienza non disponibile: gli id dei nodi dipenderebbero dalla divisione
+        self.provenance = None
+        units = len(self.wards) + sum(1 for r in self.rooms.values() if r.ward is None)
+        self.workers = max(1, min(workers or PARTITION_WORKERS, units))
+        self.processes = self.workers > 1 if processes is None else processes
+        self.owner = plan_partitions(self, self.workers)
+        self.streams = [EntityStream(key) for key in entity_keys(_scenario_seed(scenario_dict), [a.id for a in self.staff_agents])]
+
+        room_index = {rid: i for i, rid in enumerate(self.rooms)}
+        patient_index = {pid: i for i, pid in enumerate(self.patients)}
+        self._part_patients = [
+            np.array([patient_index[p.id] for p in self.patients.values() if self.owner[p.room_id] == part], dtype=np.intp)
+            for part in range(self.workers)
+        ]
+        self._part_rooms = [
+            np.array([room_index[rid] for rid in self.rooms if self.owner[rid] == part], dtype=np.intp)
+            for part in range(self.workers)
+        ]
+        self._staff_index = {s.id: i for i, s in enumerate(self.staff_agents)}
+        self._initial_states = self._count_states()
+        # Codici delle stringhe di ogni partizione nel log unito e operatore di ogni codice
+        self._remaps: List[List[int]] = [[] for _ in range(self.workers)]
+        self._staff_of_code = [self._staff_index.get(s, -1) for s in self.event_log.strings]
+        # Cariche e fotogramma raccolti all'ultima fermata (None: si leggono le entità)
+        self._loads: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self._keyframe: Optional[dict] = None
+
+    def _make_clock(self, initial_time: float):
+        return HeapClock(initial_time)
+
+    def checkpoint(self) -> dict:
+        raise ValueError("Checkpoint non supportati dal backend PARTITIONED")
+
+    def restore(self, state: dict):
+        raise ValueError("Checkpoint non supportati dal backend PARTITIONED")
+
+    def advance_to(self, tick: float):
+        raise ValueError("advance_to non supportato dal backend PARTITIONED: usare run()")
+
+    # --- Letture durante la run (dalle fermate) ---
+
+    def _current_loads(self) -> Tuple[List[float], List[float]]:
+        if self._loads is None:
+            return super()._current_loads()
+        room_loads, hand_loads, _ = self._loads
+        return room_loads.tolist(), hand_loads.tolist()
+
+    def _patient_loads(self) -> List[float]:
+        if self._loads is None:
+            return super()._patient_loads()
+        return self._loads[2].tolist()
+
+    def keyframe(self) -> dict:
+        if self._keyframe is None:
+            return super().keyframe()
+        return self._keyframe
+
+    # --- Barriere ---
+
+    def _start_partitions(self) -> list:
+        args = (self.scenario, self.log_level, self.owner)
+        if not self.processes:
+            return [_LocalPartition(*args, part) for part in range(self.workers)]
+        # `spawn`: i processi non ereditano thread e connessioni del worker che li avvia
+        ctx = multiprocessing.get_context("spawn")
+        return [_ProcessPartition(ctx, *args, part) for part in range(self.workers)]
+
+    def _initial_entries(self) -> List[List[tuple]]:
+        """Ogni operatore parte nella partizione della stanza della sua prima visita."""
+        entries: List[List[tuple]] = [[] for _ in range(self.workers)]
+        all_rooms = list(self.rooms.keys())
+        for s, (agent, stream) in enumerate(zip(self.staff_agents, self.streams)):
+            words = stream.draws(0)
+            room_ids = self.wards[agent.ward] if agent.ward is not None else all_rooms
+            part = self.owner[room_ids[words[0] % len(room_ids)]]
+            entries[part].append((s, agent.load, agent.last_update, agent.room_id, 0, self.env.now + EntityStream.gap(words)))
+        return entries
+
+    def _barrier(self, parts: list, until: float, entries: List[List[tuple]], report: bool = False, keyframe: bool = False):
+        """Porta tutte le partizioni a `until` (in parallelo); ritorna gli operatori in transito e la prossima barriera."""
+        for part, incoming in zip(parts, entries):
+            part.send(("advance", until, incoming, report, keyframe))
+        replies = [part.recv() for part in parts]
+        self.env.now = until
+
+        entries = [[] for _ in parts]
+        departure = NEVER
+        for reply in replies:
+            departure = min(departure, reply["departure"])
+            for dest, entry, leave in reply["emigrants"]:
+                entries[dest].append(entry)
+                departure = min(departure, leave)
+        self.counters = {name: sum(r["counters"][name] for r in replies) for name in self.counters}
+        infections = self.counters["infections"]
+        self.state_counts = {
+            **self._initial_states,
+            "SUSCEPTIBLE": self._initial_states["SUSCEPTIBLE"] - infections,
+            "INFECTED": self._initial_states["INFECTED"] + infections,
+        }
+        if report:
+            self._merge_events([r["events"] for r in replies])
+            self._collect_snapshots([r["snapshot"] for r in replies], keyframe)
+        return entries, departure
+
+    def _merge_events(self, shipments: List[tuple]):
+        """Accoda al log gli eventi delle partizioni in ordine (tick, indice dell'operatore)."""
+        log = self.event_log
+        merged = [[] for _ in range(len(_LOG_COLUMNS) + 1)]
+        for remap, (strings, *columns) in zip(self._remaps, shipments):
+            for value in strings:
+                code = log.intern(value)
+                remap.append(code)
+                if code == len(self._staff_of_code):
+                    self._staff_of_code.append(self._staff_index.get(value, -1))
+            if not len(columns[0]):
+                continue
+            codes = np.asarray(remap, dtype=np.int32)
+            t = np.frombuffer(columns[0], dtype=np.float64)
+            kind = np.frombuffer(columns[1], dtype=np.uint8)
+            ids = [np.frombuffer(col, dtype=np.int32) for col in columns[2:]]
+            ids = [np.where(col >= 0, codes[np.maximum(col, 0)], NO_ID) for col in ids]
+            for target, values in zip(merged, [t, kind, *ids, np.asarray(self._staff_of_code)[ids[0]]]):
+                target.append(values)
+        if not merged[0]:
+            return
+        t, kind, agent, room, patient, result, staff = (np.concatenate(values) for values in merged)
+        # Ordinamento stabile: gli eventi di una visita restano contigui e nel loro ordine
+        order = np.lexsort((staff, t))
+        log.extend(t[order], kind[order], agent[order], room[order], patient[order], result[order])
+
+    def _collect_snapshots(self, snapshots: List[dict], keyframe: bool):
+        room_loads = np.zeros(len(self.rooms))
+        hand_loads = np.zeros(len(self.staff_agents))
+        patient_loads = np.zeros(len(self.patients))
+        for rooms, patients, snapshot in zip(self._part_rooms, self._part_patients, snapshots):
+            room_loads[rooms] = np.frombuffer(snapshot["rooms"], dtype=np.float64)
+            patient_loads[patients] = np.frombuffer(snapshot["patients_load"], dtype=np.float64)
+            for s, load in snapshot["hands"].items():
+                hand_loads[s] = load
+        self._loads = (room_loads, hand_loads, patient_loads)
+        if not keyframe:
+            return
+        patients, staff_rooms = {}, {}
+        for snapshot in snapshots:
+            patients.update(snapshot["patients"])
+            staff_rooms.update(snapshot["staff_rooms"])
+        self._keyframe = {
+            "tick": self.env.now,
+            "rooms": dict(zip(self.rooms, room_loads.tolist())),
+            "patients": {pid: patients[pid] for pid in self.patients},
+            "staff": {s.id: [staff_rooms[i], float(hand_loads[i])] for i, s in enumerate(self.staff_agents)},
+        }
+
+    def _finish(self, parts: list, entries: List[List[tuple]]):
+        """Stato finale delle entità, contatori e picchi riportati sul coordinatore."""
+        for part in parts:
+            part.send(("finish",))
+        finals = [part.recv() for part in parts]
+        for final in finals:
+            for rid, (load, last_update) in final["rooms"].items():
+                room = self.rooms[rid]
+                room.load, room.last_update = load, last_update
+            for pid, (p_state, load) in final["patients"].items():
+                pat = self.patients[pid]
+                pat.state, pat.load = p_state, load
+            for s, (load, last_update, room_id) in final["staff"].items():
+                agent = self.staff_agents[s]
+                agent.load, agent.last_update, agent.room_id = load, last_update, room_id
+        for incoming in entries:
+            for s, load, last_update, room_id, _, _ in incoming:
+                agent = self.staff_agents[s]
+                agent.load, agent.last_update, agent.room_id = load, last_update, room_id
+        self.infection_ticks = sorted(t for final in finals for t in final["infection_ticks"])
+        self.peak_room_load = max([self.peak_room_load] + [f["peaks"][0] for f in finals])
+        self.peak_hand_load = max([self.peak_hand_load] + [f["peaks"][1] for f in finals])
+        self.state_counts = self._count_states()
+        self._loads = None
+
+    def run(
+        self,
+        on_progress=None,
+        progress_interval: int = 100,
+        on_checkpoint=None,
+        checkpoint_interval: int = 0,
+        series_interval: int = 0,
+        on_keyframe=None,
+        keyframe_interval: int = 0,
+    ):
+        """
+        Come `HAISimulatorEngine.run`, con le partizioni avanzate a barriere; eventi, cariche e
+        contatori sono raccolti alle fermate dei callback. `on_checkpoint` è ignorato (nessun
+        checkpoint) e i timer di fase non sono disponibili: `profiler` viene azzerato.
+        """
+        self.profiler = None
+        print(f"[{self.engine_label} Engine] Starting scenario '{self.scenario['scenario_meta']['name']}' "
+              f"for {self.max_ticks} ticks on {self.workers} partitions...")
+        if on_keyframe is not None:
+            on_keyframe(self.keyframe())
+        if series_interval > 0:
+            self.series = TimeSeries(series_interval)
+            self._series_hygiene = (self.counters["hygiene_success"], self.counters["hygiene_fail"])
+            self._sample_series()
+
+        progress_interval = progress_interval if on_progress is not None else 0
+        keyframe_interval = keyframe_interval if on_keyframe is not None else 0
+        parts = self._start_partitions()
+        try:
+            # Barriera iniziale a tick corrente: ammette gli operatori e dà la prima uscita
+            entries, departure = self._barrier(parts, self.env.now, self._initial_entries())
+            check_interval = self.stop_check_ticks if self._stops_early() else 0
+            for stop in self._stop_ticks(progress_interval, series_interval, keyframe_interval, check_interval):
+                want_keyframe = bool(keyframe_interval) and stop % keyframe_interval == 0 and stop < self.max_ticks
+                until = min(stop, departure)
+                while until < stop:
+                    entries, departure = self._barrier(parts, until, entries)
+                    until = min(stop, departure)
+                entries, departure = self._barrier(parts, stop, entries, report=True, keyframe=want_keyframe)
+                if check_interval and stop % check_interval == 0 and stop < self.max_ticks:
+                    self.stop_reason = self._check_stop()
+                last = stop == self.max_ticks or self.stop_reason is not None
+                if want_keyframe and not last:
+                    on_keyframe(self.keyframe())
+                self._keyframe = None
+                if series_interval > 0 and (stop % series_interval == 0 or last):
+                    self._sample_series()
+                if on_progress is not None and (stop % progress_interval == 0 or last):
+                    on_progress(self.env.now)
+                if last:
+                    break
+            self._finish(parts, entries)
+        finally:
+            for part in parts:
+                part.close()
+
+        self.sync_loads()
+        self._end_run()
+        if self.log_level == "FULL":
+            return self.event_log
+        return self.summary()
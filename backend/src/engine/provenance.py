@@ -0,0 +1,196 @@
+"""
+Grafo di provenienza delle infezioni (tracciabilità, US-4.1).
+
+Il motore lo aggiorna durante la run invece di ricostruirlo a posteriori scorrendo il log.
+Ogni portatore di carica (mani di un operatore, stanza, paziente) punta al nodo da cui
+proviene la parte prevalente della sua carica:
+
+- INDEX: paziente infetto all'inizio della run (INHERITED: infetto al checkpoint da cui si
+  riprende senza stato di provenienza, es. checkpoint di una run a livello COUNTERS);
+- PICKUP: l'operatore raccoglie carica da una stanza o da un paziente;
+- DEPOSIT: l'operatore deposita carica in una stanza o su un paziente;
+- INFECTION: l'operatore infetta un paziente; il nodo registra anche le stanze visitate
+  dall'ultimo lavaggio riuscito e il tick di quel lavaggio.
+
+Un contatto diventa la nuova provenienza del portatore solo se vale almeno metà della sua
+carica subito dopo il contatto (e almeno `PROVENANCE_MIN_LOAD`): la regola segue da sola
+decadimento e lavaggi, senza pesare ogni contributo. I nodi puntano sempre a nodi precedenti,
+quindi la catena di un'infezione si percorre in tempo proporzionale alla sua profondità.
+
+Gli id dei nodi sono globali sulla storia della run: il checkpoint del motore include la
+provenienza corrente dei portatori (`state`) e il grafo ripreso da un checkpoint numera i
+nuovi nodi a partire da `base`. Un replay deterministico riproduce quindi gli stessi id della
+run di origine e un fork punta ai nodi della run madre (id < `base`): la catena prosegue nel
+grafo della madre (`walk` ritorna il nodo da cui continuare). Per lo stesso motivo il grafo
+è salvato completo, non solo nei nodi raggiungibili dalle infezioni della run.
+"""
+import json
+import zlib
+from array import array
+from collections import defaultdict, deque
+from typing import Dict, List, Optional, Tuple
+
+INDEX, INFECTION, PICKUP, DEPOSIT, INHERITED = range(5)
+NODE_KINDS = ("INDEX", "INFECTION", "PICKUP", "DEPOSIT", "INHERITED")
+NO_NODE = -1
+
+PROVENANCE_MIN_LOAD = 1.0 # Contatti sotto questa carica non cambiano la provenienza
+PROVENANCE_TRAIL = 32 # Stanze dall'ultimo lavaggio conservate per operatore
+_COLUMNS = (("kind", "B"), ("t", "d"), ("actor", "i"), ("place", "i"), ("parent", "i"))
+
+
+class ProvenanceGraph:
+    """Nodi colonnari (tipo, tick, operatore, luogo, nodo padre) e provenienza corrente dei portatori."""
+
+    def __init__(self, base: int = 0):
+        self.base = base # Id del primo nodo di questo grafo (i precedenti stanno nella run di origine)
+        self.kind = array("B")
+        self.t = array("d")
+        self.actor = array("i")
+        self.place = array("i")
+        self.parent = array("i")
+        self.strings: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self.infections: Dict[str, int] = {} # paziente -> nodo INDEX/INFECTION/INHERITED
+        self.details: Dict[int, dict] = {} # nodo INFECTION -> stanze dall'ultimo lavaggio
+        # Provenienza corrente della carica di mani, stanze e pazienti
+        self.hands: Dict[str, int] = {}
+        self.rooms: Dict[str, int] = {}
+        self.patients: Dict[str, int] = {}
+        # Stanze visitate dall'ultimo lavaggio riuscito e tick del lavaggio, per operatore
+        # (aggiornate direttamente dalla visita del motore)
+        self.trails = defaultdict(lambda: deque(maxlen=PROVENANCE_TRAIL))
+        self.washed_at: Dict[str, float] = {}
+
+    def _intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_NODE
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def _node(self, kind: int, t: float, actor: Optional[str], place: str, parent: int) -> int:
+        self.kind.append(kind)
+        self.t.append(t)
+        self.actor.append(self._intern(actor))
+        self.place.append(self._intern(place))
+        self.parent.append(parent)
+        return self.base + len(self.kind) - 1
+
+    # --- Aggiornamenti dal motore ---
+
+    def origin(self, patient_id: str, t: float, kind: int = INDEX):
+        """Paziente già infetto (inizio run o checkpoint di ripresa)."""
+        node = self._node(kind, t, None, patient_id, NO_NODE)
+        self.infections[patient_id] = self.patients[patient_id] = node
+
+    def exchange(self, t: float, staff_id: str, place_id: str, carriers: Dict[str, int], picked: bool, dropped: bool):
+        """
+        Contatto mani <-> luogo (stanza o paziente, `carriers` è la mappa corrispondente):
+        `picked`/`dropped` indicano se raccolta e deposito sono prevalenti. Entrambi usano la
+        provenienza precedente al contatto.
+        """
+        hand = self.hands.get(staff_id, NO_NODE)
+        source = carriers.get(place_id, NO_NODE)
+        if picked and source != NO_NODE:
+            self.hands[staff_id] = self._node(PICKUP, t, staff_id, place_id, source)
+        if dropped and hand != NO_NODE:
+            carriers[place_id] = self._node(DEPOSIT, t, staff_id, place_id, hand)
+
+    def infect(self, t: float, staff_id: str, patient_id: str):
+        node = self._node(INFECTION, t, staff_id, patient_id, self.hands.get(staff_id, NO_NODE))
+        self.details[node] = {"rooms_since_wash": list(self.trails[staff_id]), "last_wash_tick": self.washed_at.get(staff_id)}
+        self.infections[patient_id] = self.patients[patient_id] = node
+
+    # --- Checkpoint ---
+
+    def state(self) -> dict:
+        """Provenienza corrente dei portatori e tracce di lavaggio, serializzabile in JSON."""
+        # Chiavi ordinate: lo stesso stato dà lo stesso JSON anche dopo un restore
+        return {
+            "next": self.base + len(self.kind),
+            "infections": dict(sorted(self.infections.items())),
+            "hands": dict(sorted(self.hands.items())),
+            "rooms": dict(sorted(self.rooms.items())),
+            "patients": dict(sorted(self.patients.items())),
+            "trails": {sid: list(trail) for sid, trail in sorted(self.trails.items()) if trail},
+            "washed_at": dict(sorted(self.washed_at.items())),
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "ProvenanceGraph":
+        """Grafo vuoto che riprende da `state`: i nodi esistenti restano nel grafo di origine."""
+        graph = cls(base=state["next"])
+        graph.infections = dict(state["infections"])
+        graph.hands = dict(state["hands"])
+        graph.rooms = dict(state["rooms"])
+        graph.patients = dict(state["patients"])
+        for sid, rooms in state["trails"].items():
+            graph.trails[sid].extend(rooms)
+        graph.washed_at = dict(state["washed_at"])
+        return graph
+
+    # --- Lettura ---
+
+    def __len__(self) -> int:
+        return len(self.kind)
+
+    def walk(self, node: int) -> Tuple[List[dict], Optional[int]]:
+        """
+        Passi della catena da `node` all'origine dentro questo grafo. Il secondo valore è il
+        nodo da cui proseguire nel grafo della run di origine (None se la catena è completa).
+        """
+        s = self.strings
+        chain = []
+        while node >= self.base:
+            i = node - self.base
+            kind = self.kind[i]
+            actor, place = self.actor[i], self.place[i]
+            step = {"type": NODE_KINDS[kind], "t": self.t[i]}
+            if kind == INFECTION:
+                step.update({"staff": s[actor], "patient": s[place], **self.details[node]})
+            elif kind == PICKUP:
+                step.update({"staff": s[actor], "from": s[place]})
+            elif kind == DEPOSIT:
+                step.update({"staff": s[actor], "into": s[place]})
+            else:
+                step["patient"] = s[place]
+            chain.append(step)
+            node = self.parent[i]
+        return chain, (node if node != NO_NODE else None)
+
+    def trace(self, patient_id: str) -> Optional[List[dict]]:
+        """Catena di trasmissione dall'infezione del paziente all'origine (None se mai infetto)."""
+        node = self.infections.get(patient_id)
+        if node is None:
+            return None
+        return self.walk(node)[0]
+
+    # --- Serializzazione ---
+
+    def to_blobs(self) -> dict:
+        """Colonne dei nodi compresse più metadati JSON (base, stringhe, infezioni, dettagli)."""
+        blobs = {name: zlib.compress(getattr(self, name).tobytes(), 6) for name, _ in _COLUMNS}
+        meta = {
+            "base": self.base,
+            "strings": self.strings,
+            "infections": self.infections,
+            "details": {str(node): d for node, d in self.details.items()},
+        }
+        blobs["meta"] = zlib.compress(json.dumps(meta, separators=(",", ":")).encode("utf-8"), 6)
+        return blobs
+
+    @classmethod
+    def from_blobs(cls, blobs: Dict[str, bytes]) -> "ProvenanceGraph":
+        meta = json.loads(zlib.decompress(blobs["meta"]).decode("utf-8"))
+        graph = cls(base=meta["base"])
+        for name, typecode in _COLUMNS:
+            column = array(typecode)
+            column.frombytes(zlib.decompress(blobs[name]))
+            setattr(graph, name, column)
+        graph.strings = meta["strings"]
+        graph.infections = meta["infections"]
+        graph.details = {int(node): d for node, d in meta["details"].items()}
+        return graph
@@ -0,0 +1,345 @@
+"""
+Analisi di sensibilità a varianza ridotta sui parametri di scenario.
+
+- i parametri sono intervalli su path puntati dello scenario (come nelle sweep, es.
+  `hygiene.base_compliance` in [0.4, 0.9] o `staffing.CLEANER.count` in [1, 4] interi), campionati
+  con disegni Latin hypercube (`latin_hypercube`): un punto per strato in ogni dimensione;
+- numeri casuali comuni (CRN): la replica r di ogni punto usa lo stesso seed e il backend
+  PARTITIONED (`sweep.cell_tasks(crn=True)`), i cui stream sono per operatore e per visita. Due
+  scenari vicini vedono le stesse scelte di stanza e le stesse estrazioni, quindi le differenze
+  tra punti sono appaiate e gran parte del rumore si cancella;
+- indici globali: Sobol (primo ordine e totale, stimatori di Saltelli e Jansen sulle matrici
+  A, B e A_B^i) e Morris (effetti elementari su disegno radiale: mu, mu*, sigma);
+- confronto tra interventi (`compare_arms`): differenza appaiata di ogni braccio dal primo, con
+  intervallo di confidenza ed esito.
+
+Ogni report riporta la riduzione di varianza ottenuta sulle coppie di run confrontate dagli
+stimatori (`variance_reduction`): varianza della differenza con seed indipendenti (somma delle
+varianze dei due punti) diviso varianza della differenza appaiata. Un fattore k vuol dire che con
+seed indipendenti servirebbero k volte le simulazioni per la stessa precisione.
+"""
+import argparse
+import json
+import math
+from concurrent.futures import Executor
+from statistics import fmean, stdev, variance
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .sweep import SUMMARY_FIELDS, cell_key, cell_tasks, run_sweep, t_quantile
+
+METHODS = ("SOBOL", "MORRIS")
+
+# Passo del disegno radiale di Morris nello spazio unitario (metà dell'intervallo di ogni parametro)
+MORRIS_DELTA = 0.5
+
+
+def latin_hypercube(n: int, d: int, rng: np.random.Generator) -> np.ndarray:
+    """`n` punti in [0, 1)^d: in ogni dimensione esattamente un punto in ciascuno degli `n` strati."""
+    strata = np.argsort(rng.random((n, d)), axis=0)
+    return (strata + rng.random((n, d))) / n
+
+
+def scale_points(unit: np.ndarray, parameters: List[dict]) -> List[Dict[str, Any]]:
+    """
+    Override di scenario dei punti `unit` (righe in [0, 1)^d): ogni coordinata va sull'intervallo
+    [low, high] del parametro; per i parametri interi ogni valore copre una frazione uguale.
+    """
+    points = []
+    for row in unit:
+        point = {}
+        for u, p in zip(row, parameters):
+            low, high = p["low"], p["high"]
+            if p.get("integer"):
+                point[p["path"]] = min(int(math.floor(low + u * (high - low + 1))), int(high))
+            else:
+                point[p["path"]] = float(low + u * (high - low))
+        points.append(point)
+    return points
+
+
+def saltelli_design(n: int, d: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, List[np.ndarray]]:
+    """Matrici A e B (un unico Latin hypercube in 2d dimensioni) e A_B^i: A con la colonna i presa da B."""
+    ab = latin_hypercube(n, 2 * d, rng)
+    a, b = ab[:, :d], ab[:, d:]
+    abs_ = []
+    for i in range(d):
+        m = a.copy()
+        m[:, i] = b[:, i]
+        abs_.append(m)
+    return a, b, abs_
+
+
+def sobol_indices(f_a: Sequence[float], f_b: Sequence[float], f_ab: Sequence[Sequence[float]]) -> Tuple[List[float], List[float]]:
+    """
+    Indici di primo ordine (Saltelli 2010) e totali (Jansen) dalle uscite su A, B e A_B^i.
+    Con uscita costante gli indici sono nulli.
+    """
+    f_a, f_b = np.asarray(f_a, dtype=float), np.asarray(f_b, dtype=float)
+    var = float(np.var(np.concatenate([f_a, f_b]), ddof=1))
+    if var <= 0.0:
+        return [0.0] * len(f_ab), [0.0] * len(f_ab)
+    first, total = [], []
+    for f_i in f_ab:
+        f_i = np.asarray(f_i, dtype=float)
+        first.append(float(np.mean(f_b * (f_i - f_a)) / var))
+        total.append(float(0.5 * np.mean((f_a - f_i) ** 2) / var))
+    return first, total
+
+
+def morris_design(r: int, d: int, rng: np.random.Generator, delta: float = MORRIS_DELTA) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Disegno radiale: `r` punti base da un Latin hypercube e, per ogni dimensione, il passo ±`delta`
+    che resta in [0, 1). Ritorna punti base e passi (r x d).
+    """
+    base = latin_hypercube(r, d, rng)
+    steps = np.where(base + delta < 1.0, delta, -delta)
+    return base, steps
+
+
+def morris_points(base: np.ndarray, steps: np.ndarray) -> List[np.ndarray]:
+    """Punti del disegno radiale, per ogni base: la base e poi uno spostamento per dimensione."""
+    points = []
+    for x, step in zip(base, steps):
+        points.append(x)
+        for i in range(len(x)):
+            moved = x.copy()
+            moved[i] += step[i]
+            points.append(moved)
+    return points
+
+
+def morris_effects(f_base: Sequence[float], f_moved: Sequence[Sequence[float]], steps: np.ndarray) -> Dict[str, List[float]]:
+    """
+    Statistiche degli effetti elementari (variazione dell'uscita sull'intero intervallo del
+    parametro): media `mu`, media dei moduli `mu_star`, deviazione standard `sigma`.
+    """
+    effects = (np.asarray(f_moved, dtype=float) - np.asarray(f_base, dtype=float)[:, None]) / steps
+    return {
+        "mu": [float(v) for v in effects.mean(axis=0)],
+        "mu_star": [float(v) for v in np.abs(effects).mean(axis=0)],
+        "sigma": [float(v) for v in (effects.std(axis=0, ddof=1) if len(effects) > 1 else np.zeros(effects.shape[1]))],
+    }
+
+
+def variance_reduction(pairs: Iterable[Tuple[Sequence[float], Sequence[float]]]) -> Dict[str, Any]:
+    """
+    Riduzione di varianza sulle coppie (repliche del punto a, repliche del punto b), allineate per
+    replica: somma delle varianze indipendenti (var a + var b) e delle varianze appaiate var(b - a).
+    `factor` è None se non è stimabile (meno di due repliche, uscite costanti o differenze identiche).
+    """
+    independent = paired = 0.0
+    for a, b in pairs:
+        if len(a) < 2:
+            continue
+        independent += variance(a) + variance(b)
+        paired += variance([y - x for x, y in zip(a, b)])
+    factor = independent / paired if independent > 0.0 and paired > 0.0 else None
+    return {"factor": factor, "independent_variance": independent, "paired_variance": paired}
+
+
+def _evaluate(
+    base_scenario: dict,
+    points: List[Dict[str, Any]],
+    replicates: int,
+    metric: str,
+    crn: bool,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> Tuple[List[List[float]], int]:
+    """Valori di `metric` per punto e replica; i punti ripetuti sono simulati una volta sola."""
+    tasks, seen = [], set()
+    for point in points:
+        for t in cell_tasks(base_scenario, point, range(replicates), crn):
+            if t["task_key"] not in seen:
+                seen.add(t["task_key"])
+                tasks.append(t)
+    values: Dict[str, Dict[int, float]] = {}
+    for row in run_sweep(tasks, max_workers=max_workers, executor=executor):
+        values.setdefault(row["cell_key"], {})[row["replicate"]] = float(row[metric])
+    return [[values[cell_key(p)][rep] for rep in range(replicates)] for p in points], len(tasks)
+
+
+def _check_metric(metric: str):
+    if metric not in SUMMARY_FIELDS:
+        raise ValueError(f"Metrica non valida: {metric} (ammesse: {', '.join(SUMMARY_FIELDS)})")
+
+
+def _reduction_report(pairs: List[Tuple[List[float], List[float]]], simulations: int, crn: bool) -> Dict[str, Any]:
+    reduction = variance_reduction(pairs)
+    factor = reduction["factor"]
+    reduction["crn"] = crn
+    # Simulazioni con seed indipendenti per la stessa precisione sulle differenze
+    reduction["equivalent_simulations"] = round(simulations * factor) if factor is not None else None
+    return reduction
+
+
+def run_sensitivity(
+    base_scenario: dict,
+    parameters: List[dict],
+    method: str = "SOBOL",
+    samples: int = 32,
+    replicates: int = 2,
+    metric: str = "attack_rate",
+    crn: bool = True,
+    seed: int = 0,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    delta: float = MORRIS_DELTA,
+) -> Dict[str, Any]:
+    """
+    Analisi di sensibilità globale di `metric` sui `parameters` ({path, low, high, integer}).
+    SOBOL simula `samples` x (d + 2) punti, MORRIS `samples` traiettorie radiali da d + 1 punti
+    con passo `delta`; ogni punto ha `replicates` repliche (la loro media entra negli indici,
+    almeno due per stimare la riduzione di varianza). Con passi piccoli le coppie appaiate
+    restano vicine e i numeri casuali comuni tolgono più rumore.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Metodo non valido: {method} (ammessi: {', '.join(METHODS)})")
+    _check_metric(metric)
+    if not parameters:
+        raise ValueError("Nessun parametro da analizzare")
+    d = len(parameters)
+    rng = np.random.default_rng(seed)
+
+    if method == "SOBOL":
+        a, b, abs_ = saltelli_design(samples, d, rng)
+        unit = [a, b] + abs_
+        points = scale_points(np.concatenate(unit), parameters)
+    else:
+        base, steps = morris_design(samples, d, rng, delta)
+        points = scale_points(np.array(morris_points(base, steps)), parameters)
+    values, simulations = _evaluate(base_scenario, points, replicates, metric, crn, max_workers, executor)
+    means = [fmean(v) for v in values]
+
+    indices = []
+    if method == "SOBOL":
+        n = samples
+        f_a, f_b = means[:n], means[n:2 * n]
+        f_ab = [means[(2 + i) * n:(3 + i) * n] for i in range(d)]
+        first, total = sobol_indices(f_a, f_b, f_ab)
+        for p, s1, st in zip(parameters, first, total):
+            indices.append({"path": p["path"], "S1": s1, "ST": st})
+        # Coppie confrontate dagli stimatori: A_j e A_B^i_j differiscono solo nel parametro i
+        pairs = [(values[j], values[(2 + i) * n + j]) for i in range(d) for j in range(n)]
+    else:
+        stride = d + 1
+        f_base = [means[k * stride] for k in range(samples)]
+        f_moved = [means[k * stride + 1:(k + 1) * stride] for k in range(samples)]
+        effects = morris_effects(f_base, f_moved, steps)
+        for i, p in enumerate(parameters):
+            indices.append({"path": p["path"], **{stat: effects[stat][i] for stat in ("mu", "mu_star", "sigma")}})
+        pairs = [(values[k * stride], values[k * stride + 1 + i]) for k in range(samples) for i in range(d)]
+
+    return {
+        "method": method,
+        "metric": metric,
+        "parameters": parameters,
+        "samples": samples,
+        "replicates": replicates,
+        "simulations": simulations,
+        "output_mean": fmean(means),
+        "output_variance": variance(means) if len(means) > 1 else 0.0,
+        "indices": indices,
+        "variance_reduction": _reduction_report(pairs, simulations, crn),
+    }
+
+
+def compare_arms(
+    base_scenario: dict,
+    arms: Dict[str, Dict[str, Any]],
+    replicates: int = 10,
+    metric: str = "attack_rate",
+    crn: bool = True,
+    confidence: float = 0.95,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> Dict[str, Any]:
+    """
+    Confronto tra interventi (bracci = override di scenario, il primo è il riferimento): per ogni
+    braccio la differenza media appaiata per replica da quello di riferimento, con intervallo di
+    confidenza (t di Student) ed esito HIGHER/LOWER se l'intervallo esclude lo zero.
+    """
+    _check_metric(metric)
+    if len(arms) < 2:
+        raise ValueError("Servono almeno due bracci da confrontare")
+    if replicates < 2:
+        raise ValueError("Servono almeno due repliche per braccio")
+    names = list(arms)
+    values, simulations = _evaluate(base_scenario, [arms[name] for name in names], replicates, metric, crn, max_workers, executor)
+    reference = values[0]
+    t = t_quantile(0.5 + confidence / 2.0, replicates - 1)
+
+    comparisons = []
+    for name, arm_values in zip(names[1:], values[1:]):
+        diffs = [y - x for x, y in zip(reference, arm_values)]
+        mean = fmean(diffs)
+        half_width = t * stdev(diffs) / math.sqrt(replicates)
+        decision = "HIGHER" if mean - half_width > 0 else "LOWER" if mean + half_width < 0 else "UNDECIDED"
+        reduction = _reduction_report([(reference, arm_values)], 2 * replicates, crn)
+        comparisons.append({
+            "arm": name,
+            "reference": names[0],
+            "mean_difference": mean,
+            "half_width": half_width,
+            "decision": decision,
+            "variance_reduction": reduction,
+        })
+
+    return {
+        "metric": metric,
+        "replicates": replicates,
+        "confidence": confidence,
+        "simulations": simulations,
+        "arms": [
+            {"arm": name, "overrides": arms[name], "mean": fmean(v), "stdev": stdev(v)}
+            for name, v in zip(names, values)
+        ],
+        "comparisons": comparisons,
+        "variance_reduction": _reduction_report([(reference, v) for v in values[1:]], simulations, crn),
+    }
+
+
+def _parse_parameter_arg(item: str) -> dict:
+    """path=low:high oppure path=low:high:int"""
+    path, _, bounds = item.partition("=")
+    parts = bounds.split(":")
+    return {"path": path, "low": float(parts[0]), "high": float(parts[1]), "integer": len(parts) > 2 and parts[2] == "int"}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Analisi di sensibilità (Sobol/Morris) o confronto tra interventi con numeri casuali comuni")
+    parser.add_argument("scenario", help="File JSON di scenario base")
+    parser.add_argument("--param", action="append", default=[], help="path=low:high[:int] (es. hygiene.base_compliance=0.4:0.9)")
+    parser.add_argument("--arm", action="append", default=[], help="nome={override JSON} per il confronto (il primo è il riferimento)")
+    parser.add_argument("--method", choices=METHODS, default="SOBOL")
+    parser.add_argument("--samples", type=int, default=32)
+    parser.add_argument("--replicates", type=int, default=None)
+    parser.add_argument("--metric", default="attack_rate")
+    parser.add_argument("--no-crn", action="store_true", help="Seed indipendenti per punto (riferimento per la riduzione di varianza)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed del campionamento")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from .models import ScenarioInput
+
+    with open(args.scenario) as f:
+        base = ScenarioInput(**json.load(f)).model_dump()
+    if args.arm:
+        arms = {}
+        for item in args.arm:
+            name, _, overrides = item.partition("=")
+            arms[name] = json.loads(overrides or "{}")
+        report = compare_arms(base, arms, args.replicates or 10, args.metric, not args.no_crn, max_workers=args.workers)
+    else:
+        parameters = [_parse_parameter_arg(item) for item in args.param]
+        report = run_sensitivity(
+            base, parameters, args.method, args.samples, args.replicates or 2, args.metric,
+            not args.no_crn, args.seed, args.workers,
+        )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
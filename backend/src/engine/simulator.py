@@ -1,17 +1,78 @@
+import math
 import simpy
 import random
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Sequence, Tuple
 from pydantic import BaseModel
 
+from .eventlog import EventLog
+from .provenance import INDEX, INHERITED, PROVENANCE_MIN_LOAD, ProvenanceGraph
+from .timeseries import TimeSeries
+from .models import RunSummary
+
+# Livelli di log: FULL (tutti gli eventi), EPIDEMIC_ONLY (solo START/INFECTION/END),
+# COUNTERS (nessun evento, solo contatori e accumulatori interni)
+LOG_LEVELS = ("FULL", "EPIDEMIC_ONLY", "COUNTERS")
+
+# Modalità di decadimento:
+# STEPWISE (default) - processo globale che a ogni tick moltiplica le cariche > 0.01 per il fattore a scalini
+# LAZY  - stessi fattori a scalini, applicati in forma chiusa solo quando l'entità viene toccata
+# EXACT - decadimento esponenziale continuo 2^(-dt/emivita), applicato al contatto
+DECAY_MODES = ("STEPWISE", "LAZY", "EXACT")
+DECAY_THRESHOLD = 0.01 # Sotto questa carica il modello a scalini smette di decadere
+LN2 = math.log(2.0)
+
+# Frazione della carica delle mani depositata su un paziente a ogni contatto e deposito minimo
+# che può infettarlo (vedi `_cross_contaminate` e `is_absorbed`)
+PATIENT_DROP_FRACTION = 0.10
+INFECTION_MIN_DROP = 10.0
+
+# Versione del motore: da incrementare a ogni modifica che cambia gli eventi prodotti a parità
+# di scenario e seed (invalida la cache delle run, vedi `run_cache`)
+ENGINE_VERSION = "1.3"
+
+DECAY = -1 # Voce della schedule del decadimento globale (gli agenti sono indicizzati da 0)
+CHECKPOINT_VERSION = 1
+
+
+def stepwise_decay(load: float, factor: float, steps: int) -> float:
+    """
+    Equivalente in forma chiusa di `steps` tick di `_decay_process` su una carica:
+    si moltiplica per `factor` finché la carica resta sopra `DECAY_THRESHOLD`.
+    Coincide con il ciclo a meno dell'arrotondamento di `factor ** k` (~1e-15 relativo).
+    """
+    if steps <= 0 or load <= DECAY_THRESHOLD:
+        return load
+    if factor <= 0.0:
+        return 0.0
+    # Numero di moltiplicazioni finché la carica scende a soglia, corretto per l'arrotondamento del log
+    k = min(steps, max(1, math.ceil(math.log(DECAY_THRESHOLD / load) / math.log(factor))))
+    while k < steps and load * factor ** k > DECAY_THRESHOLD:
+        k += 1
+    while k > 1 and load * factor ** (k - 1) <= DECAY_THRESHOLD:
+        k -= 1
+    return load * factor ** k
+
+class SimulationCancelled(Exception):
+    """Sollevata dal callback di avanzamento per interrompere una run in corso."""
+
+
 # --- Entità Interne del Motore ---
 
+# Entità con `__slots__`: niente `__dict__` per istanza, footprint ridotto su migliaia di letti
+
 class RoomEntity:
-    def __init__(self, room_id: str, r_type: str, env_load: float = 0.0):
+    __slots__ = ("id", "type", "load", "ward", "last_update")
+
+    def __init__(self, room_id: str, r_type: str, env_load: float = 0.0, ward: Optional[str] = None):
         self.id = room_id
         self.type = r_type
         self.load = env_load
+        self.ward = ward
+        self.last_update = 0.0 # Tick a cui `load` è aggiornata (decadimento LAZY/EXACT)
         
 class PatientEntity:
+    __slots__ = ("id", "room_id", "state", "susceptibility", "load", "is_isolated")
+
     def __init__(self, pat_id: str, room_id: str, state: str, susceptibility: float, viral_load: float, is_isolated: bool):
         self.id = pat_id
         self.room_id = room_id
@@ -21,19 +82,30 @@ class PatientEntity:
         self.is_isolated = is_isolated
 
 class StaffEntity:
-    def __init__(self, staff_id: str, role: str, compliance_mod: float, cleaning_eff: Optional[float]):
+    __slots__ = ("id", "role", "compliance_modifier", "cleaning_efficacy", "load", "ward", "last_update", "room_id")
+
+    def __init__(self, staff_id: str, role: str, compliance_mod: float, cleaning_eff: Optional[float], ward: Optional[str] = None):
         self.id = staff_id
         self.role = role
         self.compliance_modifier = compliance_mod
         self.cleaning_efficacy = cleaning_eff
         self.load = 0.0 # Carica patogena sulle mani
-
+        self.ward = ward
+        self.last_update = 0.0
+        self.room_id: Optional[str] = None # Ultima stanza visitata
 
 # --- Motore Principale SimPy ---
 
 class HAISimulatorEngine:
-    def __init__(self, scenario_dict: dict):
+    engine_label = "SimPy"
+
+    def __init__(self, scenario_dict: dict, log_level: str = "FULL"):
+        if log_level not in LOG_LEVELS:
+            raise ValueError(f"log_level non valido: {log_level} (ammessi: {', '.join(LOG_LEVELS)})")
         self.scenario = scenario_dict
+        self.log_level = log_level
+        self._log_visits = log_level == "FULL"
+        self._log_epidemic = log_level != "COUNTERS"
         
         # Estrai Metadata
         seed = self.scenario["scenario_meta"].get("seed", 42)
@@ -52,38 +124,124 @@ class HAISimulatorEngine:
         self.gel_reduction = h_cfg.get("gel_log_reduction", 0.99)
         self.iso_modifier = h_cfg.get("isolation_modifier", 1.5)
 
+        # Decadimento: emivite in tick e fattori a scalini calcolati una volta sola
+        self.decay_mode = self.scenario["simulation"].get("decay_mode", "STEPWISE")
+        if self.decay_mode not in DECAY_MODES:
+            raise ValueError(f"decay_mode non valido: {self.decay_mode} (ammessi: {', '.join(DECAY_MODES)})")
+        self._lazy_decay = self.decay_mode != "STEPWISE"
+        # Superfici: emivita in ore, quindi in tick = HalfLifeH * 60 / TickM
+        self.surface_half_life_ticks = self.decay_surface * 60.0 / self.tick_unit_m
+        self.hands_half_life_ticks = self.decay_hands / self.tick_unit_m
+        # Formula semplificata per diminuzione logaritmica a scalini
+        self.surface_decay_factor = max(0, 1.0 - (0.693 / self.surface_half_life_ticks))
+        self.hands_decay_factor = max(0, 1.0 - (0.693 / self.hands_half_life_ticks))
+
         self.rng = random.Random(seed)
-        self.env = simpy.Environment()
-        self.event_log: List[dict] = []
+        self.env = self._make_clock(0)
+        self.event_log = EventLog()
+        self.log_cursor = 0 # Eventi già emessi prima di questo EventLog (run ripristinate da checkpoint)
         
         # Mappe di stato
         self.rooms: Dict[str, RoomEntity] = {}
         self.patients: Dict[str, PatientEntity] = {}
         self.staff_agents: List[StaffEntity] = []
+        self.wards: Dict[str, List[str]] = {} # ward id -> room ids
+        self.room_patients: Dict[str, Tuple[PatientEntity, ...]] = {} # indice stanza -> occupanti
+
+        # Contatori e accumulatori (sempre attivi, sostituiscono gli eventi per-visita)
+        self.counters = {"visits": 0, "cleanings": 0, "hygiene_success": 0, "hygiene_fail": 0, "infections": 0}
+        self.infection_ticks: List[float] = []
+        self.peak_room_load = 0.0
+        self.peak_hand_load = 0.0
 
         self._initialize_from_config()
+        self._intern_codes()
+
+        # Grafo di provenienza delle infezioni (assente a livello COUNTERS, vedi `provenance`)
+        self.provenance: Optional[ProvenanceGraph] = None
+        if self._log_epidemic:
+            self._init_provenance(0.0)
+
+        # Pazienti per stato clinico (aggiornato a ogni infezione) e serie temporali opzionali
+        self.state_counts = self._count_states()
+        self.series: Optional[TimeSeries] = None
+        self._series_hygiene = (0, 0)
+
+        # Schedule: voci iniziali (tick, chi) con tick None = primo delay estratto allo start,
+        # e prossimo risveglio pendente di ogni processo con il suo numero d'ordine `seq`
+        self._startup: List[Tuple[Optional[float], int]] = ([] if self._lazy_decay else [(1.0, DECAY)]) + [
+            (None, k) for k in range(len(self.staff_agents))
+        ]
+        self._scheduled = False
+        self._seq = 0
+        self._pending: Dict[int, Tuple[float, int]] = {}
+
+        # Strumentazione opzionale (timer per fase e contatori, vedi `instrumentation`)
+        self.profiler = None
+
+        # Arresto anticipato (vedi `_check_stop`): regole dello scenario più una condizione
+        # opzionale da codice, `stop_condition(engine) -> motivo | None`
+        sim_cfg = self.scenario["simulation"]
+        self.early_stop = sim_cfg.get("early_stop", False)
+        self.stop_when: Dict[str, float] = dict(sim_cfg.get("stop_when") or {})
+        self.stop_check_ticks = sim_cfg.get("stop_check_ticks", 50)
+        self.stop_condition: Optional[Callable[["HAISimulatorEngine"], Optional[str]]] = None
+        self.stop_reason: Optional[str] = None
+
+    def _count_states(self) -> Dict[str, int]:
+        counts = {"SUSCEPTIBLE": 0, "COLONIZED": 0, "INFECTED": 0, "RECOVERED": 0}
+        for p in self.patients.values():
+            counts[p.state] = counts.get(p.state, 0) + 1
+        return counts
+
+    def _init_provenance(self, tick: float, kind: int = INDEX):
+        """Nuovo grafo con i pazienti già portatori come origini (INHERITED se si riprende da checkpoint)."""
+        self.provenance = ProvenanceGraph()
+        for p in self.patients.values():
+            if p.state != "SUSCEPTIBLE" and p.load > 0:
+                self.provenance.origin(p.id, tick, kind)
+
+    def _make_clock(self, initial_time: float):
+        return simpy.Environment(initial_time=initial_time)
+
+    def _intern_codes(self):
+        # Codici internati dell'EventLog per il hot path
+        self._room_codes = {rid: self.event_log.intern(rid) for rid in self.rooms}
+        self._result_codes = {r: self.event_log.intern(r) for r in (
+            "WASH_IN_SUCCESS", "WASH_IN_FAIL", "WASH_OUT_SUCCESS", "WASH_OUT_FAIL", "DIRECT_HANDS"
+        )}
 
     def log_event(self, event_type: str, message: str, tick: float = None, **kwargs):
+        """Evento generico; gli eventi frequenti usano i metodi tipizzati di `EventLog`."""
+        if not self._log_epidemic:
+            return
         t = tick if tick is not None else self.env.now
-        log_entry = {
-            "t": round(t, 2),
-            "type": event_type,
-            "msg": message,
-            **kwargs
-        }
-        self.event_log.append(log_entry)
+        self.event_log.add(t, event_type, message, **kwargs)
 
     def _initialize_from_config(self):
         """Popola i nodi (Stanze, Pazienti, Staff) validati dal JSON"""
         # 1. Stanze
         hosp = self.scenario.get("hospital", {})
         num_rooms = hosp.get("rooms", 0)
-        iso_ids = hosp.get("isolation_ids", [])
+        iso_ids = set(hosp.get("isolation_ids", []))
         
         for i in range(1, num_rooms + 1):
             rid = f"R_{i:02d}"
             rtype = "ISOLATION" if rid in iso_ids else "SINGLE"
             self.rooms[rid] = RoomEntity(rid, rtype)
+
+        # 1b. Reparti: stanze raggruppate `<ward>_R_<nn>`
+        for w_data in hosp.get("wards", []):
+            wid = w_data["id"]
+            ward_iso = set(w_data.get("isolation_ids", []))
+            iso_ids |= ward_iso
+            ward_rooms = []
+            for i in range(1, w_data.get("rooms", 0) + 1):
+                rid = f"{wid}_R_{i:02d}"
+                rtype = "ISOLATION" if rid in ward_iso else w_data.get("room_type", "SINGLE")
+                self.rooms[rid] = RoomEntity(rid, rtype, ward=wid)
+                ward_rooms.append(rid)
+            self.wards[wid] = ward_rooms
             
         # 2. Pazienti
         for p_data in self.scenario.get("patients", []):
@@ -101,39 +259,95 @@ class HAISimulatorEngine:
                 is_isolated=p_data.get("is_isolated", rid in iso_ids)
             )
             self.patients[pid] = pat
+
+        # Indice stanza -> pazienti (anche stanze DOUBLE con più occupanti), O(1) per visita
+        occupants: Dict[str, List[PatientEntity]] = {}
+        for pat in self.patients.values():
+            occupants.setdefault(pat.room_id, []).append(pat)
+        self.room_patients = {rid: tuple(occupants.get(rid, ())) for rid in self.rooms}
             
         # 3. Staff
+        staff_counters: Dict[Tuple[Optional[str], str], int] = {}
         for s_data in self.scenario.get("staffing", []):
             role = s_data["role"]
-            for i in range(s_data.get("count", 1)):
-                sid = f"{role}_{i+1}"
+            ward = s_data.get("ward")
+            if ward is not None and ward not in self.wards:
+                raise ValueError(f"Staff {role} assegnato a un reparto inesistente: {ward}")
+            prefix = f"{ward}_{role}" if ward is not None else role
+            for _ in range(s_data.get("count", 1)):
+                # Numerazione progressiva per (reparto, ruolo): id univoci anche con più voci dello stesso ruolo
+                n = staff_counters[(ward, role)] = staff_counters.get((ward, role), 0) + 1
                 staff = StaffEntity(
-                    staff_id=sid,
+                    staff_id=f"{prefix}_{n}",
                     role=role,
                     compliance_mod=s_data.get("compliance_modifier", 1.0),
-                    cleaning_eff=s_data.get("cleaning_efficacy", None)
+                    cleaning_eff=s_data.get("cleaning_efficacy", None),
+                    ward=ward
                 )
                 self.staff_agents.append(staff)
 
         self.log_event("START", "Simulation environment initialized")
 
-    def _decay_process(self):
-        """Processo globale continuo che riduce le cariche virali basato sull'emivita"""
+    def _decay_process(self, wake: float):
+        """Processo globale continuo che riduce le cariche virali basato sull'emivita (modalità STEPWISE)"""
+        env = self.env
+        pending = self._pending
         while True:
-            yield self.env.timeout(1.0) # Ogni tick (~10 minuti simulati)
-            
-            # Decadimento Superfici (Emivita in ore, quindi in tick = HalfLifeH * 60 / TickM)
-            # Formula semplificata per diminuzione logaritmica a scalini
-            surface_decay_factor = 1.0 - (0.693 / (self.decay_surface * 60.0 / self.tick_unit_m))
-            for r in self.rooms.values():
-                if r.load > 0.01:
-                    r.load *= max(0, surface_decay_factor)
-
-            # Decadimento Mani
-            hands_decay_factor = 1.0 - (0.693 / (self.decay_hands / self.tick_unit_m))
-            for s in self.staff_agents:
-                if s.load > 0.01:
-                    s.load *= max(0, hands_decay_factor)
+            yield env.timeout(wake - env.now)
+            self._decay_step()
+            wake = env.now + 1.0 # Ogni tick (~10 minuti simulati)
+            pending[DECAY] = (wake, self._seq)
+            self._seq += 1
+
+    def _decay_step(self):
+        """Un tick di decadimento a scalini su tutte le stanze e le mani."""
+        # Decadimento Superfici
+        surface_decay_factor = self.surface_decay_factor
+        for r in self.rooms.values():
+            if r.load > 0.01:
+                r.load *= surface_decay_factor
+
+        # Decadimento Mani
+        hands_decay_factor = self.hands_decay_factor
+        for s in self.staff_agents:
+            if s.load > 0.01:
+                s.load *= hands_decay_factor
+
+    def _decay_entity(self, entity, now: float, factor: float, half_life_ticks: float):
+        """
+        Porta la carica di una stanza o di mani al tick `now` (modalità LAZY/EXACT).
+        LAZY applica un passo per ogni tick intero trascorso dall'ultimo aggiornamento, come se il
+        decadimento del tick t avvenisse dopo le visite di t (l'ordine tipico in SimPy, dove il
+        timeout di un agente è schedulato prima di quello del processo globale); EXACT usa
+        l'esponenziale continuo.
+        """
+        if now <= entity.last_update:
+            return
+        entity.load = self._decayed_load(entity, now, factor, half_life_ticks)
+        entity.last_update = now
+
+    def _decayed_load(self, entity, now: float, factor: float, half_life_ticks: float) -> float:
+        """Carica di `entity` al tick `now` senza aggiornarla (letture per i campioni delle serie)."""
+        last = entity.last_update
+        if not self._lazy_decay or now <= last:
+            return entity.load
+        if self.decay_mode == "EXACT":
+            return entity.load * math.exp(-LN2 * (now - last) / half_life_ticks)
+        return stepwise_decay(entity.load, factor, int(math.floor(now) - math.floor(last)))
+
+    def sync_loads(self, tick: Optional[float] = None):
+        """
+        Snapshot: aggiorna il decadimento di tutte le stanze e mani al tick `tick`
+        (default il tick corrente; no-op in STEPWISE).
+        """
+        if not self._lazy_decay:
+            return
+        if tick is None:
+            tick = self.env.now
+        for r in self.rooms.values():
+            self._decay_entity(r, tick, self.surface_decay_factor, self.surface_half_life_ticks)
+        for s in self.staff_agents:
+            self._decay_entity(s, tick, self.hands_decay_factor, self.hands_half_life_ticks)
 
     def _hand_hygiene_check(self, agent: StaffEntity, room: RoomEntity) -> bool:
         """Calcola stocasticamente se l'agente esegue l'igiene delle mani."""
@@ -149,8 +363,8 @@ class HAISimulatorEngine:
             return True
         return False
 
-    def _cross_contaminate(self, agent: StaffEntity, room: RoomEntity, patient: PatientEntity = None):
-        """Meccanica di scambio carica virale e innesco infezioni"""
+    def _cross_contaminate(self, agent: StaffEntity, room: RoomEntity, patients: Sequence[PatientEntity] = ()):
+        """Meccanica di scambio carica virale e innesco infezioni (contatto con ogni occupante della stanza)"""
         
         # 1. Contatto Ambiente <-> Mani
         room_pickup = room.load * 0.10 # Il 10% della carica della stanza finisce sulle mani
@@ -158,77 +372,480 @@ class HAISimulatorEngine:
         
         agent.load = agent.load + room_pickup - hands_drop
         room.load = room.load + hands_drop - room_pickup
+        if room.load > self.peak_room_load:
+            self.peak_room_load = room.load
+
+        # Provenienza: il contatto conta se vale almeno metà della carica risultante
+        prov = self.provenance
+        if prov is not None:
+            picked = room_pickup >= PROVENANCE_MIN_LOAD and 2.0 * room_pickup >= agent.load
+            dropped = hands_drop >= PROVENANCE_MIN_LOAD and 2.0 * hands_drop >= room.load
+            if picked or dropped:
+                prov.exchange(self.env.now, agent.id, room.id, prov.rooms, picked, dropped)
         
         # 2. Contatto Paziente <-> Mani
-        if patient:
+        for patient in patients:
             pat_pickup = patient.load * 0.15
-            pat_drop = agent.load * 0.10
+            pat_drop = agent.load * PATIENT_DROP_FRACTION
             
             agent.load = agent.load + pat_pickup - pat_drop
             patient.load = patient.load + pat_drop - pat_pickup
+            if prov is not None:
+                picked = pat_pickup >= PROVENANCE_MIN_LOAD and 2.0 * pat_pickup >= agent.load
+                dropped = pat_drop >= PROVENANCE_MIN_LOAD and 2.0 * pat_drop >= patient.load
+                if picked or dropped:
+                    prov.exchange(self.env.now, agent.id, patient.id, prov.patients, picked, dropped)
             
             # 3. Check Infezione (Suscettibile -> Colonizzato)
-            if patient.state == "SUSCEPTIBLE" and pat_drop > 10.0:
+            if patient.state == "SUSCEPTIBLE" and pat_drop > INFECTION_MIN_DROP:
                 # La probabilità di infettarsi dipende dalla carica caduta e dalla prob base
                 infection_risk = min(1.0, (pat_drop / 1000.0) * self.trans_prob * patient.susceptibility)
                 if self.rng.random() < infection_risk:
                     patient.state = "INFECTED"
                     patient.load = 10000.0 # Raggiunge cap virale
-                    self.log_event("INFECTION", f"Patient {patient.id} infected by {agent.id}", 
-                                   source=agent.id, target=patient.id, mechanism="DIRECT_HANDS")
+                    self.counters["infections"] += 1
+                    self.state_counts["SUSCEPTIBLE"] -= 1
+                    self.state_counts["INFECTED"] += 1
+                    self.infection_ticks.append(self.env.now)
+                    if prov is not None:
+                        prov.infect(self.env.now, agent.id, patient.id)
+                    if self._log_epidemic:
+                        log = self.event_log
+                        log.add_infection(self.env.now, log.intern(agent.id), log.intern(patient.id), self._result_codes["DIRECT_HANDS"])
 
-    def agent_process(self, agent: StaffEntity):
-        """Il ciclo vita (Turno) di un operatore nel reparto."""
-        room_ids = list(self.rooms.keys())
-        
+        if agent.load > self.peak_hand_load:
+            self.peak_hand_load = agent.load
+
+    def agent_process(self, agent: StaffEntity, index: int, wake: float):
+        """Il ciclo vita (Turno) di un operatore nel reparto, dal primo risveglio `wake`."""
+        visit = self._make_visit(agent)
+        randint = self.rng.randint
+        env = self.env
+        pending = self._pending
         while True:
+            yield env.timeout(wake - env.now)
+            visit()
             # Delay fino al prossimo task (1-3 tick / 10-30 min)
-            yield self.env.timeout(self.rng.randint(1, 3))
-            
+            wake = env.now + randint(1, 3)
+            pending[index] = (wake, self._seq)
+            self._seq += 1
+
+    def _make_visit(self, agent: StaffEntity, rng=None) -> Callable[[], None]:
+        """
+        Ritorna la funzione che esegue una visita dell'operatore al tick corrente
+        (condivisa dal processo SimPy e dal backend a heap, vedi `heap_engine`).
+        `rng` sostituisce il generatore del motore per la scelta della stanza (stream
+        dell'operatore nel backend partizionato, vedi `partition`).
+        """
+        # Lo staff di reparto visita solo le stanze del proprio reparto
+        room_ids = self.wards[agent.ward] if agent.ward is not None else list(self.rooms.keys())
+        room_patients = self.room_patients
+        log = self.event_log
+        agent_code = log.intern(agent.id)
+        role_code = log.intern(agent.role)
+        room_codes = self._room_codes
+        res = self._result_codes
+        counters = self.counters
+        log_visits = self._log_visits
+        lazy_decay = self._lazy_decay
+        rng = self.rng if rng is None else rng
+        env = self.env
+        rooms = self.rooms
+        # Traccia delle stanze dall'ultimo lavaggio (deque del grafo di provenienza, aggiornata inline)
+        prov = self.provenance
+        trail = prov.trails[agent.id] if prov is not None else None
+        washed_at = prov.washed_at if prov is not None else None
+
+        def visit():
             # Sceglie una stanza a caso da visitare
-            target_room_id = self.rng.choice(room_ids)
-            target_room = self.rooms[target_room_id]
+            target_room_id = rng.choice(room_ids)
+            target_room = rooms[target_room_id]
             
-            # Cerca se c'è un paziente
-            target_patient = next((p for p in self.patients.values() if p.room_id == target_room_id), None)
+            # Occupanti della stanza (indice precalcolato)
+            target_patients = room_patients[target_room_id]
+
+            # Decadimento lazy: solo le entità toccate dalla visita vengono aggiornate
+            if lazy_decay:
+                now = env.now
+                self._decay_entity(target_room, now, self.surface_decay_factor, self.surface_half_life_ticks)
+                self._decay_entity(agent, now, self.hands_decay_factor, self.hands_half_life_ticks)
             
-            self.log_event("MOVE", f"{agent.role} {agent.id} visiting {target_room_id}", agent_id=agent.id, room=target_room_id)
+            agent.room_id = target_room_id
+            counters["visits"] += 1
+            room_code = room_codes[target_room_id]
+            if log_visits:
+                log.add_move(env.now, agent_code, room_code, role_code)
             
             # CLEANER LOGIC: Pulizia
             if agent.role == "CLEANER":
                 target_room.load *= (1.0 - (agent.cleaning_efficacy or 0.85))
-                self.log_event("CLEANING", f"{agent.id} cleaned {target_room_id}", agent_id=agent.id, room=target_room_id)
-                continue
+                counters["cleanings"] += 1
+                if log_visits:
+                    log.add_cleaning(env.now, agent_code, room_code)
+                return
                 
             # NURSE/DOC LOGIC: Visita Clinica
+            if trail is not None:
+                trail.append(target_room_id)
             # Momento OMS 1: Prima del contatto (Ingresso)
-            if self._hand_hygiene_check(agent, target_room):
-                self.log_event("HYGIENE", "WASH_IN_SUCCESS", agent_id=agent.id, room=target_room_id)
-            else:
-                self.log_event("HYGIENE", "WASH_IN_FAIL", agent_id=agent.id, room=target_room_id)
+            washed_in = self._hand_hygiene_check(agent, target_room)
+            counters["hygiene_success" if washed_in else "hygiene_fail"] += 1
+            if washed_in and trail is not None:
+                # Mani lavate prima del contatto: la traccia riparte dalla stanza corrente
+                trail.clear()
+                trail.append(target_room_id)
+                washed_at[agent.id] = env.now
+            if log_visits:
+                log.add_hygiene(env.now, agent_code, room_code, res["WASH_IN_SUCCESS"] if washed_in else res["WASH_IN_FAIL"])
                 
             # Interazione (Cross-Contaminazione)
-            self._cross_contaminate(agent, target_room, target_patient)
+            self._cross_contaminate(agent, target_room, target_patients)
             
             # Momento OMS 2: Dopo il contatto (Uscita)
-            if self._hand_hygiene_check(agent, target_room):
-                self.log_event("HYGIENE", "WASH_OUT_SUCCESS", agent_id=agent.id, room=target_room_id)
+            washed_out = self._hand_hygiene_check(agent, target_room)
+            counters["hygiene_success" if washed_out else "hygiene_fail"] += 1
+            if washed_out and trail is not None:
+                trail.clear()
+                washed_at[agent.id] = env.now
+            if log_visits:
+                log.add_hygiene(env.now, agent_code, room_code, res["WASH_OUT_SUCCESS"] if washed_out else res["WASH_OUT_FAIL"])
+
+        return visit
+
+    def summary(self) -> RunSummary:
+        """Riepilogo della run dai contatori interni (valido a qualunque livello di log)."""
+        self.sync_loads()
+        c = self.counters
+        hygiene_total = c["hygiene_success"] + c["hygiene_fail"]
+        initial_susceptible = sum(1 for p in self.scenario.get("patients", []) if p.get("state", "SUSCEPTIBLE") == "SUSCEPTIBLE")
+        final_states: Dict[str, int] = {}
+        for p in self.patients.values():
+            final_states[p.state] = final_states.get(p.state, 0) + 1
+        room_loads = [r.load for r in self.rooms.values()] or [0.0]
+        hand_loads = [s.load for s in self.staff_agents] or [0.0]
+        return RunSummary(
+            log_level=self.log_level,
+            ticks_simulated=self.env.now,
+            visits=c["visits"],
+            cleanings=c["cleanings"],
+            hygiene_success=c["hygiene_success"],
+            hygiene_fail=c["hygiene_fail"],
+            hygiene_success_rate=c["hygiene_success"] / hygiene_total if hygiene_total else 0.0,
+            infections=c["infections"],
+            infection_ticks=list(self.infection_ticks),
+            attack_rate=c["infections"] / initial_susceptible if initial_susceptible else 0.0,
+            final_states=final_states,
+            mean_room_load=sum(room_loads) / len(room_loads),
+            max_room_load=max(room_loads),
+            peak_room_load=self.peak_room_load,
+            mean_hand_load=sum(hand_loads) / len(hand_loads),
+            peak_hand_load=self.peak_hand_load,
+            events_logged=self.log_cursor + len(self.event_log),
+            stop_reason=self.stop_reason,
+        )
+
+    # --- Scheduling (sovrascritto dal backend a heap) ---
+
+    def _schedule_entry(self, t: float, who: int):
+        """Registra il prossimo risveglio di un processo e lo avvia in SimPy."""
+        self._pending[who] = (t, self._seq)
+        self._seq += 1
+        if who == DECAY:
+            self.env.process(self._decay_process(t))
+        else:
+            self.env.process(self.agent_process(self.staff_agents[who], who, t))
+
+    def _advance(self, until: float):
+        # Fermare SimPy a metà non altera l'ordine degli eventi: il log resta identico
+        if until > self.env.now:
+            self.env.run(until=until)
+
+    def _pending_schedule(self) -> List[Tuple[float, int]]:
+        """Risvegli pendenti `(tick, chi)` nell'ordine in cui verranno processati a parità di tick."""
+        return [(t, who) for who, (t, _) in sorted(self._pending.items(), key=lambda item: item[1][1])]
+
+    def _schedule(self):
+        # Le estrazioni del primo delay avvengono nell'ordine di creazione dei processi,
+        # come all'inizializzazione dei processi SimPy
+        for t, who in self._startup:
+            if t is None:
+                t = self.env.now + self.rng.randint(1, 3)
+            self._schedule_entry(t, who)
+        self._scheduled = True
+
+    def advance_to(self, tick: float):
+        """Avanza il clock fino a `tick` (eventi di `tick` esclusi) senza chiudere la run."""
+        if not self._scheduled:
+            self._schedule()
+        self._advance(tick)
+
+    # --- Checkpoint / restore ---
+
+    def checkpoint(self) -> dict:
+        """
+        Stato completo del motore al tick corrente (tra due avanzamenti del clock), serializzabile
+        in JSON: cariche e stati delle entità, schedule pendente, stato del RNG, contatori,
+        cursore del log (eventi già emessi) e provenienza corrente dei portatori di carica.
+        Va preso a schedule avviata (`advance_to`).
+        """
+        return {
+            "version": CHECKPOINT_VERSION,
+            "tick": self.env.now,
+            "decay_mode": self.decay_mode,
+            "rooms": {rid: [r.load, r.last_update] for rid, r in self.rooms.items()},
+            "patients": {pid: [p.state, p.load] for pid, p in self.patients.items()},
+            "staff": {s.id: [s.load, s.last_update, s.room_id] for s in self.staff_agents},
+            "pending": [[t, "DECAY" if who == DECAY else self.staff_agents[who].id] for t, who in self._pending_schedule()],
+            "rng": self.rng.getstate(),
+            "counters": dict(self.counters),
+            "infection_ticks": list(self.infection_ticks),
+            "peak_room_load": self.peak_room_load,
+            "peak_hand_load": self.peak_hand_load,
+            "log_cursor": self.log_cursor + len(self.event_log),
+            "provenance": self.provenance.state() if self.provenance is not None else None,
+        }
+
+    def restore(self, state: dict):
+        """
+        Riprende da un checkpoint, anche con uno scenario modificato: le entità sono abbinate
+        per id, quelle nuove partono dallo stato iniziale e lo staff aggiunto estrae il primo
+        delay allo start. Il log riparte vuoto dal tick del checkpoint (`log_cursor` eventi prima).
+        """
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Versione di checkpoint non supportata: {state.get('version')}")
+        if state["decay_mode"] != self.decay_mode:
+            raise ValueError("decay_mode non modificabile riprendendo da un checkpoint")
+        if self._scheduled:
+            raise RuntimeError("restore() va chiamato prima di avviare la run")
+
+        self.env = self._make_clock(state["tick"])
+        for rid, (load, last_update) in state["rooms"].items():
+            room = self.rooms.get(rid)
+            if room is not None:
+                room.load, room.last_update = load, last_update
+        for pid, (p_state, load) in state["patients"].items():
+            pat = self.patients.get(pid)
+            if pat is not None:
+                pat.state, pat.load = p_state, load
+        index = {s.id: k for k, s in enumerate(self.staff_agents)}
+        for sid, (load, last_update, *location) in state["staff"].items():
+            if sid in index:
+                agent = self.staff_agents[index[sid]]
+                agent.load, agent.last_update = load, last_update
+                agent.room_id = location[0] if location and location[0] in self.rooms else None
+
+        version, internal, gauss_next = state["rng"]
+        self.rng.setstate((version, tuple(internal), gauss_next))
+        self.counters = dict(state["counters"])
+        self.state_counts = self._count_states()
+        self.infection_ticks = list(state["infection_ticks"])
+        self.peak_room_load = state["peak_room_load"]
+        self.peak_hand_load = state["peak_hand_load"]
+
+        self.event_log = EventLog()
+        self.log_cursor = state["log_cursor"]
+        self._intern_codes()
+        # I nodi di provenienza precedenti al checkpoint restano nel grafo della run di origine
+        if self.provenance is not None:
+            if state.get("provenance"):
+                self.provenance = ProvenanceGraph.from_state(state["provenance"])
             else:
-                self.log_event("HYGIENE", "WASH_OUT_FAIL", agent_id=agent.id, room=target_room_id)
+                self._init_provenance(state["tick"], INHERITED)
 
-    def run(self) -> List[dict]:
-        """Esegue il calcolo della run."""
-        print(f"[SimPy Engine] Starting scenario '{self.scenario['scenario_meta']['name']}' for {self.max_ticks} ticks...")
-        
-        # Schedula Decadimento Ambientale
-        self.env.process(self._decay_process())
+        startup: List[Tuple[Optional[float], int]] = []
+        for t, who in state["pending"]:
+            if who == "DECAY":
+                startup.append((t, DECAY))
+            elif who in index:
+                startup.append((t, index[who]))
+        startup += [(None, k) for k, s in enumerate(self.staff_agents) if s.id not in state["staff"]]
+        self._startup = startup
+
+    def _current_loads(self) -> Tuple[List[float], List[float]]:
+        """Cariche di stanze e mani al tick corrente (decadute in LAZY/EXACT, senza aggiornarle)."""
+        now = self.env.now
+        rooms = self.rooms.values()
+        if self._lazy_decay:
+            f, h = self.surface_decay_factor, self.surface_half_life_ticks
+            room_loads = [self._decayed_load(r, now, f, h) for r in rooms]
+            f, h = self.hands_decay_factor, self.hands_half_life_ticks
+            hand_loads = [self._decayed_load(s, now, f, h) for s in self.staff_agents]
+        else:
+            room_loads = [r.load for r in rooms]
+            hand_loads = [s.load for s in self.staff_agents]
+        return room_loads, hand_loads
+
+    def _load_stats(self) -> Dict[str, float]:
+        """Carica media/massima delle stanze e media delle mani al tick corrente."""
+        room_loads, hand_loads = self._current_loads()
+        return {
+            "mean_room_load": sum(room_loads) / len(room_loads) if room_loads else 0.0,
+            "max_room_load": max(room_loads, default=0.0),
+            "mean_hand_load": sum(hand_loads) / len(hand_loads) if hand_loads else 0.0,
+        }
+
+    def _sample_series(self):
+        """Aggiunge un campione alle serie: stato corrente, cariche decadute al tick corrente."""
+        now = self.env.now
+        c = self.counters
+        prev_success, prev_fail = self._series_hygiene
+        self._series_hygiene = (c["hygiene_success"], c["hygiene_fail"])
+        self.series.append(now, {
+            "susceptible": self.state_counts["SUSCEPTIBLE"],
+            "colonized": self.state_counts["COLONIZED"],
+            "infected": self.state_counts["INFECTED"],
+            **self._load_stats(),
+            "hygiene_success": c["hygiene_success"] - prev_success,
+            "hygiene_fail": c["hygiene_fail"] - prev_fail,
+        })
+
+    def frame(self) -> dict:
+        """
+        Aggregato dello stato al tick corrente per lo streaming live (vedi `jobs`): pazienti per
+        stato, contatori cumulativi e cariche medie/massime. Costo O(stanze + staff).
+        """
+        return {
+            "tick": self.env.now,
+            "susceptible": self.state_counts["SUSCEPTIBLE"],
+            "colonized": self.state_counts["COLONIZED"],
+            "infected": self.state_counts["INFECTED"],
+            **self.counters,
+            **self._load_stats(),
+        }
+
+    def keyframe(self) -> dict:
+        """
+        Fotogramma completo dello stato al tick corrente (inizio tick, eventi del tick esclusi):
+        carica di ogni stanza, stanza/stato/carica di ogni paziente, ultima stanza e carica
+        di ogni operatore. Le cariche LAZY/EXACT sono lette decadute al tick corrente.
+        """
+        now = self.env.now
+        f, h = self.surface_decay_factor, self.surface_half_life_ticks
+        rooms = {rid: self._decayed_load(r, now, f, h) for rid, r in self.rooms.items()}
+        f, h = self.hands_decay_factor, self.hands_half_life_ticks
+        staff = {s.id: [s.room_id, self._decayed_load(s, now, f, h)] for s in self.staff_agents}
+        patients = {pid: [p.room_id, p.state, p.load] for pid, p in self.patients.items()}
+        return {"tick": now, "rooms": rooms, "patients": patients, "staff": staff}
+
+    def _patient_loads(self) -> List[float]:
+        return [p.load for p in self.patients.values()]
+
+    def is_absorbed(self) -> bool:
+        """
+        Stato assorbente: nessuna infezione è più possibile. Gli scambi sposteranno la carica
+        senza crearla (decadimento, lavaggi e pulizie la riducono, solo un'infezione la ricrea),
+        quindi nessuna mano potrà superare la carica totale di stanze, mani e pazienti: se
+        nemmeno questa basta per un deposito infettante, stati e contatori epidemici restano
+        fermi. Comprende il caso senza pazienti portatori e con tutte le cariche sotto soglia.
+        """
+        room_loads, hand_loads = self._current_loads()
+        total = sum(room_loads) + sum(hand_loads) + sum(self._patient_loads())
+        return total * PATIENT_DROP_FRACTION <= INFECTION_MIN_DROP
+
+    def _stops_early(self) -> bool:
+        return self.early_stop or bool(self.stop_when) or self.stop_condition is not None
+
+    def _check_stop(self) -> Optional[str]:
+        """Motivo per fermare la run al tick corrente (None per proseguire)."""
+        if self.stop_condition is not None:
+            reason = self.stop_condition(self)
+            if reason:
+                return str(reason)
+        if self.stop_when:
+            frame = self.frame()
+            for metric, threshold in self.stop_when.items():
+                if frame[metric] >= threshold:
+                    return f"STOP_WHEN:{metric}"
+        if self.early_stop and self.is_absorbed():
+            return "ABSORBING"
+        return None
+
+    def _end_run(self):
+        """Evento END, con il motivo se la run si è fermata prima di `max_ticks`."""
+        if self.stop_reason is None:
+            self.log_event("END", "Simulation Finished")
+        else:
+            self.log_event("END", f"Simulation stopped early ({self.stop_reason})", reason=self.stop_reason)
+
+    def _stop_ticks(self, *intervals: int) -> List[float]:
+        """Tick di fermata del clock: multipli degli intervalli dopo il tick corrente, più `max_ticks`."""
+        stops = {self.max_ticks}
+        for interval in intervals:
+            if interval and interval > 0:
+                tick = (math.floor(self.env.now / interval) + 1) * interval
+                while tick < self.max_ticks:
+                    stops.add(tick)
+                    tick += interval
+        return sorted(stops)
+
+    def run(
+        self,
+        on_progress: Optional[Callable[[float], None]] = None,
+        progress_interval: int = 100,
+        on_checkpoint: Optional[Callable[[dict], None]] = None,
+        checkpoint_interval: int = 0,
+        series_interval: int = 0,
+        on_keyframe: Optional[Callable[[dict], None]] = None,
+        keyframe_interval: int = 0,
+    ):
+        """
+        Esegue il calcolo della run (dal tick 0 o dal checkpoint ripristinato).
+        Ritorna l'EventLog a livello FULL, il `RunSummary` compatto ai livelli ridotti.
+        Se `on_progress` è fornito, il clock avanza a segmenti di `progress_interval` tick
+        e il callback riceve il tick corrente (può sollevare `SimulationCancelled`).
+        Se `on_checkpoint` è fornito riceve il checkpoint iniziale e uno ogni `checkpoint_interval` tick.
+        Con `series_interval` > 0 accumula in `self.series` un campione al tick iniziale, uno ogni
+        `series_interval` tick e uno a fine run (costo O(stanze + staff) per campione).
+        Se `on_keyframe` è fornito riceve il fotogramma di stato iniziale e uno ogni `keyframe_interval` tick.
+        Con `self.profiler` impostato (vedi `instrumentation.EngineProfiler`) la run è strumentata.
+        Con arresto anticipato attivo (`early_stop`, `stop_when`, `stop_condition`) ogni
+        `stop_check_ticks` si valuta `_check_stop`: al primo motivo la run termina in quel tick,
+        come se fosse `max_ticks` (ultimo campione e avanzamento), e il motivo va in `stop_reason`.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.install(self)
+        try:
+            print(f"[{self.engine_label} Engine] Starting scenario '{self.scenario['scenario_meta']['name']}' for {self.max_ticks} ticks...")
         
-        # Schedula Agenti
-        for staff in self.staff_agents:
-            self.env.process(self.agent_process(staff))
+            # Schedula Decadimento Ambientale (in LAZY/EXACT il costo segue le visite, non i letti) e Agenti
+            self.advance_to(self.env.now)
+            if on_checkpoint is not None:
+                on_checkpoint(self.checkpoint())
+            if on_keyframe is not None:
+                on_keyframe(self.keyframe())
+            if series_interval > 0:
+                self.series = TimeSeries(series_interval)
+                self._series_hygiene = (self.counters["hygiene_success"], self.counters["hygiene_fail"])
+                self._sample_series()
         
-        # Avvia Clock
-        self.env.run(until=self.max_ticks)
+            # Avvia Clock
+            progress_interval = progress_interval if on_progress is not None else 0
+            checkpoint_interval = checkpoint_interval if on_checkpoint is not None else 0
+            keyframe_interval = keyframe_interval if on_keyframe is not None else 0
+            check_interval = self.stop_check_ticks if self._stops_early() else 0
+            stops = self._stop_ticks(progress_interval, checkpoint_interval, series_interval, keyframe_interval, check_interval)
+            for stop in stops:
+                self._advance(stop)
+                if check_interval and stop % check_interval == 0 and stop < self.max_ticks:
+                    self.stop_reason = self._check_stop()
+                last = stop == self.max_ticks or self.stop_reason is not None
+                if keyframe_interval and stop % keyframe_interval == 0 and not last:
+                    on_keyframe(self.keyframe())
+                if series_interval > 0 and (stop % series_interval == 0 or last):
+                    self._sample_series()
+                if checkpoint_interval and stop % checkpoint_interval == 0 and not last:
+                    on_checkpoint(self.checkpoint())
+                if on_progress is not None and (stop % progress_interval == 0 or last):
+                    on_progress(self.env.now)
+                if last:
+                    break
         
-        self.log_event("END", "Simulation Finished")
-        return self.event_log
+            self.sync_loads()
+            self._end_run()
+            if self.log_level == "FULL":
+                return self.event_log
+            return self.summary()
+        finally:
+            if profiler is not None:
+                profiler.uninstall(self)
@@ -0,0 +1,454 @@
+"""
+Sweep di parametri headless ("Hessian-Run", backlog US-4.2).
+
+Da uno scenario base e da una griglia di parametri (path puntati sul JSON di scenario,
+es. `hygiene.base_compliance`, `pathogen.transmission_prob`, `staffing.CLEANER.count`)
+genera un task per ogni (cella della griglia, replica), con seed derivato in modo
+deterministico, e li distribuisce su un `ProcessPoolExecutor`. Ogni run produce una
+riga di riepilogo; le righe vengono scritte in streaming (CSV, Mongo) e una sweep
+interrotta riprende saltando i task già presenti.
+
+Con una `StoppingRule` il numero di repliche per cella non è fisso: si parte da un minimo e
+si aggiungono repliche a blocchi finché l'intervallo di confidenza della metrica obiettivo
+non raggiunge la precisione richiesta (arresto sequenziale, `run_sequential_sweep`).
+
+Con `crn` (numeri casuali comuni) la replica r di ogni cella usa lo stesso seed e il backend
+PARTITIONED, i cui stream sono per operatore: celle diverse vedono le stesse estrazioni per le
+stesse visite e le differenze tra celle sono appaiate (vedi `sensitivity`).
+"""
+import argparse
+import copy
+import csv
+import hashlib
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, wait
+from statistics import NormalDist, fmean, stdev
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .partition import PartitionedEngine
+from .simulator import HAISimulatorEngine
+
+SUMMARY_FIELDS = [
+    "infections", "attack_rate", "final_infected",
+    "hygiene_success", "hygiene_fail", "visits", "cleanings",
+    "mean_room_load", "max_room_load", "mean_hand_load",
+    "ticks_simulated", "wall_time_s",
+]
+
+
+def expand_grid(grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Prodotto cartesiano della griglia: una mappa path -> valore per ogni cella."""
+    if not grid:
+        return [{}]
+    paths = sorted(grid.keys())
+    return [dict(zip(paths, values)) for values in itertools.product(*(grid[p] for p in paths))]
+
+
+def cell_key(overrides: Dict[str, Any]) -> str:
+    """Chiave canonica di una cella (JSON con chiavi ordinate)."""
+    return json.dumps(overrides, sort_keys=True, separators=(",", ":"))
+
+
+def derive_seed(base_seed: int, key: str, replicate: int) -> int:
+    """Seed deterministico per (seed base, cella, replica): indipendente dall'ordine di esecuzione."""
+    digest = hashlib.sha256(f"{base_seed}|{key}|{replicate}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big")
+
+
+def apply_overrides(scenario: dict, overrides: Dict[str, Any]) -> dict:
+    """
+    Ritorna una copia dello scenario con i path puntati sovrascritti.
+    Nei segmenti su liste un intero è un indice, altrimenti seleziona l'elemento con
+    quel `role` (es. `staffing.CLEANER.count`); un ruolo assente viene aggiunto.
+    """
+    result = copy.deepcopy(scenario)
+    for path, value in overrides.items():
+        parts = path.split(".")
+        node = result
+        for i, part in enumerate(parts[:-1]):
+            if isinstance(node, list):
+                if part.isdigit():
+                    node = node[int(part)]
+                    continue
+                match = next((item for item in node if item.get("role") == part), None)
+                if match is None:
+                    match = {"role": part}
+                    node.append(match)
+                node = match
+            else:
+                if part not in node:
+                    raise ValueError(f"Parametro di sweep sconosciuto: '{path}'")
+                node = node[part]
+        if isinstance(node, list):
+            raise ValueError(f"Il path '{path}' deve terminare su un campo, non su una lista")
+        node[parts[-1]] = value
+    return result
+
+
+def task_key(key: str, replicate: int) -> str:
+    return f"{key}#{replicate}"
+
+
+# Chiave di derivazione dei seed con numeri casuali comuni (al posto della chiave di cella)
+CRN_KEY = "crn"
+
+
+def cell_tasks(base_scenario: dict, overrides: Dict[str, Any], replicates: Iterable[int], crn: bool = False) -> List[dict]:
+    """
+    Task delle repliche indicate di una cella (stessi seed qualunque sia il numero totale di repliche).
+    Con `crn` il seed dipende solo dalla replica e la run usa il backend PARTITIONED.
+    """
+    base_seed = base_scenario.get("scenario_meta", {}).get("seed", 42)
+    key = cell_key(overrides)
+    scenario = apply_overrides(base_scenario, overrides)
+    tasks = [{
+        "task_key": task_key(key, rep),
+        "cell_key": key,
+        "replicate": rep,
+        "seed": derive_seed(base_seed, CRN_KEY if crn else key, rep),
+        "overrides": overrides,
+        "scenario": scenario,
+    } for rep in replicates]
+    if crn:
+        for t in tasks:
+            t["backend"] = "PARTITIONED"
+    return tasks
+
+
+def build_tasks(base_scenario: dict, grid: Dict[str, List[Any]], replicates: int, crn: bool = False) -> List[dict]:
+    """Espande griglia e repliche in task autosufficienti (serializzabili verso i worker)."""
+    tasks = []
+    for overrides in expand_grid(grid):
+        tasks.extend(cell_tasks(base_scenario, overrides, range(replicates), crn))
+    return tasks
+
+
+def summarize_run(engine: HAISimulatorEngine) -> Dict[str, Any]:
+    """Metriche di esito di una singola run, dal riepilogo a contatori del motore."""
+    summary = engine.summary()
+    return {
+        "infections": summary.infections,
+        "attack_rate": summary.attack_rate,
+        "final_infected": summary.final_states.get("INFECTED", 0),
+        "hygiene_success": summary.hygiene_success,
+        "hygiene_fail": summary.hygiene_fail,
+        "visits": summary.visits,
+        "cleanings": summary.cleanings,
+        "mean_room_load": summary.mean_room_load,
+        "max_room_load": summary.max_room_load,
+        "mean_hand_load": summary.mean_hand_load,
+        "ticks_simulated": summary.ticks_simulated,
+    }
+
+
+def run_sweep_task(task: dict) -> dict:
+    """Esegue un task in un worker e ritorna la riga di riepilogo (funzione top-level, picklable)."""
+    scenario = copy.deepcopy(task["scenario"])
+    scenario["scenario_meta"]["seed"] = task["seed"]
+
+    start = time.perf_counter()
+    # Headless: nessun evento per-visita, solo contatori
+    if task.get("backend") == "PARTITIONED":
+        # Una partizione: il task è già l'unità di parallelismo del pool
+        engine = PartitionedEngine(scenario, log_level="COUNTERS", workers=1)
+    else:
+        engine = HAISimulatorEngine(scenario, log_level="COUNTERS")
+    engine.run()
+    row = task_row(task, summarize_run(engine))
+    row["wall_time_s"] = round(time.perf_counter() - start, 4)
+    return row
+
+
+def task_row(task: dict, metrics: Dict[str, Any]) -> dict:
+    """Riga di riepilogo di un task (identificativi, parametri della cella, metriche)."""
+    row = {
+        "task_key": task["task_key"],
+        "cell_key": task["cell_key"],
+        "replicate": task["replicate"],
+        "seed": task["seed"],
+        **task["overrides"],
+        **metrics,
+    }
+    if "cache_key" in task:
+        row["cache_key"] = task["cache_key"]
+    return row
+
+
+def run_sweep(
+    tasks: List[dict],
+    done_keys: Iterable[str] = (),
+    max_workers: Optional[int] = None,
+    on_row: Optional[Callable[[dict], None]] = None,
+    mp_context=None,
+    executor: Optional[Executor] = None,
+) -> Iterator[dict]:
+    """
+    Distribuisce i task non ancora completati su un pool di processi (di default uno per core)
+    e produce le righe man mano che terminano. Con `executor` usa quel pool, condiviso con
+    altri lavori: al più `max_workers` task restano in volo, gli altri attendono qui.
+    """
+    done: Set[str] = set(done_keys)
+    pending = [t for t in tasks if t["task_key"] not in done]
+    if not pending:
+        return
+    workers = min(max_workers or os.cpu_count() or 1, len(pending))
+    if executor is not None:
+        yield from _run_window(executor, pending, workers, on_row)
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+        yield from _run_window(pool, pending, workers, on_row)
+
+
+def _run_window(pool: Executor, pending: List[dict], workers: int, on_row) -> Iterator[dict]:
+    queue = iter(pending)
+    running = {pool.submit(run_sweep_task, t) for t in itertools.islice(queue, workers)}
+    try:
+        while running:
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                row = fut.result()
+                if on_row is not None:
+                    on_row(row)
+                yield row
+                task = next(queue, None)
+                if task is not None:
+                    running.add(pool.submit(run_sweep_task, task))
+    finally:
+        for fut in running:
+            fut.cancel()
+
+
+# --- Arresto sequenziale delle repliche ---
+
+def t_quantile(p: float, df: int) -> float:
+    """
+    Quantile `p` della t di Student con `df` gradi di libertà: esatto per 1 e 2, altrimenti
+    espansione di Cornish-Fisher sul quantile normale (errore < 1% da 3 gradi di libertà).
+    """
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2.0 * p - 1.0) / math.sqrt(2.0 * p * (1.0 - p))
+    x = NormalDist().inv_cdf(p)
+    g1 = (x ** 3 + x) / 4.0
+    g2 = (5 * x ** 5 + 16 * x ** 3 + 3 * x) / 96.0
+    g3 = (3 * x ** 7 + 19 * x ** 5 + 17 * x ** 3 - 15 * x) / 384.0
+    g4 = (79 * x ** 9 + 776 * x ** 7 + 1482 * x ** 5 - 1920 * x ** 3 - 945 * x) / 92160.0
+    return x + g1 / df + g2 / df ** 2 + g3 / df ** 3 + g4 / df ** 4
+
+
+class StoppingRule:
+    """
+    Regola di arresto sequenziale per cella: repliche finché la semiampiezza dell'intervallo
+    di confidenza (t di Student) della media di `metric` non scende a `precision`, con almeno
+    `min_replicates` e al più `max_replicates` repliche. Ogni blocco stima le repliche mancanti
+    dalla varianza osservata, senza più che raddoppiare quelle già fatte.
+    """
+
+    def __init__(
+        self, precision: float, metric: str = "attack_rate", confidence: float = 0.95,
+        min_replicates: int = 10, max_replicates: int = 1000,
+    ):
+        if metric not in SUMMARY_FIELDS:
+            raise ValueError(f"Metrica non valida: {metric} (ammesse: {', '.join(SUMMARY_FIELDS)})")
+        self.precision = precision
+        self.metric = metric
+        self.confidence = confidence
+        self.min_replicates = max(2, min_replicates)
+        self.max_replicates = max(self.min_replicates, max_replicates)
+
+    def estimate(self, values: List[float]) -> Dict[str, Any]:
+        """Media, semiampiezza dell'intervallo e convergenza sulle repliche `values`."""
+        n = len(values)
+        half_width = math.inf
+        if n >= 2:
+            half_width = t_quantile(0.5 + self.confidence / 2.0, n - 1) * stdev(values) / math.sqrt(n)
+        return {
+            "replicates": n,
+            "mean": fmean(values) if values else None,
+            "half_width": half_width if n >= 2 else None,
+            "converged": half_width <= self.precision,
+        }
+
+    def target(self, values: List[float]) -> int:
+        """Repliche da raggiungere dopo aver osservato `values` (`len(values)`: stop)."""
+        n = len(values)
+        if n >= self.max_replicates or self.estimate(values)["converged"]:
+            return n
+        # n* = (t * s / precisione)^2 con la varianza corrente
+        t = t_quantile(0.5 + self.confidence / 2.0, n - 1)
+        needed = math.ceil((t * stdev(values) / self.precision) ** 2)
+        return min(self.max_replicates, 2 * n, max(n + 1, needed))
+
+
+def _cell_progress(rule: StoppingRule, by_replicate: Dict[int, float]) -> Tuple[int, bool]:
+    """
+    Ripercorre la regola sulle repliche 0..n-1 già calcolate: ritorna le repliche richieste
+    ora dalla cella e se la cella è conclusa. Dipende solo dai valori delle repliche, quindi
+    una sweep ripresa segue gli stessi blocchi di una sweep ininterrotta.
+    """
+    n = rule.min_replicates
+    while all(rep in by_replicate for rep in range(n)):
+        target = rule.target([by_replicate[rep] for rep in range(n)])
+        if target <= n:
+            return n, True
+        n = target
+    return n, False
+
+
+def _rows_by_cell(rows: Iterable[dict], metric: str) -> Dict[str, Dict[int, float]]:
+    cells: Dict[str, Dict[int, float]] = {}
+    for row in rows:
+        cells.setdefault(row["cell_key"], {})[int(row["replicate"])] = float(row[metric])
+    return cells
+
+
+def sequential_tasks(base_scenario: dict, grid: Dict[str, List[Any]], rule: StoppingRule, rows: Iterable[dict], crn: bool = False) -> List[dict]:
+    """Task del blocco corrente per le celle non concluse (vuoto a sweep terminata)."""
+    done = _rows_by_cell(rows, rule.metric)
+    tasks = []
+    for overrides in expand_grid(grid):
+        by_replicate = done.get(cell_key(overrides), {})
+        n, finished = _cell_progress(rule, by_replicate)
+        if not finished:
+            tasks.extend(cell_tasks(base_scenario, overrides, [rep for rep in range(n) if rep not in by_replicate], crn))
+    return tasks
+
+
+def sequential_report(grid: Dict[str, List[Any]], rule: StoppingRule, rows: Iterable[dict]) -> List[dict]:
+    """Stima per cella sulle repliche usate dalla regola: media, semiampiezza raggiunta, convergenza."""
+    done = _rows_by_cell(rows, rule.metric)
+    report = []
+    for overrides in expand_grid(grid):
+        key = cell_key(overrides)
+        by_replicate = done.get(key, {})
+        n, finished = _cell_progress(rule, by_replicate)
+        values = [by_replicate[rep] for rep in range(n) if rep in by_replicate]
+        report.append({
+            "cell_key": key,
+            "overrides": overrides,
+            "metric": rule.metric,
+            **rule.estimate(values),
+            "precision": rule.precision,
+            "finished": finished,
+        })
+    return report
+
+
+def run_sequential_sweep(
+    base_scenario: dict,
+    grid: Dict[str, List[Any]],
+    rule: StoppingRule,
+    done_rows: Iterable[dict] = (),
+    max_workers: Optional[int] = None,
+    on_row: Optional[Callable[[dict], None]] = None,
+    crn: bool = False,
+) -> Iterator[dict]:
+    """Sweep ad arresto sequenziale: esegue i blocchi di repliche richiesti da `rule` fino alla conclusione di ogni cella."""
+    rows = list(done_rows)
+    while True:
+        tasks = sequential_tasks(base_scenario, grid, rule, rows, crn)
+        if not tasks:
+            return
+        for row in run_sweep(tasks, max_workers=max_workers, on_row=on_row):
+            rows.append(row)
+            yield row
+
+
+class CsvRowWriter:
+    """Scrittura in append delle righe di una sweep; il file esistente funge da checkpoint di ripresa."""
+
+    def __init__(self, path: str, param_paths: List[str]):
+        self.path = path
+        self.fields = ["task_key", "cell_key", "replicate", "seed"] + sorted(param_paths) + SUMMARY_FIELDS
+
+    def done_keys(self) -> Set[str]:
+        return {row["task_key"] for row in self.rows()}
+
+    def rows(self) -> List[dict]:
+        """Righe già scritte (valori come stringhe CSV)."""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, newline="") as f:
+            return list(csv.DictReader(f))
+
+    def write(self, row: dict):
+        is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.fields, extrasaction="ignore")
+            if is_new:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def write_rows(self, rows: List[dict]):
+        for row in rows:
+            self.write(row)
+
+
+def export_parquet(csv_path: str, parquet_path: str):
+    """Converte l'export CSV in Parquet (richiede `pyarrow`, dipendenza opzionale)."""
+    try:
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Export Parquet non disponibile: installare `pyarrow`") from e
+    pq.write_table(pa_csv.read_csv(csv_path), parquet_path)
+
+
+def _parse_grid_arg(items: List[str]) -> Dict[str, List[Any]]:
+    grid = {}
+    for item in items:
+        path, _, values = item.partition("=")
+        grid[path] = [json.loads(v) for v in values.split(",")]
+    return grid
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Hessian-Run: sweep headless di parametri su uno o più scenari JSON")
+    parser.add_argument("scenarios", nargs="+", help="File JSON di scenario")
+    parser.add_argument("--grid", action="append", default=[], help="path=v1,v2,... (es. hygiene.base_compliance=0.6,0.8)")
+    parser.add_argument("--replicates", type=int, default=10, help="Repliche per cella (minime con --precision)")
+    parser.add_argument("--precision", type=float, help="Semiampiezza dell'IC a cui fermare le repliche di una cella")
+    parser.add_argument("--metric", default="attack_rate", help="Metrica obiettivo dell'arresto sequenziale")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--max-replicates", type=int, default=1000)
+    parser.add_argument("--crn", action="store_true", help="Numeri casuali comuni tra le celle (backend PARTITIONED)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out-dir", default="sweeps")
+    parser.add_argument("--parquet", action="store_true", help="Esporta anche in Parquet a fine sweep")
+    args = parser.parse_args(argv)
+
+    from .models import ScenarioInput
+
+    grid = _parse_grid_arg(args.grid)
+    os.makedirs(args.out_dir, exist_ok=True)
+    for path in args.scenarios:
+        with open(path) as f:
+            base = ScenarioInput(**json.load(f)).model_dump()
+        name = os.path.splitext(os.path.basename(path))[0]
+        writer = CsvRowWriter(os.path.join(args.out_dir, f"{name}.csv"), list(grid.keys()))
+        if args.precision is not None:
+            rule = StoppingRule(args.precision, args.metric, args.confidence, args.replicates, args.max_replicates)
+            done = writer.rows()
+            print(f"[Sweep] {name}: arresto sequenziale su {rule.metric} (±{rule.precision}), {len(done)} task già completati")
+            for _ in run_sequential_sweep(base, grid, rule, done_rows=done, max_workers=args.workers, on_row=writer.write, crn=args.crn):
+                pass
+            for cell in sequential_report(grid, rule, writer.rows()):
+                print(f"[Sweep] {cell['cell_key']}: n={cell['replicates']} media={cell['mean']:.4g} "
+                      f"±{cell['half_width']:.4g} {'OK' if cell['converged'] else 'precisione non raggiunta'}")
+        else:
+            tasks = build_tasks(base, grid, args.replicates, args.crn)
+            done = writer.done_keys()
+            print(f"[Sweep] {name}: {len(tasks)} task, {len(done)} già completati")
+            for _ in run_sweep(tasks, done_keys=done, max_workers=args.workers, on_row=writer.write):
+                pass
+        if args.parquet:
+            export_parquet(writer.path, os.path.join(args.out_dir, f"{name}.parquet"))
+
+
+if __name__ == "__main__":
+    main()
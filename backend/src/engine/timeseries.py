@@ -0,0 +1,97 @@
+import sys
+import zlib
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Metriche campionate dal motore (vedi `HAISimulatorEngine._sample_series`)
+SERIES_METRICS = (
+    "susceptible", "colonized", "infected",
+    "mean_room_load", "max_room_load", "mean_hand_load",
+    "hygiene_success", "hygiene_fail",
+)
+
+
+class TimeSeries:
+    """
+    Serie temporali colonnari di una run: un `array('d')` per metrica più la colonna `t`.
+    Il campione al tick t descrive lo stato all'inizio del tick (eventi di t esclusi);
+    i conteggi di igiene sono quelli avvenuti dal campione precedente.
+    """
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self.t = array("d")
+        self.columns: Dict[str, array] = {m: array("d") for m in SERIES_METRICS}
+
+    def append(self, tick: float, values: Dict[str, float]):
+        self.t.append(tick)
+        for m, col in self.columns.items():
+            col.append(values[m])
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    # --- Serializzazione compatta (float64 little-endian, zlib) ---
+
+    def to_blobs(self) -> Dict[str, bytes]:
+        blobs = {"t": zlib.compress(_le_bytes(self.t))}
+        for m, col in self.columns.items():
+            blobs[m] = zlib.compress(_le_bytes(col))
+        return blobs
+
+    @classmethod
+    def from_blobs(cls, interval: int, blobs: Dict[str, bytes]) -> "TimeSeries":
+        series = cls(interval)
+        series.t = _from_le_bytes(zlib.decompress(blobs["t"]))
+        for m in SERIES_METRICS:
+            if m in blobs:
+                series.columns[m] = _from_le_bytes(zlib.decompress(blobs[m]))
+        return series
+
+
+def _le_bytes(col: array) -> bytes:
+    if sys.byteorder == "little":
+        return col.tobytes()
+    swapped = array("d", col)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+def _from_le_bytes(data: bytes) -> array:
+    col = array("d")
+    col.frombytes(data)
+    if sys.byteorder != "little":
+        col.byteswap()
+    return col
+
+
+def downsample(
+    t: Sequence[float],
+    columns: Dict[str, Sequence[float]],
+    resolution: int,
+    metrics: Optional[List[str]] = None,
+) -> dict:
+    """
+    Riduce le serie a (al più) `resolution` bucket di campioni consecutivi, con min/max/media
+    per bucket; `t` è il tick del primo campione di ogni bucket.
+    """
+    metrics = list(columns) if metrics is None else metrics
+    n = len(t)
+    width = max(1, -(-n // max(1, resolution))) # ceil(n / resolution)
+    starts = np.arange(0, n, width)
+    ticks = np.asarray(t, dtype=np.float64)
+    out = {"bucket_samples": width, "t": ticks[starts].tolist() if n else [], "series": {}}
+    for m in metrics:
+        values = np.asarray(columns[m], dtype=np.float64)
+        if n == 0:
+            out["series"][m] = {"min": [], "max": [], "mean": []}
+            continue
+        counts = np.diff(np.append(starts, n))
+        out["series"][m] = {
+            "min": np.minimum.reduceat(values, starts).tolist(),
+            "max": np.maximum.reduceat(values, starts).tolist(),
+            "mean": (np.add.reduceat(values, starts) / counts).tolist(),
+        }
+    return out
@@ -0,0 +1,112 @@
+"""
+Archiviazione a chunk dell'EventLog.
+
+Gli eventi di una run non stanno più in un unico documento (limite BSON di 16 MB):
+vengono raggruppati per finestre di `EVENT_CHUNK_TICKS` tick in documenti della
+collection `run_event_chunks`, indicizzata su `(run_id, t_start)`. Una finestra molto
+densa viene spezzata in più documenti consecutivi (`seq`) di al più
+`EVENT_CHUNK_MAX_EVENTS` eventi.
+
+Ogni chunk contiene gli eventi come blocco binario compresso (`block`, codec in `codec`,
+vedi `engine.event_archive`): gli stessi blocchi, concatenati, formano l'archivio `.hailog`
+della run. I chunk scritti prima del formato binario hanno la lista `events` e restano
+leggibili tramite `chunk_events`.
+"""
+import os
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from bson import Binary
+
+from .engine.event_archive import DEFAULT_CODEC, block_events, encode_block
+from .engine.eventlog import EventLog
+
+EVENT_CHUNK_TICKS = int(os.getenv("EVENT_CHUNK_TICKS", "50"))
+EVENT_CHUNK_MAX_EVENTS = int(os.getenv("EVENT_CHUNK_MAX_EVENTS", "5000"))
+CHUNK_COLLECTION = "run_event_chunks"
+CHUNK_INDEX = [("run_id", 1), ("t_start", 1), ("seq", 1)]
+
+
+EVENT_CODEC = os.getenv("EVENT_CODEC", DEFAULT_CODEC)
+# Volume locale opzionale: se impostato il worker vi scrive anche `<run_id>.hailog`
+EVENT_ARCHIVE_DIR = os.getenv("EVENT_ARCHIVE_DIR")
+# Proiezione dei campi necessari a decodificare un chunk (binario o legacy)
+CHUNK_EVENTS_PROJECTION = {"block": 1, "codec": 1, "events": 1}
+
+
+def chunk_event_log(
+    run_id: str,
+    event_log: EventLog,
+    chunk_ticks: int = EVENT_CHUNK_TICKS,
+    max_events: int = EVENT_CHUNK_MAX_EVENTS,
+    codec: str = EVENT_CODEC,
+    start: int = 0,
+    stop: Optional[int] = None,
+    seq: int = 0,
+) -> Iterator[dict]:
+    """
+    Divide un log ordinato per tempo in documenti chunk `{run_id, seq, t_start, t_end, n, codec, block}`.
+    `start`/`stop` (indici nel log) e `seq` iniziale permettono di scriverlo a pezzi durante la
+    run: se i pezzi terminano a confini di finestra i chunk sono identici a quelli di un'unica passata.
+    """
+    stop = len(event_log) if stop is None else stop
+    if stop <= start:
+        return
+    windows = np.floor_divide(np.frombuffer(event_log.t, dtype=np.float64)[start:stop], chunk_ticks).astype(np.int64)
+    # Confini dove cambia la finestra di tick, poi spezzati ogni `max_events` eventi
+    bounds = (np.flatnonzero(np.diff(windows)) + 1 + start).tolist()
+    for first, last in zip([start, *bounds], [*bounds, stop]):
+        window = int(windows[first - start])
+        for a in range(first, last, max_events):
+            b = min(a + max_events, last)
+            yield {
+                "run_id": run_id,
+                "seq": seq,
+                "t_start": window * chunk_ticks,
+                "t_end": (window + 1) * chunk_ticks,
+                "n": b - a,
+                "codec": codec,
+                "block": Binary(encode_block(event_log, a, b, codec)),
+            }
+            seq += 1
+
+
+def archive_path(run_id: str) -> Optional[str]:
+    """Percorso dell'archivio `.hailog` della run sul volume locale (None se non configurato)."""
+    if not EVENT_ARCHIVE_DIR:
+        return None
+    return os.path.join(EVENT_ARCHIVE_DIR, f"{run_id}.hailog")
+
+
+def chunk_events(chunk: dict) -> Iterator[dict]:
+    """Eventi di un chunk, nel formato dict dell'EventLog."""
+    if "block" in chunk:
+        return block_events(chunk["block"], chunk["codec"])
+    return iter(chunk["events"])
+
+
+def chunk_query(run_id: str, from_tick: Optional[float] = None, to_tick: Optional[float] = None) -> dict:
+    """Filtro Mongo dei soli chunk che intersecano l'intervallo `[from_tick, to_tick]`."""
+    query = {"run_id": run_id}
+    if from_tick is not None:
+        query["t_end"] = {"$gt": from_tick}
+    if to_tick is not None:
+        query["t_start"] = {"$lte": to_tick}
+    return query
+
+
+def filter_events(
+    events: Iterable[dict],
+    from_tick: Optional[float] = None,
+    to_tick: Optional[float] = None,
+    types: Optional[set] = None,
+) -> Iterator[dict]:
+    """Seleziona dagli eventi di un chunk quelli nell'intervallo di tick e dei tipi richiesti."""
+    for e in events:
+        if from_tick is not None and e["t"] < from_tick:
+            continue
+        if to_tick is not None and e["t"] > to_tick:
+            continue
+        if types and e["type"] not in types:
+            continue
+        yield e
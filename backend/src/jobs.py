@@ -0,0 +1,370 @@
+"""
+Esecuzione asincrona delle run di simulazione.
+
+Le run girano in un pool di processi limitato (il GIL non fa da tetto e l'event loop
+di uvicorn resta libero). Il worker scrive direttamente il risultato su MongoDB con
+un client sincrono (eventi a chunk scritti già durante la run, vedi `event_store`; checkpoint, fotogrammi, serie temporali
+e grafo di provenienza, vedi `checkpoint_store`, `timeseries_store` e `provenance_store`), così il log non viene mai serializzato
+verso il processo API. Avanzamento e richieste di cancellazione sono condivisi tramite
+un `Manager`.
+
+Streaming live: al più ogni `RUN_LIVE_FLUSH_S` secondi il worker scrive i chunk delle
+finestre di tick già complete e un fotogramma aggregato (`HAISimulatorEngine.frame`) in
+`run_live_frames`; `GET /runs/{id}/live` li legge da MongoDB, quindi chi si collega tardi
+riparte dal prefisso già salvato.
+"""
+import asyncio
+import bisect
+import cProfile
+import marshal
+import multiprocessing
+import os
+import time
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from bson import Binary, ObjectId
+
+from .engine.heap_engine import create_engine
+from .engine.instrumentation import EngineProfiler
+from .engine.simulator import ENGINE_VERSION, SimulationCancelled
+from .checkpoint_store import (
+    CHECKPOINT_COLLECTION, KEYFRAME_COLLECTION, RUN_CHECKPOINT_TICKS, RUN_KEYFRAME_TICKS,
+    checkpoint_doc, decode_checkpoint,
+)
+from .engine.event_archive import write_archive
+from .event_store import CHUNK_COLLECTION, EVENT_CHUNK_TICKS, EVENT_CODEC, archive_path, chunk_event_log
+from .provenance_store import PROVENANCE_COLLECTION, provenance_doc
+from .run_cache import event_log_digest
+from .timeseries_store import TIMESERIES_COLLECTION, series_interval_for, timeseries_doc
+
+RUN_MAX_WORKERS = int(os.getenv("RUN_MAX_WORKERS", str(os.cpu_count() or 1)))
+RUN_MAX_QUEUED = int(os.getenv("RUN_MAX_QUEUED", "32"))
+# Processi per i task di sweep e analisi: pool separato, le run in coda non li attendono
+TASK_MAX_WORKERS = int(os.getenv("TASK_MAX_WORKERS", str(os.cpu_count() or 1)))
+RUN_PROGRESS_UPDATES = 100 # Aggiornamenti di avanzamento per run
+# Timer di fase del motore su tutte le run (costo ~50-100% del tempo di simulazione);
+# per una singola run si attivano con `profile=PHASES`
+RUN_PHASE_TIMERS = os.getenv("RUN_PHASE_TIMERS", "0") == "1"
+PROFILE_COLLECTION = "run_profiles"
+RUN_LIVE_FLUSH_S = float(os.getenv("RUN_LIVE_FLUSH_S", "0.25"))
+LIVE_FRAME_COLLECTION = "run_live_frames"
+
+# Client Mongo sincrono, uno per processo worker
+_worker_client = None
+
+
+class QueueFullError(Exception):
+    """La coda delle run ha raggiunto il limite configurato."""
+
+
+def _worker_db(mongo_url: str, db_name: str):
+    global _worker_client
+    if _worker_client is None:
+        from pymongo import MongoClient
+        _worker_client = MongoClient(mongo_url)
+    return _worker_client[db_name]
+
+
+def _simulate_and_store(engine, run_id: str, worker_db, progress, cancel_flags, profile: Optional[str] = None) -> str:
+    """
+    Esegue la run (nuova o ripresa da checkpoint) salvando checkpoint, eventi e riepilogo.
+    Registra nel documento della run le statistiche `stats` (tempi reale/CPU, eventi per tipo,
+    tempi di serializzazione e scrittura; timer di fase del motore con `profile=PHASES`).
+    Con `profile=CPROFILE` salva anche il profilo cProfile della simulazione in `run_profiles`.
+    """
+    runs = worker_db.simulation_runs
+    oid = ObjectId(run_id)
+    checkpoints = worker_db[CHECKPOINT_COLLECTION]
+    keyframes = worker_db[KEYFRAME_COLLECTION]
+    frames = worker_db[LIVE_FRAME_COLLECTION]
+    storage = {"checkpoints": 0.0, "keyframes": 0.0, "serialize_events": 0.0, "write_events": 0.0}
+    event_log = engine.event_log
+    live = {"flushed": 0, "seq": 0, "at": None, "tick": None}
+    chunks = []
+    # Checkpoint e fotogrammi chiave in attesa: scritti in blocco a ogni flush
+    pending = {CHECKPOINT_COLLECTION: [], KEYFRAME_COLLECTION: []}
+    if profile == "PHASES" or RUN_PHASE_TIMERS:
+        engine.profiler = EngineProfiler()
+    cprofile = cProfile.Profile() if profile == "CPROFILE" else None
+
+    def write_pending():
+        for name, docs in pending.items():
+            if docs:
+                start = time.perf_counter()
+                worker_db[name].insert_many(docs)
+                storage["checkpoints" if name == CHECKPOINT_COLLECTION else "keyframes"] += time.perf_counter() - start
+                docs.clear()
+
+    def flush(final: bool = False):
+        """
+        Scrive i chunk delle finestre complete (a fine run tutti), i checkpoint e fotogrammi
+        chiave in attesa e il fotogramma corrente.
+        """
+        write_pending()
+        start = time.perf_counter()
+        if final:
+            stop = len(event_log)
+        else:
+            boundary = (engine.env.now // EVENT_CHUNK_TICKS) * EVENT_CHUNK_TICKS
+            stop = bisect.bisect_left(event_log.t, boundary, live["flushed"])
+        batch = list(chunk_event_log(run_id, event_log, start=live["flushed"], stop=stop, seq=live["seq"]))
+        storage["serialize_events"] += time.perf_counter() - start
+        start = time.perf_counter()
+        if batch:
+            worker_db[CHUNK_COLLECTION].insert_many(batch)
+            chunks.extend(batch)
+            live["flushed"], live["seq"] = stop, live["seq"] + len(batch)
+        # Un solo fotogramma per tick (l'ultimo avanzamento coincide con la fine della run)
+        if engine.env.now != live["tick"]:
+            frames.insert_one({"run_id": run_id, **engine.frame()})
+            live["tick"] = engine.env.now
+        storage["write_events"] += time.perf_counter() - start
+        live["at"] = time.perf_counter()
+
+    def on_progress(tick: float):
+        progress[run_id] = tick
+        if cancel_flags.get(run_id):
+            raise SimulationCancelled()
+        if live["at"] is None or time.perf_counter() - live["at"] >= RUN_LIVE_FLUSH_S:
+            flush()
+
+    def on_checkpoint(state: dict):
+        start = time.perf_counter()
+        pending[CHECKPOINT_COLLECTION].append(checkpoint_doc(run_id, state))
+        storage["checkpoints"] += time.perf_counter() - start
+
+    def on_keyframe(state: dict):
+        start = time.perf_counter()
+        pending[KEYFRAME_COLLECTION].append(checkpoint_doc(run_id, state))
+        storage["keyframes"] += time.perf_counter() - start
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    if cprofile is not None:
+        cprofile.enable()
+    try:
+        engine.run(
+            on_progress=on_progress,
+            # Fermate almeno a ogni finestra di chunk: il primo flush live arriva presto
+            progress_interval=max(1, min(engine.max_ticks // RUN_PROGRESS_UPDATES, EVENT_CHUNK_TICKS)),
+            on_checkpoint=on_checkpoint,
+            checkpoint_interval=RUN_CHECKPOINT_TICKS,
+            on_keyframe=on_keyframe,
+            keyframe_interval=RUN_KEYFRAME_TICKS,
+            series_interval=series_interval_for(engine.max_ticks - engine.env.now),
+        )
+    except SimulationCancelled:
+        checkpoints.delete_many({"run_id": run_id})
+        keyframes.delete_many({"run_id": run_id})
+        worker_db[CHUNK_COLLECTION].delete_many({"run_id": run_id})
+        frames.delete_many({"run_id": run_id})
+        runs.update_one({"_id": oid}, {"$set": {
+            "status": "CANCELLED",
+            "ticks_simulated": engine.env.now,
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+        }})
+        return "CANCELLED"
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    # Ultimi chunk e fotogramma finale; il documento run resta un header leggero.
+    # A livello COUNTERS il log è vuoto e si scrivono solo i fotogrammi.
+    flush(final=True)
+    # Impronta del log per verificare la cache
+    start = time.perf_counter()
+    digest = event_log_digest(event_log)
+    storage["serialize_events"] += time.perf_counter() - start
+    path = archive_path(run_id)
+    if path is not None:
+        # Copia dell'archivio sul volume locale, servita dall'API così com'è con `FileResponse` (scrittura atomica)
+        start = time.perf_counter()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as fp:
+            write_archive(fp, chunks, EVENT_CODEC, meta={"run_id": run_id, "engine_version": ENGINE_VERSION})
+        os.replace(path + ".tmp", path)
+        storage["archive"] = time.perf_counter() - start
+    start = time.perf_counter()
+    worker_db[TIMESERIES_COLLECTION].insert_one(timeseries_doc(run_id, engine.series))
+    storage["timeseries"] = time.perf_counter() - start
+    if engine.provenance is not None:
+        start = time.perf_counter()
+        worker_db[PROVENANCE_COLLECTION].insert_one(provenance_doc(run_id, engine.provenance))
+        storage["provenance"] = time.perf_counter() - start
+    if cprofile is not None:
+        start = time.perf_counter()
+        worker_db[PROFILE_COLLECTION].insert_one(profile_doc(run_id, cprofile))
+        storage["profile"] = time.perf_counter() - start
+
+    if engine.profiler is not None:
+        engine_stats = engine.profiler.stats(engine)
+    else:
+        engine_stats = {"counters": {"visits": engine.counters["visits"]}, "events_by_type": event_log.count_by_type()}
+    stats = {
+        "wall_s": round(wall, 6),
+        "cpu_s": round(cpu, 6),
+        "engine": engine_stats,
+        "storage": {step: round(seconds, 6) for step, seconds in storage.items()},
+    }
+
+    runs.update_one({"_id": oid}, {"$set": {
+        "status": "COMPLETED",
+        # Tick effettivi: minori di `max_ticks` se la run si è fermata in anticipo
+        "ticks_simulated": engine.env.now,
+        "stop_reason": engine.stop_reason,
+        "summary": engine.summary().model_dump(),
+        "event_log_size": len(event_log),
+        "event_chunks": len(chunks),
+        "chunk_ticks": EVENT_CHUNK_TICKS,
+        "event_codec": EVENT_CODEC,
+        "keyframe_ticks": RUN_KEYFRAME_TICKS,
+        "event_log_sha256": digest,
+        "engine_version": ENGINE_VERSION,
+        "stats": stats,
+        "has_profile": cprofile is not None,
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+    }})
+    return "COMPLETED"
+
+
+def profile_doc(run_id: str, cprofile: cProfile.Profile) -> dict:
+    """Profilo cProfile nel formato di `pstats.dump_stats` (marshal), compresso con zlib."""
+    cprofile.create_stats()
+    data = zlib.compress(marshal.dumps(cprofile.stats), 6)
+    return {"run_id": run_id, "size": len(data), "data": Binary(data)}
+
+
+def _mark_running(worker_db, run_id: str):
+    worker_db.simulation_runs.update_one(
+        {"_id": ObjectId(run_id)}, {"$set": {"status": "RUNNING", "started_at": datetime.now(timezone.utc).isoformat()}}
+    )
+
+
+def execute_run_job(
+    run_id: str, scenario_dict: dict, log_level: str, backend: str, progress, cancel_flags, mongo_url: str, db_name: str,
+    profile: Optional[str] = None,
+) -> str:
+    """Corpo del job nel processo worker: simula, pubblica l'avanzamento e salva il risultato."""
+    worker_db = _worker_db(mongo_url, db_name)
+    _mark_running(worker_db, run_id)
+    engine = create_engine(scenario_dict, log_level=log_level, backend=backend)
+    return _simulate_and_store(engine, run_id, worker_db, progress, cancel_flags, profile)
+
+
+def execute_fork_job(
+    run_id: str, fork: dict, log_level: str, backend: str, progress, cancel_flags, mongo_url: str, db_name: str,
+    profile: Optional[str] = None,
+) -> str:
+    """
+    Job di fork: riprende dal checkpoint della run sorgente, riallinea il motore al tick di
+    divergenza con lo scenario originale (se il checkpoint è precedente) e prosegue con lo
+    scenario modificato. Il log del fork contiene solo gli eventi da `fork["tick"]` in poi.
+    """
+    worker_db = _worker_db(mongo_url, db_name)
+    _mark_running(worker_db, run_id)
+
+    state = decode_checkpoint(fork["checkpoint"])
+    if state["tick"] < fork["tick"]:
+        replay = create_engine(fork["source_scenario"], log_level=fork["source_log_level"], backend=backend)
+        replay.restore(state)
+        replay.advance_to(fork["tick"])
+        state = replay.checkpoint()
+
+    engine = create_engine(fork["scenario"], log_level=log_level, backend=backend)
+    engine.restore(state)
+    engine.log_event("FORK", f"Forked from run {fork['parent_run_id']} at tick {fork['tick']}", parent_run_id=fork["parent_run_id"])
+    worker_db.simulation_runs.update_one({"_id": ObjectId(run_id)}, {"$set": {"fork_log_cursor": engine.log_cursor}})
+    return _simulate_and_store(engine, run_id, worker_db, progress, cancel_flags, profile)
+
+
+class RunJobManager:
+    """
+    Coda limitata di job di simulazione su un `ProcessPoolExecutor`. I task di sweep e analisi
+    girano su un secondo pool (`task_executor`): non occupano posti della coda delle run.
+    """
+
+    def __init__(
+        self, mongo_url: str, db_name: str, max_workers: int = RUN_MAX_WORKERS, max_queued: int = RUN_MAX_QUEUED,
+        task_workers: int = TASK_MAX_WORKERS,
+    ):
+        self.mongo_url = mongo_url
+        self.db_name = db_name
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.task_workers = task_workers
+        self.jobs: Dict[str, Future] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._task_executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._progress = None
+        self._cancel = None
+
+    def start(self):
+        # `spawn`: i worker non ereditano i thread di motor/uvicorn del processo API
+        ctx = multiprocessing.get_context("spawn")
+        self._manager = ctx.Manager()
+        self._progress = self._manager.dict()
+        self._cancel = self._manager.dict()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=ctx)
+        self._task_executor = ProcessPoolExecutor(max_workers=self.task_workers, mp_context=ctx)
+
+    @property
+    def task_executor(self) -> Optional[ProcessPoolExecutor]:
+        """Pool dei task di sweep e analisi, condiviso tra tutte le richieste (`task_workers` processi)."""
+        return self._task_executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            for run_id in list(self.jobs):
+                self.cancel(run_id)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._task_executor is not None:
+            self._task_executor.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+
+    def submit(
+        self, run_id: str, scenario_dict: dict, log_level: str = "FULL", backend: str = "SIMPY", profile: Optional[str] = None
+    ) -> "asyncio.Future":
+        """Accoda un job; ritorna un future asyncio che si risolve con lo stato finale."""
+        return self._submit(execute_run_job, run_id, scenario_dict, log_level, backend, profile)
+
+    def submit_fork(
+        self, run_id: str, fork: dict, log_level: str = "FULL", backend: str = "SIMPY", profile: Optional[str] = None
+    ) -> "asyncio.Future":
+        """Accoda un fork da checkpoint (vedi `execute_fork_job`)."""
+        return self._submit(execute_fork_job, run_id, fork, log_level, backend, profile)
+
+    def _submit(self, job_fn, run_id: str, payload, log_level: str, backend: str, profile: Optional[str] = None) -> "asyncio.Future":
+        if len(self.jobs) >= self.max_workers + self.max_queued:
+            raise QueueFullError()
+        self._progress[run_id] = 0
+        fut = self._executor.submit(
+            job_fn, run_id, payload, log_level, backend, self._progress, self._cancel, self.mongo_url, self.db_name, profile
+        )
+        self.jobs[run_id] = fut
+        fut.add_done_callback(lambda _: self._forget(run_id))
+        return asyncio.wrap_future(fut)
+
+    def _forget(self, run_id: str):
+        self.jobs.pop(run_id, None)
+        self._progress.pop(run_id, None)
+        self._cancel.pop(run_id, None)
+
+    def progress_of(self, run_id: str) -> Optional[float]:
+        if run_id not in self.jobs:
+            return None
+        return self._progress.get(run_id)
+
+    def cancel(self, run_id: str) -> bool:
+        """Cancella un job in coda, o chiede a quello in esecuzione di fermarsi al prossimo checkpoint."""
+        fut = self.jobs.get(run_id)
+        if fut is None:
+            return False
+        if fut.cancel():
+            return True
+        self._cancel[run_id] = True
+        return True
@@ -1,27 +1,168 @@
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Query, Request, status
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
+import hashlib
+import io
+import json
+import marshal
+import pstats
+import zlib
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from contextlib import asynccontextmanager
 from bson import ObjectId
 
 # Importiamo i modelli definiti (usando path relativo dal package engine)
-from .engine.models import ScenarioInput
+from .engine.models import EngineBackend, ForkRequest, LogLevel, ProfileMode, ScenarioInput
+from .engine.sweep import apply_overrides
+
+from .jobs import LIVE_FRAME_COLLECTION, PROFILE_COLLECTION, QueueFullError, RunJobManager
+from .metrics import DB_WRITES, REGISTRY, RequestMetricsMiddleware, observe_run
+from .engine.event_archive import ArchiveWriter, codec_available, recode
+from .event_store import (
+    CHUNK_COLLECTION, CHUNK_EVENTS_PROJECTION, CHUNK_INDEX, EVENT_CODEC, archive_path, chunk_events, chunk_query, filter_events,
+)
+from .checkpoint_store import (
+    CHECKPOINT_COLLECTION, CHECKPOINT_INDEX, KEYFRAME_COLLECTION, apply_event_delta, checkpoint_query, decode_checkpoint,
+)
+from .run_cache import (
+    CACHEABLE_STATUSES, RUN_CACHE_COLLECTION, RUN_CACHE_MAX_ENTRIES, RUN_CACHE_TTL_S,
+    event_log_digest, run_cache_key, sweep_task_cache_key,
+)
+from .engine.simulator import ENGINE_VERSION
+from .engine.timeseries import SERIES_METRICS, downsample
+from .timeseries_store import TIMESERIES_COLLECTION, series_from_doc
+from .provenance_store import PROVENANCE_COLLECTION, graph_from_doc
+import numpy as np
 
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "hai_simulator")
+# Pool di connessioni Motor dell'API (le richieste concorrenti oltre `maxPoolSize` attendono una connessione libera)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
 client = None
 db = None
+run_jobs = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global client, db
-    client = AsyncIOMotorClient(MONGO_URL)
-    db = client.hai_simulator
+    global client, db, run_jobs
+    client = AsyncIOMotorClient(MONGO_URL, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE)
+    db = client[MONGO_DB_NAME]
     print(f"Connected to MongoDB at {MONGO_URL}")
+    await ensure_indexes(db)
+    run_jobs = RunJobManager(MONGO_URL, MONGO_DB_NAME)
+    run_jobs.start()
     yield
+    # L'arresto del manager multiprocessing è bloccante: fuori dall'event loop
+    await asyncio.to_thread(run_jobs.shutdown)
     if client:
         client.close()
 
+# --- Accesso ai dati: indici, paginazione a cursore, proiezioni ---
+
+# Indici per collection: (chiavi, opzioni), creati all'avvio (idempotenti)
+INDEXES = {
+    "simulation_runs": [
+        ([("scenario_id", 1), ("_id", -1)], {}), # Run di uno scenario, dalla più recente
+        ([("timestamp", -1)], {}),
+        ([("cache_key", 1)], {}),
+    ],
+    RUN_CACHE_COLLECTION: [([("last_hit_at", 1)], {"expireAfterSeconds": RUN_CACHE_TTL_S})],
+    CHUNK_COLLECTION: [(CHUNK_INDEX, {})],
+    CHECKPOINT_COLLECTION: [(CHECKPOINT_INDEX, {})],
+    KEYFRAME_COLLECTION: [(CHECKPOINT_INDEX, {})],
+    TIMESERIES_COLLECTION: [([("run_id", 1)], {})],
+    PROVENANCE_COLLECTION: [([("run_id", 1)], {})],
+    LIVE_FRAME_COLLECTION: [([("run_id", 1), ("tick", 1)], {})],
+    "sweeps": [([("timestamp", -1)], {})],
+    "sweep_rows": [
+        ([("sweep_id", 1), ("task_key", 1)], {"unique": True}),
+        ([("sweep_id", 1), ("_id", 1)], {}), # Pagine di righe a cursore
+        ([("cache_key", 1)], {}),
+    ],
+}
+
+async def ensure_indexes(database):
+    """Crea gli indici di `INDEXES` (nessun effetto se esistono già)."""
+    for name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            await database[name].create_index(keys, **options)
+
+PAGE_LIMIT_DEFAULT = 100
+PAGE_LIMIT_MAX = 1000
+
+# Campi selezionabili con `fields` nei listing: nome nella risposta -> path nel documento
+SCENARIO_LIST_FIELDS = {
+    "name": "scenario_meta.name",
+    "description": "scenario_meta.description",
+    "seed": "scenario_meta.seed",
+    "pathogen": "pathogen.type",
+    "max_ticks": "simulation.max_ticks",
+    "decay_mode": "simulation.decay_mode",
+}
+SCENARIO_LIST_DEFAULT = "name,description"
+RUN_LIST_FIELDS = {
+    "status": "status",
+    "timestamp": "timestamp",
+    "finished_at": "finished_at",
+    "engine": "engine",
+    "log_level": "log_level",
+    "ticks_simulated": "ticks_simulated",
+    "stop_reason": "stop_reason",
+    "event_log_size": "event_log_size",
+    "parent_run_id": "parent_run_id",
+    "fork_tick": "fork_tick",
+    "infections": "summary.infections",
+    "attack_rate": "summary.attack_rate",
+    "final_states": "summary.final_states",
+    "summary": "summary",
+}
+RUN_LIST_DEFAULT = "status,timestamp,engine,log_level,ticks_simulated,infections,attack_rate"
+
+def _list_fields(fields: str, allowed: dict) -> dict:
+    """Campi richiesti (nome -> path); 422 per nomi sconosciuti."""
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in names if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Campi non disponibili: {', '.join(unknown)} (ammessi: {', '.join(allowed)})")
+    return {f: allowed[f] for f in names}
+
+def _pluck(doc: dict, path: str):
+    for key in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+async def _find_page(collection, query: dict, fields: Optional[dict], limit: int, cursor: Optional[str], response: Response, newest_first: bool) -> List[dict]:
+    """
+    Pagina di un listing con paginazione a cursore su `_id` (indice, nessuno `skip`): al più `limit`
+    documenti dopo `cursor` con i soli `fields` (proiezione per inclusione: payload pesanti come gli
+    eventi non vengono mai letti; None = documenti interi senza i campi filtrati da `query`).
+    Se ci sono altre pagine l'`_id` dell'ultimo documento va nell'header `X-Next-Cursor`, da
+    passare come `cursor` alla richiesta successiva.
+    """
+    if fields is None:
+        projection = {key: 0 for key in query} or None
+    else:
+        projection = {path: 1 for path in fields.values()}
+    if cursor is not None:
+        if not ObjectId.is_valid(cursor):
+            raise HTTPException(status_code=400, detail="Cursore non valido")
+        query = {**query, "_id": {"$lt" if newest_first else "$gt": ObjectId(cursor)}}
+    docs = await collection.find(query, projection).sort("_id", -1 if newest_first else 1).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers["X-Next-Cursor"] = str(docs[-1]["_id"])
+    if fields is None:
+        return [{"id": str(doc.pop("_id")), **doc} for doc in docs]
+    return [{"id": str(doc["_id"]), **{name: _pluck(doc, path) for name, path in fields.items()}} for doc in docs]
+
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
 app = FastAPI(title="HAI Simulator API", version="0.1.0", lifespan=lifespan)
 
@@ -32,7 +173,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"], # Cursore della pagina successiva nei listing
 )
+# Compressione gzip negoziata con `Accept-Encoding` (risposte JSON e NDJSON oltre 1 KB)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+app.add_middleware(RequestMetricsMiddleware)
+
+REGISTRY.gauge("hai_run_jobs_active", "Run in coda o in esecuzione nel pool", lambda: len(run_jobs.jobs) if run_jobs else 0)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Metriche aggregate (richieste, scritture DB, run e motore) in formato testo Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     return {"message": "HAI Simulator API is running"}
@@ -54,23 +207,23 @@ async def create_scenario(scenario: ScenarioInput):
     e lo salva su MongoDB nella collection `scenarios`.
     """
     scenario_dict = scenario.model_dump()
-    result = await db.scenarios.insert_one(scenario_dict)
+    with DB_WRITES.time(collection="scenarios", op="insert_one"):
+        result = await db.scenarios.insert_one(scenario_dict)
     return {"id": str(result.inserted_id), "message": "Scenario created successfully"}
 
 @app.get("/scenarios")
-async def list_scenarios():
+async def list_scenarios(
+    response: Response,
+    limit: int = Query(PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    cursor: Optional[str] = None,
+    fields: str = SCENARIO_LIST_DEFAULT,
+):
     """
-    Ritorna la lista degli scenari salvati con il loro nome e descrizione.
+    Ritorna la lista degli scenari salvati (in ordine di creazione) con i campi `fields`
+    (default nome e descrizione). Paginata: il cursore della pagina successiva è
+    nell'header `X-Next-Cursor` (assente sull'ultima pagina).
     """
-    scenarios = []
-    cursor = db.scenarios.find({}, {"scenario_meta": 1})
-    async for doc in cursor:
-        scenarios.append({
-            "id": str(doc["_id"]),
-            "name": doc["scenario_meta"].get("name"),
-            "description": doc["scenario_meta"].get("description")
-        })
-    return scenarios
+    return await _find_page(db.scenarios, {}, _list_fields(fields, SCENARIO_LIST_FIELDS), limit, cursor, response, newest_first=False)
 
 @app.get("/scenarios/{scenario_id}")
 async def get_scenario(scenario_id: str):
@@ -87,13 +240,98 @@ async def get_scenario(scenario_id: str):
     doc["id"] = str(doc.pop("_id"))
     return doc
 
-from .engine.simulator import HAISimulatorEngine
+@app.get("/scenarios/{scenario_id}/runs")
+async def list_scenario_runs(
+    scenario_id: str,
+    response: Response,
+    limit: int = Query(PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    cursor: Optional[str] = None,
+    fields: str = RUN_LIST_DEFAULT,
+    status_filter: Optional[str] = Query(None, alias="status"),
+):
+    """
+    Run di uno scenario (fork compresi), dalla più recente: solo i campi di riepilogo `fields`,
+    mai eventi né checkpoint. Paginata come `GET /scenarios` (header `X-Next-Cursor`).
+    """
+    if not ObjectId.is_valid(scenario_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    if await db.scenarios.find_one({"_id": ObjectId(scenario_id)}, {"_id": 1}) is None:
+        raise HTTPException(status_code=404, detail="Scenario not found")
+    query = {"scenario_id": scenario_id}
+    if status_filter is not None:
+        query["status"] = status_filter
+    return await _find_page(db.simulation_runs, query, _list_fields(fields, RUN_LIST_FIELDS), limit, cursor, response, newest_first=True)
+
+async def _watch_run_job(run_id: str, job):
+    """Allinea il documento della run se il job termina senza che il worker l'abbia aggiornato."""
+    try:
+        final_status = await job
+    except asyncio.CancelledError:
+        # Cancellata prima di partire: il worker non l'ha mai vista
+        await db.simulation_runs.update_one(
+            {"_id": ObjectId(run_id), "status": "QUEUED"}, {"$set": {"status": "CANCELLED"}}
+        )
+    except Exception as e:
+        await db.simulation_runs.update_one(
+            {"_id": ObjectId(run_id)}, {"$set": {"status": "FAILED", "error": str(e)}}
+        )
+        observe_run("FAILED", None)
+    else:
+        # Statistiche della run salvate dal worker, sommate alle metriche aggregate
+        doc = await db.simulation_runs.find_one({"_id": ObjectId(run_id)}, {"stats": 1})
+        observe_run(final_status, (doc or {}).get("stats"))
+
+async def _cached_run(cache_key: str) -> Optional[dict]:
+    """Run associata alla chiave di cache, se ancora valida (in coda, in esecuzione o completata)."""
+    entry = await db[RUN_CACHE_COLLECTION].find_one({"_id": cache_key})
+    if entry is None:
+        return None
+    run = await db.simulation_runs.find_one({"_id": ObjectId(entry["run_id"])}, {"status": 1})
+    if run is None or run.get("status", "COMPLETED") not in CACHEABLE_STATUSES:
+        # Run fallita, cancellata o rimossa: la voce non vale più
+        await db[RUN_CACHE_COLLECTION].delete_one({"_id": cache_key})
+        return None
+    await db[RUN_CACHE_COLLECTION].update_one(
+        {"_id": cache_key}, {"$set": {"last_hit_at": datetime.now(timezone.utc)}, "$inc": {"hits": 1}}
+    )
+    return run
+
+async def _store_in_cache(cache_key: str, run_id: str):
+    now = datetime.now(timezone.utc)
+    with DB_WRITES.time(collection=RUN_CACHE_COLLECTION, op="replace_one"):
+        await db[RUN_CACHE_COLLECTION].replace_one(
+            {"_id": cache_key},
+            {"run_id": run_id, "engine_version": ENGINE_VERSION, "created_at": now, "last_hit_at": now, "hits": 0},
+            upsert=True,
+        )
+    # Tetto di dimensione: si scartano le voci usate meno di recente
+    excess = await db[RUN_CACHE_COLLECTION].estimated_document_count() - RUN_CACHE_MAX_ENTRIES
+    if excess > 0:
+        cursor = db[RUN_CACHE_COLLECTION].find({}, {"_id": 1}).sort("last_hit_at", 1).limit(excess)
+        stale = [d["_id"] async for d in cursor]
+        await db[RUN_CACHE_COLLECTION].delete_many({"_id": {"$in": stale}})
 
-@app.post("/scenarios/{scenario_id}/run")
-async def run_simulation(scenario_id: str):
+@app.post("/scenarios/{scenario_id}/run", status_code=status.HTTP_202_ACCEPTED)
+async def run_simulation(
+    scenario_id: str,
+    log_level: LogLevel = "FULL",
+    engine: EngineBackend = "SIMPY",
+    use_cache: bool = True,
+    profile: Optional[ProfileMode] = None,
+):
     """
-    Innesca l'engine SimPy per lo scenario richiesto.
-    Salva il risultato EventLog risultante in MongoDB.
+    Accoda una run dello scenario richiesto sul backend scelto con `engine` (SIMPY di default,
+    HEAP o PARTITIONED) e ritorna subito il run id. L'esecuzione avviene nel pool di processi;
+    il worker salva l'EventLog in MongoDB.
+    Con `log_level` EPIDEMIC_ONLY o COUNTERS gli eventi per-visita non vengono generati
+    né salvati: la run conserva solo il riepilogo (`summary`).
+    `engine=HEAP` usa il backend a heap, più veloce e con la stessa sequenza di eventi.
+    `engine=PARTITIONED` divide i reparti tra processi (`PARTITION_WORKERS`): sequenza propria,
+    riproducibile per qualunque numero di processi, senza checkpoint (niente fork) né provenienza.
+    Se lo stesso scenario (stesso seed, stessa versione del motore e livello di log) è già
+    stato eseguito, ritorna subito la run esistente (`cached: true`); `use_cache=false` forza il ricalcolo.
+    `profile=PHASES` registra i timer di fase del motore in `stats`; `profile=CPROFILE` salva il
+    profilo cProfile scaricabile da `/runs/{id}/profile`. Una run profilata non legge la cache.
     """
     if not ObjectId.is_valid(scenario_id):
          raise HTTPException(status_code=400, detail="Invalid ID format")
@@ -104,41 +342,934 @@ async def run_simulation(scenario_id: str):
         raise HTTPException(status_code=404, detail="Scenario non trovato")
     
     scenario_dict["scenario_id"] = str(scenario_dict.pop("_id"))
+
+    # 2. Cache indirizzata per contenuto (SIMPY e HEAP condividono la chiave, PARTITIONED no)
+    cache_key = run_cache_key(scenario_dict, log_level, engine)
+    if use_cache and profile is None:
+        cached = await _cached_run(cache_key)
+        if cached is not None:
+            return {
+                "message": "Run già calcolata per questo scenario.",
+                "run_id": str(cached["_id"]),
+                "status": cached.get("status", "COMPLETED"),
+                "cached": True,
+            }
     
-    # 2. Avvio Simulatore Engine Sincrono
-    # In un vero sistema heavy-load useremmo Celery, ma per l'MVP il worker python va bene.
-    engine = HAISimulatorEngine(scenario_dict)
-    event_log = engine.run()
-    
-    # 3. Salvataggio Log in Mongo
+    # 3. Documento run in stato QUEUED (il worker lo completa)
     run_doc = {
         "scenario_id": scenario_id,
         "scenario_name": scenario_dict.get("scenario_meta", {}).get("name", "Unknown"),
-        "timestamp": os.getenv("CURRENT_TIME", "Now"), # or datetime.utcnow()
-        "ticks_simulated": engine.max_ticks,
-        "event_log_size": len(event_log),
-        "events": event_log
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "status": "QUEUED",
+        "log_level": log_level,
+        "engine": engine,
+        "profile": profile,
+        "cache_key": cache_key,
+        "ticks_simulated": scenario_dict.get("simulation", {}).get("max_ticks", 1000),
+        "event_log_size": 0
     }
+    with DB_WRITES.time(collection="simulation_runs", op="insert_one"):
+        res = await db.simulation_runs.insert_one(run_doc)
+    run_id = str(res.inserted_id)
+
+    # 4. Accodamento nel pool di worker
+    try:
+        job = run_jobs.submit(run_id, scenario_dict, log_level, engine, profile)
+    except QueueFullError:
+        await db.simulation_runs.delete_one({"_id": res.inserted_id})
+        raise HTTPException(status_code=503, detail="Coda delle simulazioni piena, riprovare più tardi")
+    asyncio.create_task(_watch_run_job(run_id, job))
+    await _store_in_cache(cache_key, run_id)
     
-    res = await db.simulation_runs.insert_one(run_doc)
+    return {
+        "message": "Simulazione accodata.", 
+        "run_id": run_id,
+        "status": "QUEUED",
+        "cached": False,
+    }
+
+@app.get("/runs/{run_id}/status")
+async def get_run_status(run_id: str):
+    """
+    Stato di una run (QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED) con l'avanzamento
+    in tick mentre è in esecuzione.
+    """
+    if not ObjectId.is_valid(run_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
     
+    doc = await db.simulation_runs.find_one(
+        {"_id": ObjectId(run_id)}, {"status": 1, "ticks_simulated": 1, "event_log_size": 1, "error": 1}
+    )
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Run non trovata")
+
+    run_status = doc.get("status", "COMPLETED")
+    max_ticks = doc.get("ticks_simulated", 0)
+    current_tick = run_jobs.progress_of(run_id)
+    if current_tick is None:
+        current_tick = max_ticks if run_status == "COMPLETED" else 0
     return {
-        "message": f"Simulazione completata.", 
-        "run_id": str(res.inserted_id),
-        "total_events": len(event_log)
+        "run_id": run_id,
+        "status": run_status,
+        "current_tick": current_tick,
+        "max_ticks": max_ticks,
+        "progress": round(current_tick / max_ticks, 4) if max_ticks else 0.0,
+        "total_events": doc.get("event_log_size", 0),
+        "error": doc.get("error"),
     }
 
+@app.post("/runs/{run_id}/cancel", status_code=status.HTTP_202_ACCEPTED)
+async def cancel_run(run_id: str):
+    """Cancella una run in coda o in esecuzione."""
+    if not ObjectId.is_valid(run_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    if not run_jobs.cancel(run_id):
+        raise HTTPException(status_code=409, detail="Run non attiva")
+    return {"run_id": run_id, "message": "Cancellazione richiesta"}
+
+# Campi dell'header usati per segmenti e ETag
+_ETAG_PROJECTION = {"parent_run_id": 1, "fork_tick": 1, "status": 1, "event_log_sha256": 1}
+
+def _run_etag(doc: dict, request: Request) -> Optional[str]:
+    """
+    ETag (debole: la codifica gzip cambia i byte) delle risposte su una run completata, che
+    non cambia più: impronta del log del worker combinata con path e query della richiesta.
+    None per run non completate, che non vanno messe in cache.
+    """
+    if doc.get("status") != "COMPLETED" or "event_log_sha256" not in doc:
+        return None
+    key = f'{doc["event_log_sha256"]}|{request.url.path}?{request.url.query}'
+    return 'W/"%s"' % hashlib.sha256(key.encode()).hexdigest()[:32]
+
+def _not_modified(request: Request, etag: Optional[str]) -> bool:
+    """True se `If-None-Match` contiene l'ETag corrente (confronto debole, `*` compreso)."""
+    if etag is None:
+        return False
+    candidates = {c.strip() for c in request.headers.get("if-none-match", "").split(",")}
+    return "*" in candidates or etag in candidates or etag[2:] in candidates
+
+async def _event_segments(doc: dict) -> List[Tuple[str, Optional[float]]]:
+    """
+    Run da cui leggere gli eventi di `doc`, dalla radice: un fork eredita dalla run madre
+    gli eventi precedenti al proprio `fork_tick` (limite esclusivo, None = nessun limite).
+    """
+    segments = [(str(doc["_id"]), None)]
+    upper = None
+    while doc.get("parent_run_id"):
+        upper = doc["fork_tick"] if upper is None else min(upper, doc["fork_tick"])
+        doc = await db.simulation_runs.find_one({"_id": ObjectId(doc["parent_run_id"])}, {"parent_run_id": 1, "fork_tick": 1})
+        if doc is None:
+            break
+        segments.insert(0, (str(doc["_id"]), upper))
+    return segments
+
 @app.get("/runs/{run_id}")
-async def get_run_results(run_id: str):
+async def get_run_results(run_id: str, request: Request, response: Response, include_events: bool = False):
     """
-    Recupera i risultati di una simulazione (incluso l'array events)
+    Recupera l'header di una simulazione. L'array completo `events` viene
+    ricostruito dai chunk solo se richiesto con `include_events=true`
+    (per un fork, prefisso della run madre incluso).
     """
     if not ObjectId.is_valid(run_id):
          raise HTTPException(status_code=400, detail="Invalid ID format")
     
-    doc = await db.simulation_runs.find_one({"_id": ObjectId(run_id)})
+    projection = {"scenario": 0} if include_events else {"events": 0, "scenario": 0}
+    doc = await db.simulation_runs.find_one({"_id": ObjectId(run_id)}, projection)
     if doc is None:
         raise HTTPException(status_code=404, detail="Run non trovata")
-    
+    etag = _run_etag(doc, request)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if include_events and "events" not in doc:
+        events = []
+        for source_id, upper in await _event_segments(doc):
+            cursor = db[CHUNK_COLLECTION].find(chunk_query(source_id, None, upper), CHUNK_EVENTS_PROJECTION).sort(CHUNK_INDEX[1:])
+            async for chunk in cursor:
+                events.extend(e for e in chunk_events(chunk) if upper is None or e["t"] < upper)
+        doc["events"] = events
+    doc["id"] = str(doc.pop("_id"))
+    if etag:
+        response.headers["ETag"] = etag
+    return doc
+
+@app.get("/runs/{run_id}/events")
+async def stream_run_events(
+    run_id: str, request: Request, from_tick: Optional[float] = None, to_tick: Optional[float] = None, types: Optional[str] = None,
+):
+    """
+    Stream NDJSON degli eventi di una run nell'intervallo di tick richiesto,
+    opzionalmente filtrati per tipo (`types=MOVE,INFECTION`). Legge solo i chunk necessari.
+    """
+    if not ObjectId.is_valid(run_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    header = await db.simulation_runs.find_one({"_id": ObjectId(run_id)}, _ETAG_PROJECTION)
+    if header is None:
+        raise HTTPException(status_code=404, detail="Run non trovata")
+    etag = _run_etag(header, request)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    type_set = set(types.split(",")) if types else None
+    segments = await _event_segments(header)
+
+    async def ndjson():
+        for source_id, upper in segments:
+            if upper is not None and from_tick is not None and from_tick >= upper:
+                continue
+            seg_to = upper if to_tick is None else (to_tick if upper is None else min(to_tick, upper))
+            cursor = db[CHUNK_COLLECTION].find(chunk_query(source_id, from_tick, seg_to), CHUNK_EVENTS_PROJECTION).sort(CHUNK_INDEX[1:])
+            async for chunk in cursor:
+                events = filter_events(chunk_events(chunk), from_tick, to_tick, type_set)
+                lines = [json.dumps(e) for e in events if upper is None or e["t"] < upper]
+                if lines:
+                    yield "\n".join(lines) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson", headers={"ETag": etag} if etag else None)
+
+@app.get("/runs/{run_id}/archive")
+async def download_run_archive(run_id: str, request: Request):
+    """
+    Archivio binario `.hailog` del log della run (blocchi compressi con indice, vedi
+    `engine.event_archive`), da decodificare con `python -m src.engine.event_archive`.
+    Se la run ha una copia sul volume locale la si invia così com'è (`FileResponse`), altrimenti
+    l'archivio è composto in streaming dai blocchi dei chunk (per un fork, prefisso della run
+    madre incluso, ricompresso se la madre usa un altro codec; 409 se il codec manca sul server).
+    """
+    if not ObjectId.is_valid(run_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    header = await db.simulation_runs.find_one({"_id": ObjectId(run_id)}, {**_ETAG_PROJECTION, "engine_version": 1, "event_codec": 1})
+    if header is None:
+        raise HTTPException(status_code=404, detail="Run non trovata")
+    if header.get("status") != "COMPLETED":
+        raise HTTPException(status_code=409, detail="Run non completata")
+    etag = _run_etag(header, request)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    # I blocchi sono già compressi: `identity` evita la ricompressione gzip
+    headers = {
+        **({"ETag": etag} if etag else {}),
+        "Content-Encoding": "identity",
+        "Content-Disposition": f'attachment; filename="run_{run_id}.hailog"',
+    }
+    path = archive_path(run_id)
+    if path is not None and not header.get("parent_run_id") and os.path.exists(path):
+        return FileResponse(path, media_type="application/octet-stream", headers=headers)
+    segments = await _event_segments(header)
+    codec = header.get("event_codec", EVENT_CODEC)
+    # I blocchi ereditati da un fork possono avere un codec diverso da quello della run:
+    # vanno ricompressi, e se qui manca uno dei due codec l'archivio non è componibile
+    codecs = {codec}
+    for source_id, upper in segments:
+        codecs.update(await db[CHUNK_COLLECTION].distinct("codec", chunk_query(source_id, None, upper)))
+    missing = sorted(c for c in codecs if not codec_available(c))
+    if missing:
+        raise HTTPException(status_code=409, detail=f"Codec non disponibile sul server: {', '.join(missing)}")
+
+    async def archive():
+        writer = ArchiveWriter(codec)
+        yield writer.header()
+        for source_id, upper in segments:
+            cursor = db[CHUNK_COLLECTION].find(chunk_query(source_id, None, upper), {"events": 0}).sort(CHUNK_INDEX[1:])
+            async for chunk in cursor:
+                if "block" not in chunk:
+                    raise RuntimeError(f"Chunk in formato legacy (run {source_id}): archivio non disponibile")
+                block = chunk["block"]
+                if chunk["codec"] != codec:
+                    block = await asyncio.to_thread(recode, block, chunk["codec"], codec)
+                yield writer.block(block, chunk["n"], chunk["t_start"], chunk["t_end"], upper)
+        yield writer.footer({"run_id": run_id, "engine_version": header.get("engine_version")})
+
+    return StreamingResponse(archive(), media_type="application/octet-stream", headers=headers)
+
+# Streaming live: intervallo di polling su MongoDB e chunk letti per volta da ogni client
+LIVE_POLL_S = float(os.getenv("LIVE_POLL_S", "0.25"))
+LIVE_BATCH = int(os.getenv("LIVE_BATCH", "20"))
+_ACTIVE_STATUSES = ("QUEUED", "RUNNING")
+
+def _sse(event: str, data, event_id: Optional[str] = None) -> str:
+    head = f"event: {event}\n" + (f"id: {event_id}\n" if event_id else "")
+    return head + "data: " + json.dumps(data, separators=(",", ":")) + "\n\n"
+
+@app.get("/runs/{run_id}/live")
+async def stream_run_live(run_id: str, request: Request):
+    """
+    Server-Sent Events di una run mentre è in esecuzione: `events` (lista degli eventi di un
+    chunk), `frame` (aggregati correnti, vedi `HAISimulatorEngine.frame`) ed `end` con lo
+    stato finale. Il worker salva chunk e fotogrammi durante la run, quindi un client che si
+    collega tardi riceve prima il prefisso già salvato (per un fork, anche quello della run
+    madre) e poi segue la coda. Ogni messaggio ha id `seq:tick`: alla riconnessione il browser
+    manda `Last-Event-ID` e lo stream riprende da lì.
+
+    Il flusso è guidato dal client: ogni connessione legge al più `LIVE_BATCH` chunk per volta
+    e passa al successivo solo dopo averli inviati, quindi un client lento resta indietro
+    senza accumulare eventi in memoria e senza rallentare il worker.
+    """
+    if not ObjectId.is_valid(run_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    header = await db.simulation_runs.find_one({"_id": ObjectId(run_id)}, _ETAG_PROJECTION)
+    if header is None:
+        raise HTTPException(status_code=404, detail="Run non trovata")
+    resume = request.headers.get("last-event-id")
+    last_seq, last_tick = -1, -1.0
+    if resume:
+        try:
+            seq, tick = resume.split(":")
+            last_seq, last_tick = int(seq), float(tick)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID non valido")
+    segments = await _event_segments(header)
+
+    async def stream():
+        nonlocal last_seq, last_tick
+        yield "retry: 2000\n\n"
+        # Prefisso ereditato dalla run madre (senza id: si rimanda solo a stream nuovo)
+        if not resume:
+            for source_id, upper in segments[:-1]:
+                cursor = db[CHUNK_COLLECTION].find(chunk_query(source_id, None, upper), CHUNK_EVENTS_PROJECTION).sort(CHUNK_INDEX[1:])
+                async for chunk in cursor:
+                    events = [e for e in chunk_events(chunk) if e["t"] < upper]
+                    if events:
+                        yield _sse("events", events)
+        while True:
+            # Stato letto prima dei dati: se era già terminale, i dati letti dopo sono completi
+            doc = await db.simulation_runs.find_one({"_id": ObjectId(run_id)}, {"status": 1})
+            run_status = doc.get("status", "COMPLETED") if doc else "CANCELLED"
+            chunks = await db[CHUNK_COLLECTION].find(
+                {"run_id": run_id, "seq": {"$gt": last_seq}}, {**CHUNK_EVENTS_PROJECTION, "seq": 1, "t_end": 1},
+            ).sort(CHUNK_INDEX[1:]).limit(LIVE_BATCH).to_list(None)
+            tick_query = {"$gt": last_tick}
+            if len(chunks) == LIVE_BATCH:
+                # Batch pieno: i fotogrammi oltre l'ultimo chunk arrivano col prossimo giro
+                tick_query["$lte"] = chunks[-1]["t_end"]
+            frames = await db[LIVE_FRAME_COLLECTION].find(
+                {"run_id": run_id, "tick": tick_query}, {"_id": 0, "run_id": 0},
+            ).sort("tick", 1).to_list(None)
+
+            if not chunks and not frames:
+                if run_status not in _ACTIVE_STATUSES:
+                    yield _sse("end", {"run_id": run_id, "status": run_status}, f"{last_seq}:{last_tick}")
+                    return
+                yield ": keepalive\n\n"
+                await asyncio.sleep(LIVE_POLL_S)
+                continue
+            # Ordine per tick: un fotogramma precede i chunk delle finestre che terminano dopo di lui
+            i = 0
+            for chunk in chunks:
+                while i < len(frames) and frames[i]["tick"] < chunk["t_end"]:
+                    last_tick = frames[i]["tick"]
+                    yield _sse("frame", frames[i], f"{last_seq}:{last_tick}")
+                    i += 1
+                last_seq = chunk["seq"]
+                yield _sse("events", list(chunk_events(chunk)), f"{last_seq}:{last_tick}")
+            for frame in frames[i:]:
+                last_tick = frame["tick"]
+                yield _sse("frame", frame, f"{last_seq}:{last_tick}")
+
+    # Niente gzip (tratterrebbe i messaggi nel buffer del compressore) né buffering del proxy
+    headers = {"Content-Encoding": "identity", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=headers)
+
+class _LoadedProfile:
+    """Adattatore per `pstats.Stats`: accetta oggetti con `create_stats()` e `stats`."""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+@app.get("/runs/{run_id}/profile")
+async def get_run_profile(run_id: str, format: str = Query("prof", pattern="^(prof|text)$"), limit: int = Query(40, ge=1, le=500)):
+    """
+    Profilo cProfile di una run eseguita con `profile=CPROFILE`: `format=prof` scarica il file
+    per `pstats`/snakeviz, `format=text` ritorna le prime `limit` funzioni per tempo cumulativo.
+    """
+    if not ObjectId.is_valid(run_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    doc = await db[PROFILE_COLLECTION].find_one({"run_id": run_id})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Profilo non disponibile (run senza profile=CPROFILE)")
+    data = zlib.decompress(doc["data"])
+    if format == "prof":
+        return Response(data, media_type="application/octet-stream", headers={
+            "Content-Disposition": f'attachment; filename="run_{run_id}.prof"',
+        })
+    out = io.StringIO()
+    stats = pstats.Stats(_LoadedProfile(marshal.loads(data)), stream=out)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return PlainTextResponse(out.getvalue())
+
+@app.get("/runs/{run_id}/verify")
+async def verify_run(run_id: str):
+    """Ricalcola lo SHA-256 del log dai chunk salvati e lo confronta con quello registrato dal worker."""
+    if not ObjectId.is_valid(run_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    doc = await db.simulation_runs.find_one({"_id": ObjectId(run_id)}, {"event_log_sha256": 1, "engine_version": 1})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Run non trovata")
+    if "event_log_sha256" not in doc:
+        raise HTTPException(status_code=409, detail="Run senza impronta del log (non completata)")
+
+    events = []
+    cursor = db[CHUNK_COLLECTION].find({"run_id": run_id}, CHUNK_EVENTS_PROJECTION).sort(CHUNK_INDEX[1:])
+    async for chunk in cursor:
+        events.extend(chunk_events(chunk))
+    computed = event_log_digest(events)
+    return {
+        "run_id": run_id,
+        "engine_version": doc.get("engine_version"),
+        "event_log_sha256": doc["event_log_sha256"],
+        "computed_sha256": computed,
+        "valid": computed == doc["event_log_sha256"],
+    }
+
+@app.get("/runs/{run_id}/timeseries")
+async def get_run_timeseries(
+    run_id: str, request: Request, response: Response, metrics: Optional[str] = None, resolution: int = Query(500, ge=1, le=100000),
+):
+    """
+    Serie temporali della run (S/C/I, cariche medie/massime, igiene per campione), ridotte
+    lato server ad al più `resolution` bucket con min/max/media: una sola richiesta leggera
+    per i grafici, indipendentemente dalla durata della run. `metrics=infected,max_room_load`
+    seleziona le metriche (default tutte).
+    """
+    if not ObjectId.is_valid(run_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    header = await db.simulation_runs.find_one({"_id": ObjectId(run_id)}, _ETAG_PROJECTION)
+    if header is None:
+        raise HTTPException(status_code=404, detail="Run non trovata")
+    etag = _run_etag(header, request)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    names = metrics.split(",") if metrics else list(SERIES_METRICS)
+    unknown = [m for m in names if m not in SERIES_METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Metriche sconosciute: {', '.join(unknown)}")
+
+    # Un fork eredita dalla run madre i campioni precedenti al tick di fork
+    ticks, columns, interval = [], {m: [] for m in names}, None
+    for source_id, upper in await _event_segments(header):
+        doc = await db[TIMESERIES_COLLECTION].find_one({"run_id": source_id})
+        if doc is None:
+            continue
+        series = series_from_doc(doc)
+        interval = series.interval
+        t = np.frombuffer(series.t, dtype=np.float64)
+        keep = slice(None) if upper is None else t < upper
+        ticks.append(t[keep])
+        for m in names:
+            columns[m].append(np.frombuffer(series.columns[m], dtype=np.float64)[keep])
+    if interval is None:
+        raise HTTPException(status_code=404, detail="Serie temporali non disponibili per questa run")
+
+    t = np.concatenate(ticks)
+    reduced = downsample(t, {m: np.concatenate(parts) for m, parts in columns.items()}, resolution, names)
+    if etag:
+        response.headers["ETag"] = etag
+    return {"run_id": run_id, "sample_interval": interval, "samples": int(t.shape[0]), **reduced}
+
+@app.get("/runs/{run_id}/state")
+async def get_run_state(run_id: str, request: Request, response: Response, tick: float = Query(..., ge=0)):
+    """
+    Stato completo della run al tick richiesto (stanze, pazienti, operatori): parte dal
+    fotogramma più vicino non successivo al tick (ricerca sull'indice `(run_id, tick)`) e
+    applica solo gli eventi da lì al tick incluso. Le cariche sono quelle del fotogramma
+    (`keyframe_tick`); per log ridotti (non FULL) anche la stanza degli operatori.
+    """
+    if not ObjectId.is_valid(run_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    header = await db.simulation_runs.find_one(
+        {"_id": ObjectId(run_id)}, {**_ETAG_PROJECTION, "log_level": 1, "summary.ticks_simulated": 1}
+    )
+    if header is None:
+        raise HTTPException(status_code=404, detail="Run non trovata")
+    if header.get("status") != "COMPLETED":
+        raise HTTPException(status_code=409, detail="Run non completata")
+    # Run salvate prima dei riepiloghi: nessun intervallo noto, quindi nessun fotogramma
+    max_tick = header.get("summary", {}).get("ticks_simulated")
+    if max_tick is None:
+        raise HTTPException(status_code=404, detail="Stato non disponibile per questa run")
+    if tick > max_tick:
+        raise HTTPException(status_code=400, detail=f"tick fuori intervallo [0, {max_tick}]")
+    etag = _run_etag(header, request)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # Per un fork, i tick precedenti al fork_tick si leggono dalla run madre
+    source_id = next(sid for sid, upper in await _event_segments(header) if upper is None or tick < upper)
+    keyframe = await db[KEYFRAME_COLLECTION].find_one(checkpoint_query(source_id, tick), sort=[("tick", -1)])
+    if keyframe is None:
+        raise HTTPException(status_code=404, detail="Fotogrammi di stato non disponibili per questa run")
+
+    state = decode_checkpoint(keyframe["data"])
+    events = []
+    cursor = db[CHUNK_COLLECTION].find(chunk_query(source_id, state["tick"], tick), CHUNK_EVENTS_PROJECTION).sort(CHUNK_INDEX[1:])
+    async for chunk in cursor:
+        events.extend(chunk_events(chunk))
+    if etag:
+        response.headers["ETag"] = etag
+    return {"run_id": run_id, "log_level": header.get("log_level"), **apply_event_delta(state, events, tick)}
+
+@app.get("/runs/{run_id}/trace/{patient_id}")
+async def trace_patient(run_id: str, patient_id: str, request: Request, response: Response):
+    """
+    Catena di trasmissione dell'infezione di un paziente (albero di tracciabilità, US-4.1):
+    operatore che lo ha infettato, stanze visitate dall'ultimo lavaggio riuscito, e a ritroso
+    raccolte e depositi di carica fino al paziente indice. Legge il grafo di provenienza
+    salvato con la run (costo proporzionale alla profondità della catena, non al log); per un
+    fork la catena prosegue nella run madre oltre il tick di fork.
+    """
+    if not ObjectId.is_valid(run_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    header = await db.simulation_runs.find_one({"_id": ObjectId(run_id)}, _ETAG_PROJECTION)
+    if header is None:
+        raise HTTPException(status_code=404, detail="Run non trovata")
+    if header.get("status") != "COMPLETED":
+        raise HTTPException(status_code=409, detail="Run non completata")
+    etag = _run_etag(header, request)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # Dal grafo della run verso quelli delle run madri (nodi con id precedente al fork)
+    chain, node = [], None
+    for source_id, _ in reversed(await _event_segments(header)):
+        doc = await db[PROVENANCE_COLLECTION].find_one({"run_id": source_id})
+        if doc is None:
+            raise HTTPException(status_code=404, detail="Grafo di provenienza non disponibile (run a livello COUNTERS)")
+        graph = graph_from_doc(doc)
+        if node is None:
+            node = graph.infections.get(patient_id)
+            if node is None:
+                break
+        steps, node = graph.walk(node)
+        chain.extend(steps)
+        if node is None:
+            break
+    if not chain:
+        raise HTTPException(status_code=404, detail=f"Paziente {patient_id} non infettato in questa run")
+    if etag:
+        response.headers["ETag"] = etag
+    return {"run_id": run_id, "patient_id": patient_id, "infected_at": chain[0]["t"], "depth": len(chain), "chain": chain}
+
+async def _run_scenario(doc: dict) -> dict:
+    """Scenario effettivo di una run: quello salvato nel fork, altrimenti lo scenario di origine."""
+    if doc.get("scenario") is not None:
+        return doc["scenario"]
+    scenario_dict = await db.scenarios.find_one({"_id": ObjectId(doc["scenario_id"])})
+    if scenario_dict is None:
+        raise HTTPException(status_code=404, detail="Scenario non trovato")
+    scenario_dict["scenario_id"] = str(scenario_dict.pop("_id"))
+    return scenario_dict
+
+@app.post("/runs/{run_id}/fork", status_code=status.HTTP_202_ACCEPTED)
+async def fork_run(
+    run_id: str,
+    tick: float,
+    request: Optional[ForkRequest] = None,
+    log_level: LogLevel = "FULL",
+    engine: EngineBackend = "SIMPY",
+):
+    """
+    What-if: nuova run che coincide con `run_id` fino a `tick` e da lì prosegue con lo
+    scenario modificato da `overrides`. Riparte dal checkpoint più vicino prima di `tick`,
+    quindi si simulano solo i tick successivi. Gli eventi del fork partono da `tick`;
+    quelli precedenti sono letti dalla run madre.
+    """
+    if not ObjectId.is_valid(run_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    parent = await db.simulation_runs.find_one({"_id": ObjectId(run_id)}, {"events": 0})
+    if parent is None:
+        raise HTTPException(status_code=404, detail="Run non trovata")
+    if parent.get("status", "COMPLETED") != "COMPLETED":
+        raise HTTPException(status_code=409, detail="Il fork richiede una run completata")
+    if engine == "PARTITIONED" or parent.get("engine") == "PARTITIONED":
+        raise HTTPException(status_code=400, detail="Il backend PARTITIONED non supporta i fork (nessun checkpoint)")
+    overrides = request.overrides if request is not None else {}
+
+    # 1. Scenario modificato (validato come uno scenario nuovo)
+    parent_scenario = await _run_scenario(parent)
+    try:
+        patched = ScenarioInput(**apply_overrides(parent_scenario, overrides)).model_dump()
+    except ValueError as e:
+        # Path sconosciuti e ValidationError di Pydantic (sottoclasse di ValueError)
+        raise HTTPException(status_code=422, detail=str(e))
+    if patched["simulation"]["decay_mode"] != parent_scenario.get("simulation", {}).get("decay_mode", "STEPWISE"):
+        raise HTTPException(status_code=400, detail="decay_mode non modificabile in un fork")
+    if not 0 <= tick < min(parent.get("ticks_simulated", 0), patched["simulation"]["max_ticks"]):
+        raise HTTPException(status_code=400, detail="Tick di fork fuori dall'intervallo della run")
+
+    # 2. Checkpoint più vicino: prima del proprio fork_tick un fork coincide con la madre
+    source = parent
+    while source.get("parent_run_id") and tick < source["fork_tick"]:
+        source = await db.simulation_runs.find_one({"_id": ObjectId(source["parent_run_id"])}, {"events": 0})
+        if source is None:
+            raise HTTPException(status_code=404, detail="Run madre non trovata")
+    source_id = str(source["_id"])
+    checkpoint = await db[CHECKPOINT_COLLECTION].find_one(checkpoint_query(source_id, tick), sort=[("tick", -1)])
+    if checkpoint is None:
+        raise HTTPException(status_code=409, detail="Nessun checkpoint disponibile per questa run")
+
+    # 3. Documento run del fork in stato QUEUED
+    run_doc = {
+        "scenario_id": parent.get("scenario_id"),
+        "scenario_name": patched["scenario_meta"]["name"],
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "status": "QUEUED",
+        "log_level": log_level,
+        "engine": engine,
+        "ticks_simulated": patched["simulation"]["max_ticks"],
+        "event_log_size": 0,
+        "parent_run_id": run_id,
+        "fork_tick": tick,
+        "checkpoint_tick": checkpoint["tick"],
+        "overrides": [{"path": path, "value": value} for path, value in overrides.items()],
+        "scenario": patched,
+    }
+    with DB_WRITES.time(collection="simulation_runs", op="insert_one"):
+        res = await db.simulation_runs.insert_one(run_doc)
+    fork_id = str(res.inserted_id)
+
+    fork = {
+        "parent_run_id": run_id,
+        "tick": tick,
+        "checkpoint": bytes(checkpoint["data"]),
+        "source_scenario": await _run_scenario(source),
+        "source_log_level": source.get("log_level", "FULL"),
+        "scenario": patched,
+    }
+    try:
+        job = run_jobs.submit_fork(fork_id, fork, log_level, engine)
+    except QueueFullError:
+        await db.simulation_runs.delete_one({"_id": res.inserted_id})
+        raise HTTPException(status_code=503, detail="Coda delle simulazioni piena, riprovare più tardi")
+    asyncio.create_task(_watch_run_job(fork_id, job))
+
+    return {
+        "message": "Fork accodato.",
+        "run_id": fork_id,
+        "status": "QUEUED",
+        "parent_run_id": run_id,
+        "fork_tick": tick,
+        "checkpoint_tick": checkpoint["tick"],
+    }
+
+# --- Sweep di parametri (Hessian-Run, US-4.2) ---
+
+from .engine.models import SweepRequest
+from .engine.sweep import (
+    SUMMARY_FIELDS, CsvRowWriter, StoppingRule, build_tasks, expand_grid, export_parquet, run_sweep_task,
+    sequential_report, sequential_tasks, task_row,
+)
+
+SWEEP_EXPORT_DIR = os.getenv("SWEEP_EXPORT_DIR", "exports/sweeps")
+SWEEP_FLUSH_ROWS = 50
+active_sweeps = {}
+
+def _stopping_rule(sweep: dict) -> Optional[StoppingRule]:
+    """Regola di arresto sequenziale della sweep (None: numero fisso di repliche)."""
+    if sweep.get("precision") is None:
+        return None
+    return StoppingRule(
+        sweep["precision"], sweep.get("target_metric", "attack_rate"), sweep.get("confidence", 0.95),
+        sweep["replicates"], sweep.get("max_replicates", 1000),
+    )
+
+async def _run_sweep_tasks(sweep: dict, pending: list, flush):
+    """
+    Riusa le righe già calcolate da altre sweep (stessa chiave di cache) e simula le altre nel
+    pool dei task di sweep e analisi (`run_jobs.task_executor`), con al più `max_workers` task in volo.
+    """
+    # Punti già simulati (stesso scenario e seed): righe riusate senza ricalcolo
+    for t in pending:
+        t["cache_key"] = sweep_task_cache_key(t)
+    cached_metrics = {}
+    projection = {"_id": 0, "cache_key": 1, **{f: 1 for f in SUMMARY_FIELDS}}
+    async for row in db.sweep_rows.find({"cache_key": {"$in": [t["cache_key"] for t in pending]}}, projection):
+        cached_metrics.setdefault(row.pop("cache_key"), row)
+    reused = [task_row(t, cached_metrics[t["cache_key"]]) for t in pending if t["cache_key"] in cached_metrics]
+    if reused:
+        await flush(reused)
+    pending = [t for t in pending if t["cache_key"] not in cached_metrics]
+
+    if pending:
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(min(sweep.get("max_workers") or run_jobs.task_workers, len(pending)))
+
+        async def run(task):
+            async with in_flight:
+                return await loop.run_in_executor(run_jobs.task_executor, run_sweep_task, task)
+
+        futures = [asyncio.ensure_future(run(t)) for t in pending]
+        try:
+            buffer = []
+            for fut in asyncio.as_completed(futures):
+                buffer.append(await fut)
+                if len(buffer) >= SWEEP_FLUSH_ROWS:
+                    await flush(buffer)
+                    buffer = []
+            if buffer:
+                await flush(buffer)
+        finally:
+            # Su errore i task non ancora partiti lasciano libero il pool
+            for fut in futures:
+                fut.cancel()
+
+async def _execute_sweep(sweep_id: str):
+    """
+    Esegue (o riprende) una sweep: i task già presenti in `sweep_rows` vengono saltati,
+    quelli già calcolati da altre sweep (stessa chiave di cache) vengono riusati,
+    gli altri girano su un pool di processi e le righe sono scritte a blocchi su Mongo e CSV.
+    Con arresto sequenziale i task arrivano a blocchi: dopo ogni blocco la regola decide quali
+    celle richiedono altre repliche; a fine sweep la stima per cella va in `cells`.
+    """
+    sweep = await db.sweeps.find_one({"_id": ObjectId(sweep_id)})
+    rule = _stopping_rule(sweep)
+    completed = await db.sweep_rows.count_documents({"sweep_id": sweep_id})
+
+    await asyncio.to_thread(os.makedirs, SWEEP_EXPORT_DIR, exist_ok=True)
+    writer = CsvRowWriter(os.path.join(SWEEP_EXPORT_DIR, f"{sweep_id}.csv"), list(sweep["grid"].keys()))
+    await db.sweeps.update_one({"_id": ObjectId(sweep_id)}, {"$set": {"status": "RUNNING", "completed_tasks": completed}})
+
+    async def flush(rows):
+        # Prima Mongo (fonte di verità per la ripresa), poi l'export CSV
+        await db.sweep_rows.insert_many([{"sweep_id": sweep_id, **r} for r in rows])
+        await asyncio.to_thread(writer.write_rows, rows)
+        await db.sweeps.update_one({"_id": ObjectId(sweep_id)}, {"$inc": {"completed_tasks": len(rows)}})
+
+    async def done_rows() -> list:
+        projection = {"_id": 0, "cell_key": 1, "replicate": 1, rule.metric: 1}
+        return [row async for row in db.sweep_rows.find({"sweep_id": sweep_id}, projection)]
+
+    try:
+        while True:
+            if rule is None:
+                tasks = build_tasks(sweep["base_scenario"], sweep["grid"], sweep["replicates"], sweep.get("crn", False))
+                done = {d["task_key"] async for d in db.sweep_rows.find({"sweep_id": sweep_id}, {"task_key": 1})}
+                pending = [t for t in tasks if t["task_key"] not in done]
+            else:
+                rows = await done_rows()
+                pending = sequential_tasks(sweep["base_scenario"], sweep["grid"], rule, rows, sweep.get("crn", False))
+                # Totale noto solo blocco per blocco
+                await db.sweeps.update_one({"_id": ObjectId(sweep_id)}, {"$set": {"total_tasks": len(rows) + len(pending)}})
+            if pending:
+                await _run_sweep_tasks(sweep, pending, flush)
+            if rule is None or not pending:
+                break
+        update = {"status": "COMPLETED"}
+        if rule is not None:
+            update["cells"] = sequential_report(sweep["grid"], rule, await done_rows())
+        await db.sweeps.update_one({"_id": ObjectId(sweep_id)}, {"$set": update})
+    except Exception as e:
+        await db.sweeps.update_one({"_id": ObjectId(sweep_id)}, {"$set": {"status": "FAILED", "error": str(e)}})
+    finally:
+        active_sweeps.pop(sweep_id, None)
+
+def _launch_sweep(sweep_id: str):
+    active_sweeps[sweep_id] = asyncio.create_task(_execute_sweep(sweep_id))
+
+async def _base_scenario(request) -> dict:
+    """Scenario base di una richiesta di sweep o di analisi: inline (`base_scenario`) o salvato (`scenario_id`)."""
+    if request.base_scenario is not None:
+        return request.base_scenario.model_dump()
+    if request.scenario_id is not None:
+        if not ObjectId.is_valid(request.scenario_id):
+            raise HTTPException(status_code=400, detail="Invalid ID format")
+        base = await db.scenarios.find_one({"_id": ObjectId(request.scenario_id)}, {"_id": 0})
+        if base is None:
+            raise HTTPException(status_code=404, detail="Scenario non trovato")
+        return base
+    raise HTTPException(status_code=422, detail="Specificare `scenario_id` o `base_scenario`")
+
+@app.post("/sweeps", status_code=status.HTTP_202_ACCEPTED)
+async def create_sweep(request: SweepRequest):
+    """
+    Avvia una sweep di parametri headless sullo scenario base (inline o da `scenario_id`).
+    Le run girano in background: avanzamento su `GET /sweeps/{id}`.
+    Con `precision` le repliche per cella si fermano quando la semiampiezza dell'IC di
+    `target_metric` la raggiunge (al più `max_replicates`); la stima per cella è in `cells`.
+    Con `crn` la replica r di ogni cella usa lo stesso seed (backend PARTITIONED): differenze tra celle appaiate.
+    """
+    base = await _base_scenario(request)
+
+    # Ogni cella della griglia deve restare uno scenario valido
+    try:
+        for overrides in expand_grid(request.grid):
+            ScenarioInput(**apply_overrides(base, overrides))
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Griglia non valida: {e}")
+
+    if request.precision is not None and request.target_metric not in SUMMARY_FIELDS:
+        raise HTTPException(status_code=422, detail=f"Metrica obiettivo non valida: {request.target_metric}")
+
+    # Con arresto sequenziale il totale parte dal minimo di repliche e cresce a ogni blocco
+    total = len(expand_grid(request.grid)) * request.replicates
+    sweep_doc = {
+        "scenario_id": request.scenario_id,
+        "base_scenario": base,
+        "grid": request.grid,
+        "replicates": request.replicates,
+        "max_workers": request.max_workers,
+        "precision": request.precision,
+        "target_metric": request.target_metric,
+        "confidence": request.confidence,
+        "max_replicates": request.max_replicates,
+        "crn": request.crn,
+        "total_tasks": total,
+        "completed_tasks": 0,
+        "status": "QUEUED",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+    res = await db.sweeps.insert_one(sweep_doc)
+    sweep_id = str(res.inserted_id)
+    _launch_sweep(sweep_id)
+    return {"sweep_id": sweep_id, "total_tasks": total, "status": "QUEUED"}
+
+async def _get_sweep_or_404(sweep_id: str) -> dict:
+    if not ObjectId.is_valid(sweep_id):
+         raise HTTPException(status_code=400, detail="Invalid ID format")
+    doc = await db.sweeps.find_one({"_id": ObjectId(sweep_id)}, {"base_scenario": 0})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Sweep non trovata")
+    doc["id"] = str(doc.pop("_id"))
+    return doc
+
+@app.get("/sweeps/{sweep_id}")
+async def get_sweep(sweep_id: str):
+    """Stato e avanzamento di una sweep."""
+    return await _get_sweep_or_404(sweep_id)
+
+@app.post("/sweeps/{sweep_id}/resume", status_code=status.HTTP_202_ACCEPTED)
+async def resume_sweep(sweep_id: str):
+    """Riprende una sweep interrotta ricalcolando solo i task mancanti."""
+    doc = await _get_sweep_or_404(sweep_id)
+    if sweep_id in active_sweeps:
+        raise HTTPException(status_code=409, detail="Sweep già in esecuzione")
+    _launch_sweep(sweep_id)
+    return {"sweep_id": sweep_id, "completed_tasks": doc.get("completed_tasks", 0), "total_tasks": doc["total_tasks"]}
+
+@app.get("/sweeps/{sweep_id}/rows")
+async def get_sweep_rows(
+    sweep_id: str,
+    response: Response,
+    limit: int = Query(PAGE_LIMIT_MAX, ge=1, le=PAGE_LIMIT_MAX),
+    cursor: Optional[str] = None,
+):
+    """
+    Righe di riepilogo (una per run) prodotte dalla sweep, in ordine di scrittura.
+    Paginata come `GET /scenarios` (header `X-Next-Cursor`).
+    """
+    await _get_sweep_or_404(sweep_id)
+    return await _find_page(db.sweep_rows, {"sweep_id": sweep_id}, None, limit, cursor, response, newest_first=False)
+
+@app.get("/sweeps/{sweep_id}/export")
+async def export_sweep(sweep_id: str, format: str = "csv"):
+    """Scarica la tabella della sweep in CSV o Parquet."""
+    await _get_sweep_or_404(sweep_id)
+    csv_path = os.path.join(SWEEP_EXPORT_DIR, f"{sweep_id}.csv")
+    if not os.path.exists(csv_path):
+        raise HTTPException(status_code=404, detail="Nessuna riga esportata")
+    if format == "csv":
+        return FileResponse(csv_path, media_type="text/csv", filename=f"sweep_{sweep_id}.csv")
+    if format == "parquet":
+        parquet_path = os.path.join(SWEEP_EXPORT_DIR, f"{sweep_id}.parquet")
+        try:
+            await asyncio.to_thread(export_parquet, csv_path, parquet_path)
+        except RuntimeError as e:
+            raise HTTPException(status_code=501, detail=str(e))
+        return FileResponse(parquet_path, media_type="application/octet-stream", filename=f"sweep_{sweep_id}.parquet")
+    raise HTTPException(status_code=400, detail="Formato non supportato (csv, parquet)")
+
+# --- Analisi di sensibilità e confronto tra interventi (numeri casuali comuni) ---
+
+from .engine.models import ComparisonRequest, SensitivityRequest
+from .engine.sensitivity import compare_arms, run_sensitivity
+
+active_analyses = {}
+
+def _check_analysis_metric(metric: str):
+    if metric not in SUMMARY_FIELDS:
+        raise HTTPException(status_code=422, detail=f"Metrica non valida: {metric}")
+
+async def _execute_analysis(analysis_id: str, analyze, *args, **kwargs):
+    """Esegue l'analisi in un thread (le run girano nel pool dei task, `run_jobs.task_executor`) e salva il report."""
+    await db.analyses.update_one({"_id": ObjectId(analysis_id)}, {"$set": {"status": "RUNNING"}})
+    try:
+        report = await asyncio.to_thread(analyze, *args, executor=run_jobs.task_executor, **kwargs)
+        await db.analyses.update_one({"_id": ObjectId(analysis_id)}, {"$set": {"status": "COMPLETED", "report": report}})
+    except Exception as e:
+        await db.analyses.update_one({"_id": ObjectId(analysis_id)}, {"$set": {"status": "FAILED", "error": str(e)}})
+    finally:
+        active_analyses.pop(analysis_id, None)
+
+async def _launch_analysis(doc: dict, analyze, *args, **kwargs) -> str:
+    doc.update({"status": "QUEUED", "timestamp": datetime.now(timezone.utc).isoformat()})
+    res = await db.analyses.insert_one(doc)
+    analysis_id = str(res.inserted_id)
+    active_analyses[analysis_id] = asyncio.create_task(_execute_analysis(analysis_id, analyze, *args, **kwargs))
+    return analysis_id
+
+@app.post("/analyses/sensitivity", status_code=status.HTTP_202_ACCEPTED)
+async def create_sensitivity_analysis(request: SensitivityRequest):
+    """
+    Analisi di sensibilità globale (Sobol o Morris) su intervalli di parametri campionati con
+    Latin hypercube; con `crn` tutti i punti condividono gli stream casuali di ogni replica.
+    Il report (`GET /analyses/{id}`) riporta indici e riduzione di varianza ottenuta.
+    """
+    base = await _base_scenario(request)
+    _check_analysis_metric(request.metric)
+    if not request.parameters:
+        raise HTTPException(status_code=422, detail="Nessun parametro da analizzare")
+    parameters = [p.model_dump() for p in request.parameters]
+    # Gli estremi di ogni intervallo devono dare scenari validi
+    try:
+        for p in parameters:
+            if p["low"] > p["high"]:
+                raise ValueError(f"intervallo vuoto per '{p['path']}'")
+            for value in (p["low"], p["high"]):
+                ScenarioInput(**apply_overrides(base, {p["path"]: int(value) if p["integer"] else value}))
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Parametri non validi: {e}")
+
+    d = len(parameters)
+    points = request.samples * (d + 2 if request.method == "SOBOL" else d + 1)
+    analysis_id = await _launch_analysis(
+        {"kind": "SENSITIVITY", "request": request.model_dump(exclude={"base_scenario"}), "total_tasks": points * request.replicates},
+        run_sensitivity, base, parameters, request.method, request.samples, request.replicates, request.metric,
+        request.crn, request.seed, request.max_workers, delta=request.morris_delta,
+    )
+    return {"analysis_id": analysis_id, "total_tasks": points * request.replicates, "status": "QUEUED"}
+
+@app.post("/analyses/compare", status_code=status.HTTP_202_ACCEPTED)
+async def create_comparison(request: ComparisonRequest):
+    """
+    Confronto tra interventi: differenza appaiata di ogni braccio dal primo su `metric`, con
+    intervallo di confidenza, esito e riduzione di varianza dei numeri casuali comuni.
+    """
+    base = await _base_scenario(request)
+    _check_analysis_metric(request.metric)
+    if len(request.arms) < 2:
+        raise HTTPException(status_code=422, detail="Servono almeno due bracci da confrontare")
+    try:
+        for overrides in request.arms.values():
+            ScenarioInput(**apply_overrides(base, overrides))
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Bracci non validi: {e}")
+
+    total = len(request.arms) * request.replicates
+    analysis_id = await _launch_analysis(
+        {"kind": "COMPARISON", "request": request.model_dump(exclude={"base_scenario"}), "total_tasks": total},
+        compare_arms, base, request.arms, request.replicates, request.metric, request.crn, request.confidence,
+        request.max_workers,
+    )
+    return {"analysis_id": analysis_id, "total_tasks": total, "status": "QUEUED"}
+
+@app.get("/analyses/{analysis_id}")
+async def get_analysis(analysis_id: str):
+    """Stato e, a conclusione, report di un'analisi."""
+    if not ObjectId.is_valid(analysis_id):
+        raise HTTPException(status_code=400, detail="Invalid ID format")
+    doc = await db.analyses.find_one({"_id": ObjectId(analysis_id)})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Analisi non trovata")
     doc["id"] = str(doc.pop("_id"))
     return doc
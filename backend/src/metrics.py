@@ -0,0 +1,197 @@
+"""
+Metriche aggregate del servizio in formato testo Prometheus (esposte da `GET /metrics`).
+
+Registro minimale senza dipendenze esterne: contatori, istogrammi a bucket fissi e gauge
+letti al momento dell'esposizione. Le richieste HTTP e le scritture su MongoDB del
+processo API sono misurate direttamente; le statistiche di ogni run (calcolate nel
+processo worker e salvate nel documento della run, vedi `jobs`) vengono sommate qui da
+`observe_run` quando il job termina.
+"""
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Bucket di latenza in secondi (richieste API e scritture su DB)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bucket della durata delle run in secondi
+RUN_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values: Dict[Tuple[str, ...], list] = {} # chiave -> [conteggi per bucket, somma, totale]
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, n) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {n}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+class Gauge:
+    """Valore letto da `read()` al momento dell'esposizione."""
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_number(self.read())}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> Gauge:
+        metric = Gauge(name, help_text, read)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter("hai_http_requests_total", "Richieste HTTP servite", ("method", "route", "status"))
+HTTP_LATENCY = REGISTRY.histogram("hai_http_request_duration_seconds", "Durata delle richieste HTTP (fino alle intestazioni)", ("method", "route"))
+DB_WRITES = REGISTRY.histogram("hai_db_write_seconds", "Durata delle scritture MongoDB del processo API", ("collection", "op"))
+
+RUNS = REGISTRY.counter("hai_runs_total", "Run terminate per stato finale", ("status",))
+RUN_WALL = REGISTRY.histogram("hai_run_wall_seconds", "Tempo reale di simulazione per run", buckets=RUN_BUCKETS)
+RUN_CPU = REGISTRY.histogram("hai_run_cpu_seconds", "Tempo CPU di simulazione per run", buckets=RUN_BUCKETS)
+RUN_STORAGE = REGISTRY.counter("hai_run_storage_seconds_total", "Tempo di serializzazione e scrittura dei risultati nel worker", ("step",))
+ENGINE_EVENTS = REGISTRY.counter("hai_engine_events_total", "Eventi prodotti dal motore per tipo", ("type",))
+ENGINE_COUNTERS = REGISTRY.counter("hai_engine_operations_total", "Contatori del motore (visite, decadimento, estrazioni casuali)", ("operation",))
+ENGINE_PHASE_SECONDS = REGISTRY.counter("hai_engine_phase_seconds_total", "Tempo per fase del motore (run con timer di fase)", ("phase",))
+ENGINE_PHASE_CALLS = REGISTRY.counter("hai_engine_phase_calls_total", "Chiamate per fase del motore (run con timer di fase)", ("phase",))
+
+
+def observe_run(status: str, stats: Optional[dict]):
+    """Somma alle metriche aggregate le statistiche registrate da una run (`stats` del documento)."""
+    RUNS.inc(status=status)
+    if not stats:
+        return
+    RUN_WALL.observe(stats["wall_s"])
+    RUN_CPU.observe(stats["cpu_s"])
+    for step, seconds in stats.get("storage", {}).items():
+        RUN_STORAGE.inc(seconds, step=step)
+    engine = stats.get("engine", {})
+    for event_type, n in engine.get("events_by_type", {}).items():
+        ENGINE_EVENTS.inc(n, type=event_type)
+    for operation, n in engine.get("counters", {}).items():
+        ENGINE_COUNTERS.inc(n, operation=operation)
+    for phase, values in engine.get("phases", {}).items():
+        ENGINE_PHASE_SECONDS.inc(values["seconds"], phase=phase)
+        ENGINE_PHASE_CALLS.inc(values["calls"], phase=phase)
+
+
+class RequestMetricsMiddleware:
+    """
+    Middleware ASGI puro (senza il costo di `BaseHTTPMiddleware`): conteggio e durata delle
+    richieste per route, usando il template del path (`/runs/{run_id}`), non l'URL con gli id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                route = scope.get("route")
+                HTTP_LATENCY.observe(time.perf_counter() - start, method=scope["method"], route=route.path if route else "unmatched")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUESTS.inc(method=scope["method"], route=route.path if route else "unmatched", status=status)
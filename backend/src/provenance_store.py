@@ -0,0 +1,27 @@
+"""
+Archiviazione del grafo di provenienza delle infezioni.
+
+A fine run il worker salva il grafo completo (vedi `engine.provenance`: i fork proseguono le
+catene nei nodi della run madre) in un documento per run della collection `run_provenance`:
+colonne compresse dei nodi più tabella delle stringhe e dettagli delle infezioni. `GET /runs/{id}/trace/{patient_id}`
+legge solo questo documento, non il log degli eventi.
+"""
+from bson import Binary
+
+from .engine.provenance import ProvenanceGraph
+
+PROVENANCE_COLLECTION = "run_provenance"
+
+
+def provenance_doc(run_id: str, graph: ProvenanceGraph) -> dict:
+    blobs = graph.to_blobs()
+    return {
+        "run_id": run_id,
+        "infections": len(graph.infections),
+        "size": sum(len(blob) for blob in blobs.values()),
+        "graph": {name: Binary(blob) for name, blob in blobs.items()},
+    }
+
+
+def graph_from_doc(doc: dict) -> ProvenanceGraph:
+    return ProvenanceGraph.from_blobs({name: bytes(blob) for name, blob in doc["graph"].items()})
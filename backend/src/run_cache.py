@@ -0,0 +1,56 @@
+"""
+Cache delle run indirizzata per contenuto.
+
+La chiave è lo SHA-256 della serializzazione canonica (JSON a chiavi ordinate) dello
+`ScenarioInput` validato, insieme a `ENGINE_VERSION` e al livello di log: a parità di
+chiave il motore produce per costruzione lo stesso EventLog (seed incluso nello
+scenario). La collection `run_cache` mappa la chiave sulla run che l'ha calcolata; le
+voci scadono per TTL dall'ultimo accesso e oltre `RUN_CACHE_MAX_ENTRIES` vengono
+rimosse le meno usate di recente (LRU). Le run restano: si scarta solo la mappatura.
+Ogni run salva lo SHA-256 del proprio log (`event_log_sha256`) per la verifica.
+"""
+import copy
+import hashlib
+import json
+import os
+from typing import Iterable
+
+from .engine.models import ScenarioInput
+from .engine.simulator import ENGINE_VERSION
+
+RUN_CACHE_COLLECTION = "run_cache"
+RUN_CACHE_TTL_S = int(os.getenv("RUN_CACHE_TTL_S", str(7 * 24 * 3600)))
+RUN_CACHE_MAX_ENTRIES = int(os.getenv("RUN_CACHE_MAX_ENTRIES", "10000"))
+CACHEABLE_STATUSES = ("QUEUED", "RUNNING", "COMPLETED")
+
+
+def _canonical_json(value) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def canonical_scenario(scenario_dict: dict) -> str:
+    """Serializzazione canonica dello scenario validato (default espliciti, campi extra esclusi)."""
+    return _canonical_json(ScenarioInput(**scenario_dict).model_dump(mode="json"))
+
+
+def run_cache_key(scenario_dict: dict, log_level: str = "FULL", backend: str = "SIMPY") -> str:
+    # SIMPY e HEAP danno gli stessi eventi e condividono la chiave; PARTITIONED ha la sua sequenza
+    prefix = "PARTITIONED|" if backend == "PARTITIONED" else ""
+    payload = f"{prefix}{ENGINE_VERSION}|{log_level}|{canonical_scenario(scenario_dict)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def sweep_task_cache_key(task: dict) -> str:
+    """Chiave di un task di sweep: lo scenario della cella con il seed del task, a livello COUNTERS."""
+    scenario = copy.deepcopy(task["scenario"])
+    scenario["scenario_meta"]["seed"] = task["seed"]
+    return run_cache_key(scenario, "COUNTERS", task.get("backend", "SIMPY"))
+
+
+def event_log_digest(events: Iterable[dict]) -> str:
+    """SHA-256 del log come JSON Lines canonico (una riga per evento, chiavi ordinate)."""
+    digest = hashlib.sha256()
+    for e in events:
+        digest.update(_canonical_json(e).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
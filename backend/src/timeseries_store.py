@@ -0,0 +1,37 @@
+"""
+Archiviazione delle serie temporali di una run.
+
+Il worker campiona lo stato del motore ogni `RUN_SERIES_INTERVAL` tick (vedi
+`HAISimulatorEngine.run`) e salva un documento per run nella collection
+`run_timeseries`: una colonna float64 compressa per metrica più la colonna dei tick.
+L'intervallo viene allargato oltre `RUN_SERIES_MAX_POINTS` campioni, così il documento
+resta ben sotto il limite BSON anche per run molto lunghe.
+"""
+import math
+import os
+
+from bson import Binary
+
+from .engine.timeseries import TimeSeries
+
+RUN_SERIES_INTERVAL = int(os.getenv("RUN_SERIES_INTERVAL", "1"))
+RUN_SERIES_MAX_POINTS = int(os.getenv("RUN_SERIES_MAX_POINTS", "100000"))
+TIMESERIES_COLLECTION = "run_timeseries"
+
+
+def series_interval_for(ticks: float) -> int:
+    """Intervallo di campionamento per una run di `ticks` tick."""
+    return max(RUN_SERIES_INTERVAL, math.ceil(ticks / RUN_SERIES_MAX_POINTS))
+
+
+def timeseries_doc(run_id: str, series: TimeSeries) -> dict:
+    return {
+        "run_id": run_id,
+        "interval": series.interval,
+        "n": len(series),
+        "columns": {name: Binary(blob) for name, blob in series.to_blobs().items()},
+    }
+
+
+def series_from_doc(doc: dict) -> TimeSeries:
+    return TimeSeries.from_blobs(doc["interval"], {name: bytes(blob) for name, blob in doc["columns"].items()})
@@ -0,0 +1,46 @@
+"""
+Client ASGI minimo per pilotare l'app FastAPI in processo, senza rete né client HTTP
+(usato dai test delle API e dai benchmark).
+"""
+import asyncio
+
+
+async def asgi_request(app, method: str, path: str, query: str = "") -> tuple:
+    """Richiesta HTTP diretta all'app ASGI (senza rete né client HTTP); ritorna (status, corpo)."""
+    status, _, body = await asgi_exchange(app, method, path, query)
+    return status, body
+
+
+async def asgi_exchange(app, method: str, path: str, query: str = "", headers: dict = None) -> tuple:
+    """Come `asgi_request`, con intestazioni di richiesta; ritorna (status, intestazioni, corpo)."""
+    response = {"status": None, "headers": {}, "body": []}
+    done = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode().lower(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": query.encode(),
+        "headers": [(b"host", b"bench")] + [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    try:
+        await app(scope, receive, send)
+    finally:
+        done.set()
+    return response["status"], response["headers"], b"".join(response["body"])
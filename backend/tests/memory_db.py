@@ -0,0 +1,326 @@
+"""
+Sostituto in memoria del database Motor, per i test e i benchmark delle API senza un server MongoDB.
+
+Copre solo il sottoinsieme di operazioni usato da `src/main.py` (filtri per uguaglianza,
+`$in/$gt/$gte/$lt/$lte`, proiezioni, `sort/skip/limit`, `$set/$inc`): non è un emulatore
+generale di MongoDB. Le operazioni sono coroutine, come in Motor, e cedono il controllo
+all'event loop a ogni chiamata.
+
+Gli indici sono emulati quanto basta perché i costi somiglino a quelli di MongoDB: `_id` è
+sempre indicizzato in ordine e `create_index` indicizza per uguaglianza il primo campo delle
+chiavi (con gli `_id` in ordine, come un indice composto `(campo, _id)`). Una ricerca con
+uguaglianza su un campo indicizzato legge solo i suoi documenti; un `sort("_id")` con `limit`
+scorre l'indice dal limite del filtro su `_id` e si ferma dopo `limit` documenti.
+"""
+import asyncio
+import bisect
+import copy
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+
+_OPERATORS = {
+    "$in": lambda value, arg: value in arg,
+    "$gt": lambda value, arg: value is not None and value > arg,
+    "$gte": lambda value, arg: value is not None and value >= arg,
+    "$lt": lambda value, arg: value is not None and value < arg,
+    "$lte": lambda value, arg: value is not None and value <= arg,
+}
+
+
+def _get(doc: dict, path: str) -> Any:
+    for key in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for path, cond in query.items():
+        value = _get(doc, path)
+        if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+            if not all(_OPERATORS[op](value, arg) for op, arg in cond.items()):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    # Copia superficiale: gli handler modificano solo chiavi di primo livello dei documenti letti
+    if not projection:
+        return dict(doc)
+    include = {k.split(".")[0] for k, v in projection.items() if v and k != "_id"}
+    if include:
+        keep = include | ({"_id"} if projection.get("_id", 1) else set())
+        return {k: v for k, v in doc.items() if k in keep}
+    exclude = {k for k, v in projection.items() if not v}
+    return {k: v for k, v in doc.items() if k not in exclude}
+
+
+def _sort_spec(key, direction=None) -> List[tuple]:
+    if isinstance(key, str):
+        return [(key, 1 if direction is None else direction)]
+    return list(key)
+
+
+def _sorted(docs: List[dict], spec: List[tuple]) -> List[dict]:
+    for path, direction in reversed(spec):
+        docs = sorted(docs, key=lambda d: (_get(d, path) is not None, _get(d, path)), reverse=direction < 0)
+    return docs
+
+
+def _is_condition(cond) -> bool:
+    return isinstance(cond, dict) and bool(cond) and all(k.startswith("$") for k in cond)
+
+
+def _index_key(value) -> Any:
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return ("__unhashable__", repr(value))
+
+
+class MemoryCursor:
+    def __init__(self, collection: "MemoryCollection", query: dict, projection: Optional[dict]):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: List[tuple] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=None) -> "MemoryCursor":
+        self._sort = _sort_spec(key, direction)
+        return self
+
+    def skip(self, n: int) -> "MemoryCursor":
+        self._skip = n
+        return self
+
+    def limit(self, n: int) -> "MemoryCursor":
+        self._limit = n
+        return self
+
+    def _results(self) -> List[dict]:
+        if self._limit and len(self._sort) == 1 and self._sort[0][0] == "_id":
+            docs = self._collection._scan_ids(self._query, self._sort[0][1], self._skip + self._limit)[self._skip:]
+        else:
+            docs = _sorted(self._collection._find(self._query), self._sort)[self._skip:]
+            if self._limit:
+                docs = docs[:self._limit]
+        return [_project(d, self._projection) for d in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        await asyncio.sleep(0)
+        docs = self._results()
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(0)
+        for doc in self._results():
+            yield doc
+
+
+class MemoryCollection:
+    def __init__(self):
+        self.docs: Dict[Any, dict] = {}
+        self._ids: List[Any] = [] # `_id` in ordine
+        self._indexes: Dict[str, Dict[Any, List[Any]]] = {} # campo -> valore -> `_id` in ordine
+
+    def _candidates(self, query: dict) -> Optional[List[Any]]:
+        """`_id` in ordine dei documenti con l'uguaglianza di un campo indicizzato (None: nessun indice utile)."""
+        for path, cond in query.items():
+            if path in self._indexes and not _is_condition(cond):
+                return self._indexes[path].get(_index_key(cond), [])
+        return None
+
+    def _find(self, query: Optional[dict]) -> List[dict]:
+        query = query or {}
+        if "_id" in query and not isinstance(query["_id"], dict):
+            doc = self.docs.get(query["_id"])
+            return [doc] if doc is not None and _matches(doc, query) else []
+        ids = self._candidates(query)
+        docs = self.docs.values() if ids is None else (self.docs[i] for i in ids)
+        return [d for d in docs if _matches(d, query)]
+
+    def _scan_ids(self, query: dict, direction: int, n: int) -> List[dict]:
+        """Primi `n` documenti in ordine di `_id`, scorrendo l'indice dal limite del filtro su `_id`."""
+        ids = self._candidates(query)
+        ids = self._ids if ids is None else ids
+        bounds = query.get("_id") if _is_condition(query.get("_id")) else {}
+        if direction >= 0:
+            start = (bisect.bisect_right(ids, bounds["$gt"]) if "$gt" in bounds else
+                     bisect.bisect_left(ids, bounds["$gte"]) if "$gte" in bounds else 0)
+            order = range(start, len(ids))
+        else:
+            stop = (bisect.bisect_left(ids, bounds["$lt"]) if "$lt" in bounds else
+                    bisect.bisect_right(ids, bounds["$lte"]) if "$lte" in bounds else len(ids))
+            order = range(stop - 1, -1, -1)
+        docs = []
+        for i in order:
+            doc = self.docs[ids[i]]
+            if _matches(doc, query):
+                docs.append(doc)
+                if len(docs) >= n:
+                    break
+        return docs
+
+    def _index(self, doc: dict):
+        bisect.insort(self._ids, doc["_id"])
+        for path, values in self._indexes.items():
+            bisect.insort(values.setdefault(_index_key(_get(doc, path)), []), doc["_id"])
+
+    def _unindex(self, doc: dict):
+        self._ids.pop(bisect.bisect_left(self._ids, doc["_id"]))
+        for path, values in self._indexes.items():
+            ids = values[_index_key(_get(doc, path))]
+            ids.pop(bisect.bisect_left(ids, doc["_id"]))
+
+    async def create_index(self, keys, **kwargs) -> str:
+        path = keys if isinstance(keys, str) else keys[0] if isinstance(keys[0], str) else keys[0][0]
+        if path != "_id" and path not in self._indexes:
+            values = self._indexes[path] = {}
+            for _id in self._ids:
+                values.setdefault(_index_key(_get(self.docs[_id], path)), []).append(_id)
+        return path
+
+    async def insert_one(self, doc: dict):
+        await asyncio.sleep(0)
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs:
+            self._unindex(self.docs[doc["_id"]])
+        self.docs[doc["_id"]] = stored = copy.deepcopy(doc)
+        self._index(stored)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs: List[dict]):
+        ids = [(await self.insert_one(doc)).inserted_id for doc in docs]
+        return SimpleNamespace(inserted_ids=ids)
+
+    async def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None, sort=None):
+        await asyncio.sleep(0)
+        docs = _sorted(self._find(query), _sort_spec(sort) if sort else [])
+        return _project(docs[0], projection) if docs else None
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> MemoryCursor:
+        return MemoryCursor(self, query or {}, projection)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        await asyncio.sleep(0)
+        docs = self._find(query)
+        if not docs:
+            if not upsert:
+                return SimpleNamespace(matched_count=0, modified_count=0)
+            doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            await self.insert_one(doc)
+            docs = self._find({"_id": doc["_id"]})
+        doc = docs[0]
+        self._unindex(doc)
+        for path, value in update.get("$set", {}).items():
+            _set(doc, path, copy.deepcopy(value))
+        for path, value in update.get("$inc", {}).items():
+            _set(doc, path, (_get(doc, path) or 0) + value)
+        self._index(doc)
+        return SimpleNamespace(matched_count=1, modified_count=1)
+
+    async def replace_one(self, query: dict, doc: dict, upsert: bool = False):
+        await asyncio.sleep(0)
+        found = self._find(query)
+        if found:
+            doc = {**doc, "_id": found[0]["_id"]}
+        elif not upsert:
+            return SimpleNamespace(matched_count=0)
+        elif "_id" in query:
+            doc = {**doc, "_id": query["_id"]}
+        await self.insert_one(doc)
+        return SimpleNamespace(matched_count=len(found))
+
+    async def delete_one(self, query: dict):
+        docs = self._find(query)
+        if docs:
+            self._unindex(docs[0])
+            del self.docs[docs[0]["_id"]]
+        return SimpleNamespace(deleted_count=len(docs[:1]))
+
+    async def delete_many(self, query: dict):
+        docs = self._find(query)
+        for doc in docs:
+            self._unindex(doc)
+            del self.docs[doc["_id"]]
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def count_documents(self, query: dict) -> int:
+        return len(self._find(query))
+
+    async def distinct(self, key: str, query: Optional[dict] = None) -> List[Any]:
+        values = []
+        for doc in self._find(query):
+            if key in doc and doc[key] not in values:
+                values.append(doc[key])
+        return values
+
+    async def estimated_document_count(self) -> int:
+        return len(self.docs)
+
+
+def _set(doc: dict, path: str, value: Any):
+    *parents, leaf = path.split(".")
+    for key in parents:
+        doc = doc.setdefault(key, {})
+    doc[leaf] = value
+
+
+class MemoryDatabase:
+    """Database in memoria: `db.nome` e `db["nome"]` restituiscono la stessa collection."""
+
+    def __init__(self):
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        return self._collections.setdefault(name, MemoryCollection())
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, name: str) -> dict:
+        return {"ok": 1.0}
+
+
+class SyncDatabase:
+    """
+    Vista sincrona (stile pymongo) di un `MemoryDatabase`, per riusare il codice del worker
+    (`jobs._simulate_and_store`) nel popolamento. Da usare fuori da un event loop attivo.
+    """
+
+    def __init__(self, db: MemoryDatabase):
+        self._db = db
+
+    def __getitem__(self, name: str) -> "_SyncCollection":
+        return _SyncCollection(self._db[name])
+
+    def __getattr__(self, name: str) -> "_SyncCollection":
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+class _SyncCollection:
+    def __init__(self, collection: MemoryCollection):
+        self._collection = collection
+
+    def __getattr__(self, name: str):
+        method = getattr(self._collection, name)
+
+        def call(*args, **kwargs):
+            result = method(*args, **kwargs)
+            return asyncio.run(result) if asyncio.iscoroutine(result) else result
+        return call
@@ -0,0 +1,41 @@
+"""
+Scenari a reparti condivisi dai test: definiti qui, indipendenti dai generatori dei benchmark.
+Reparti di stanze doppie con infermieri dedicati, medici e cleaner su tutto l'ospedale (gli
+unici che migrano tra reparti), un caso indice ogni 50 pazienti. Di default focolaio: contagio
+certo e igiene scarsa, decine di infezioni in poche centinaia di tick.
+"""
+
+
+def ward_scenario(
+    ward_rooms, nurses, doctors, cleaners, patients, max_ticks=300, decay_mode="STEPWISE",
+    transmission_prob=1.0, base_compliance=0.1,
+):
+    wards = [{ "id": f"W{k + 1:03d}", "rooms": n, "room_type": "DOUBLE" } for k, n in enumerate(ward_rooms)]
+    room_ids = [f"{w['id']}_R_{i:02d}" for w in wards for i in range(1, w["rooms"] + 1)]
+    staffing = []
+    for k, ward in enumerate(wards):
+        count = nurses // len(wards) + (1 if k < nurses % len(wards) else 0)
+        staffing.append({ "role": "NURSE", "count": count, "ward": ward["id"], "compliance_modifier": 0.9 })
+    if doctors:
+        staffing.append({ "role": "DOC", "count": doctors, "compliance_modifier": 0.8 })
+    staffing.append({ "role": "CLEANER", "count": cleaners, "cleaning_efficacy": 0.85 })
+    # Due pazienti per stanza se non bastano le stanze
+    per_room = 2 if patients > len(room_ids) else 1
+    return {
+        "scenario_meta": { "name": "Ward Scenario", "seed": 42 },
+        "hospital": { "rooms": 0, "wards": wards },
+        "staffing": staffing,
+        "patients": [
+            {
+                "id": f"P_{i:05d}",
+                "room": room_ids[i // per_room],
+                "state": "INFECTED" if i % 50 == 0 else "SUSCEPTIBLE",
+                "susceptibility": 0.5 + 0.4 * ((i * 7919) % 100) / 100.0,
+                "viral_load": 10000.0 if i % 50 == 0 else 0.0,
+            }
+            for i in range(patients)
+        ],
+        "pathogen": { "transmission_prob": transmission_prob },
+        "hygiene": { "base_compliance": base_compliance },
+        "simulation": { "max_ticks": max_ticks, "tick_unit_minutes": 10, "decay_mode": decay_mode },
+    }
@@ -35,13 +35,48 @@ def test_api_workflow():
     req_run = urllib.request.Request(f"{API_URL}/scenarios/{s_id}/run", method="POST")
     try:
         with urllib.request.urlopen(req_run) as resp:
-            duration = time.time() - start
             run_res = json.loads(resp.read().decode())
-            print(f"Simulazione Finita in {duration:.2f}s!")
-            print(f"Run ID MongoDB: {run_res.get('run_id')}")
-            print(f"Eventi Generati: {run_res.get('total_events')}")
+            run_id = run_res.get('run_id')
+            print(f"Run accodata in {time.time() - start:.3f}s, Run ID MongoDB: {run_id}")
+
+        # Polling dello stato finché il job non termina
+        while True:
+            with urllib.request.urlopen(f"{API_URL}/runs/{run_id}/status") as resp:
+                run_status = json.loads(resp.read().decode())
+            if run_status["status"] not in ("QUEUED", "RUNNING"):
+                break
+            time.sleep(0.2)
+        duration = time.time() - start
+        print(f"Simulazione {run_status['status']} in {duration:.2f}s!")
+        print(f"Eventi Generati: {run_status.get('total_events')}")
     except urllib.error.HTTPError as e:
         print(f"Error running simulation: {e.read().decode()}")
 
+    print("\n--- 4. Forking Run (what-if: un cleaner in più) ---")
+    fork_payload = json.dumps({"overrides": {"staffing.CLEANER.count": 2}}).encode('utf-8')
+    req_fork = urllib.request.Request(
+        f"{API_URL}/runs/{run_id}/fork?tick=20", data=fork_payload, headers={'Content-Type': 'application/json'}, method="POST"
+    )
+    try:
+        with urllib.request.urlopen(req_fork) as resp:
+            fork = json.loads(resp.read().decode())
+            print(f"Fork ID: {fork['run_id']} (checkpoint al tick {fork['checkpoint_tick']})")
+    except urllib.error.HTTPError as e:
+        print(f"Error forking run: {e.read().decode()}")
+
+    print("\n--- 5. Launching Parameter Sweep ---")
+    sweep_payload = json.dumps({
+        "scenario_id": s_id,
+        "grid": {"hygiene.base_compliance": [0.4, 0.8]},
+        "replicates": 2
+    }).encode('utf-8')
+    req_sweep = urllib.request.Request(f"{API_URL}/sweeps", data=sweep_payload, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req_sweep) as resp:
+            sweep = json.loads(resp.read().decode())
+            print(f"Sweep ID: {sweep['sweep_id']} ({sweep['total_tasks']} task)")
+    except urllib.error.HTTPError as e:
+        print(f"Error launching sweep: {e.read().decode()}")
+
 if __name__ == "__main__":
     test_api_workflow()
@@ -0,0 +1,61 @@
+import os
+import sys
+import copy
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.engine.simulator import HAISimulatorEngine
+from src.engine.batch import BatchSimulatorEngine, summarize_outcomes
+from tests.test_engine import get_base_scenario
+
+def get_outbreak_scenario():
+    """ Scenario con compliance bassa e trasmissione alta, per avere infezioni misurabili """
+    scenario = get_base_scenario()
+    scenario["hospital"]["rooms"] = 3
+    scenario["staffing"][0]["count"] = 2
+    scenario["hygiene"]["base_compliance"] = 0.2
+    scenario["pathogen"]["transmission_prob"] = 1.0
+    scenario["patients"].append({ "id": "P_002", "room": "R_03", "state": "SUSCEPTIBLE", "susceptibility": 0.9 })
+    scenario["simulation"]["max_ticks"] = 100
+    return scenario
+
+def test_batch_shapes_and_determinism():
+    """ Stesso seed -> stessi esiti per replica; un valore per replica per ogni metrica """
+    scenario = get_outbreak_scenario()
+    out_1 = BatchSimulatorEngine(scenario, replicates=64, seed=7).run()
+    out_2 = BatchSimulatorEngine(scenario, replicates=64, seed=7).run()
+
+    for name, values in out_1.items():
+        assert values.shape == (64,), f"Metrica {name} con shape inattesa"
+        assert np.array_equal(values, out_2[name]), f"Metrica {name} non deterministica"
+
+def test_batch_matches_scalar_statistics():
+    """ Equivalenza statistica (entro tolleranza Monte Carlo) tra motore vettoriale e SimPy scalare """
+    scenario = get_outbreak_scenario()
+
+    infections, successes, hygiene_total = [], [], []
+    for seed in range(300):
+        s = copy.deepcopy(scenario)
+        s["scenario_meta"]["seed"] = seed
+        log = HAISimulatorEngine(s).run()
+        infections.append(sum(1 for e in log if e["type"] == "INFECTION"))
+        successes.append(sum(1 for e in log if e.get("msg") in ["WASH_IN_SUCCESS", "WASH_OUT_SUCCESS"]))
+        hygiene_total.append(sum(1 for e in log if e["type"] == "HYGIENE"))
+
+    batch = summarize_outcomes(BatchSimulatorEngine(scenario, replicates=3000, seed=1).run())
+
+    scalar_inf_mean = np.mean(infections)
+    scalar_inf_se = np.std(infections, ddof=1) / np.sqrt(len(infections))
+    batch_inf_se = batch["infections"]["ci95_half_width"] / 1.96
+    assert abs(batch["infections"]["mean"] - scalar_inf_mean) < 4 * np.hypot(scalar_inf_se, batch_inf_se)
+
+    scalar_rate = sum(successes) / sum(hygiene_total)
+    batch_rate = batch["hygiene_success"]["mean"] / (batch["hygiene_success"]["mean"] + batch["hygiene_fail"]["mean"])
+    assert abs(batch_rate - scalar_rate) < 0.02
+
+    # Stesso ritmo di visite (1-3 tick per task)
+    scalar_visits = np.mean(hygiene_total) / 2
+    clinical_visits = batch["visits"]["mean"] - batch["cleanings"]["mean"]
+    assert abs(clinical_visits - scalar_visits) / scalar_visits < 0.05
@@ -0,0 +1,91 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.bench import _api_requests, _populate_api_db, compare, listing_load
+from benchmarks.scenarios import ENGINE_CASES, generate_scenario
+from src import main
+from src.engine.models import ScenarioInput
+from tests.asgi import asgi_exchange, asgi_request
+from tests.memory_db import MemoryDatabase
+
+
+def test_generated_scenarios_are_valid():
+    for params in ENGINE_CASES.values():
+        scenario = generate_scenario(**{**params, "max_ticks": 10})
+        ScenarioInput(**scenario)
+        assert len({p["id"] for p in scenario["patients"]}) == len(scenario["patients"])
+
+def test_compare_flags_only_regressions_beyond_threshold():
+    baseline = {"cases": {"a": {"events_per_s": 1000.0, "peak_rss_mb": 100.0}}}
+    current = {"cases": {
+        "a": {"events_per_s": 700.0, "peak_rss_mb": 104.0}, # -30% throughput, +4% memoria
+        "nuovo": {"events_per_s": 1.0},
+    }}
+    regressions = compare(baseline, current)
+    assert len(regressions) == 1 and regressions[0].startswith("a.events_per_s")
+    assert compare(baseline, current, threshold=0.5) == []
+    assert compare(baseline, {"cases": {"a": {"events_per_s": 2000.0, "peak_rss_mb": 50.0}}}) == []
+
+def test_api_endpoints_on_memory_db():
+    """ Gli endpoint di lettura rispondono sul database in memoria popolato dal codice del worker """
+    db = MemoryDatabase()
+    previous, main.db = main.db, db
+    try:
+        ids = _populate_api_db(db)
+        for name, request in _api_requests(ids).items():
+            status, body = asyncio.run(asgi_request(main.app, *request))
+            assert 200 <= status < 300, (name, body)
+        _, body = asyncio.run(asgi_request(main.app, *_api_requests(ids)["api_run_cached"]))
+        assert json.loads(body)["cached"] is True
+    finally:
+        main.db = previous
+
+def test_paginated_listings_with_projections():
+    """ Listing a cursore senza duplicati né buchi, campi scelti con `fields`, run dello scenario dalla più recente """
+    db = MemoryDatabase()
+    previous, main.db = main.db, db
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(listing_load(db, [60], requests=2, concurrency=1))
+        seen, cursor = [], None
+        while True:
+            query = "limit=4" + (f"&cursor={cursor}" if cursor else "")
+            status, headers, body = asyncio.run(asgi_exchange(main.app, "GET", "/scenarios", query))
+            assert status == 200
+            seen.extend(doc["id"] for doc in json.loads(body))
+            cursor = headers.get("x-next-cursor")
+            if cursor is None:
+                break
+        assert len(seen) == len(set(seen)) == 6 and seen == sorted(seen)
+
+        hot = seen[0]
+        status, headers, body = asyncio.run(asgi_exchange(main.app, "GET", f"/scenarios/{hot}/runs", "limit=20&fields=status,infections"))
+        runs = json.loads(body)
+        assert status == 200 and len(runs) == 20 and "x-next-cursor" in headers
+        assert set(runs[0]) == {"id", "status", "infections"}
+        assert [r["id"] for r in runs] == sorted((r["id"] for r in runs), reverse=True)
+        _, _, body = asyncio.run(asgi_exchange(main.app, "GET", f"/scenarios/{hot}/runs", f"limit=20&cursor={headers['x-next-cursor']}"))
+        rest = json.loads(body)
+        assert len(runs) + len(rest) == 30 and not {r["id"] for r in runs} & {r["id"] for r in rest}
+
+        assert asyncio.run(asgi_request(main.app, "GET", f"/scenarios/{hot}/runs", "fields=events"))[0] == 422
+        assert asyncio.run(asgi_request(main.app, "GET", "/scenarios", "cursor=nope"))[0] == 400
+        assert asyncio.run(asgi_request(main.app, "GET", "/scenarios/0123456789abcdef01234567/runs"))[0] == 404
+
+        # Righe di sweep: stesso cursore, righe intere senza il filtro `sweep_id`
+        sweep_id = str(asyncio.run(db.sweeps.insert_one({"grid": {}, "total_tasks": 5})).inserted_id)
+        asyncio.run(db.sweep_rows.insert_many([{"sweep_id": sweep_id, "task_key": f"t{i}", "infections": i} for i in range(5)]))
+        status, headers, body = asyncio.run(asgi_exchange(main.app, "GET", f"/sweeps/{sweep_id}/rows", "limit=3"))
+        rows = json.loads(body)
+        assert status == 200 and [r["task_key"] for r in rows] == ["t0", "t1", "t2"]
+        assert set(rows[0]) == {"id", "task_key", "infections"}
+        _, headers, body = asyncio.run(asgi_exchange(main.app, "GET", f"/sweeps/{sweep_id}/rows", f"limit=3&cursor={headers['x-next-cursor']}"))
+        assert [r["task_key"] for r in json.loads(body)] == ["t3", "t4"] and "x-next-cursor" not in headers
+    finally:
+        main.db = previous
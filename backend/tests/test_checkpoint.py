@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import main
+from src.checkpoint_store import apply_event_delta, decode_checkpoint, encode_checkpoint
+from src.engine.heap_engine import create_engine
+from src.engine.sweep import apply_overrides
+from tests.asgi import asgi_request
+from tests.memory_db import MemoryDatabase
+from tests.test_heap_engine import get_ward_scenario
+
+
+def run_with_checkpoints(scenario, backend="SIMPY", interval=100):
+    checkpoints = []
+    engine = create_engine(scenario, backend=backend)
+    log = engine.run(on_checkpoint=checkpoints.append, checkpoint_interval=interval)
+    return engine, log.to_list(), checkpoints
+
+
+@pytest.mark.parametrize("backend", ["SIMPY", "HEAP"])
+@pytest.mark.parametrize("decay_mode", ["STEPWISE", "LAZY"])
+def test_restore_reproduces_run_tail(backend, decay_mode):
+    """ Ripartire da qualunque checkpoint (anche sull'altro backend) riproduce la coda della run originale """
+    scenario = get_ward_scenario()
+    scenario["simulation"]["max_ticks"] = 450
+    scenario["simulation"]["decay_mode"] = decay_mode
+    engine, events, checkpoints = run_with_checkpoints(scenario, backend)
+    assert [c["tick"] for c in checkpoints] == [0, 100, 200, 300, 400]
+
+    for state in checkpoints:
+        state = decode_checkpoint(encode_checkpoint(state))
+        for other in ("SIMPY", "HEAP"):
+            resumed = create_engine(scenario, backend=other)
+            resumed.restore(state)
+            assert resumed.run().to_list() == events[state["log_cursor"]:]
+            assert resumed.summary() == engine.summary()
+
+def test_replay_to_fork_tick_matches_direct_checkpoint():
+    """ Checkpoint + riallineamento fino a un tick intermedio == stato della run a quel tick """
+    scenario = get_ward_scenario()
+    scenario["simulation"]["max_ticks"] = 300
+    _, _, checkpoints = run_with_checkpoints(scenario)
+
+    direct = create_engine(scenario)
+    direct.advance_to(137)
+
+    replay = create_engine(scenario, backend="HEAP")
+    replay.restore(checkpoints[1])
+    replay.advance_to(137)
+    assert json.dumps(replay.checkpoint()) == json.dumps(direct.checkpoint())
+
+def test_fork_with_added_cleaner():
+    """ Fork what-if: stesso passato fino al tick di fork, il nuovo cleaner lavora solo dopo """
+    scenario = get_ward_scenario()
+    scenario["simulation"]["max_ticks"] = 400
+    _, events, checkpoints = run_with_checkpoints(scenario)
+
+    fork_tick = 200
+    state = checkpoints[2]
+    patched = apply_overrides(scenario, {"staffing.CLEANER.count": 2})
+    fork = create_engine(patched)
+    fork.restore(state)
+    fork_events = fork.run().to_list()
+
+    assert state["tick"] == fork_tick
+    assert all(e["t"] < fork_tick for e in events[:state["log_cursor"]])
+    assert all(e["t"] >= fork_tick for e in fork_events)
+    cleaner_moves = [e for e in fork_events if e["type"] == "MOVE" and e["agent_id"] == "CLEANER_2"]
+    assert cleaner_moves and fork_events != events[state["log_cursor"]:]
+
+def test_restore_rejects_decay_mode_change():
+    scenario = get_ward_scenario()
+    _, _, checkpoints = run_with_checkpoints(scenario)
+    scenario["simulation"]["decay_mode"] = "LAZY"
+    with pytest.raises(ValueError):
+        create_engine(scenario).restore(checkpoints[0])
+
+@pytest.mark.parametrize("backend", ["SIMPY", "HEAP"])
+def test_keyframe_plus_event_delta_matches_next_keyframe(backend):
+    """ Fotogramma + delta di eventi fino al tick t == stanze dello staff e stati dei pazienti del fotogramma a t + 1 """
+    scenario = get_ward_scenario()
+    scenario["simulation"]["max_ticks"] = 260
+    keyframes = []
+    engine = create_engine(scenario, backend=backend)
+    events = engine.run(on_keyframe=keyframes.append, keyframe_interval=50).to_list()
+    assert [k["tick"] for k in keyframes] == [0, 50, 100, 150, 200, 250]
+    assert any(room is not None for room, _ in keyframes[-1]["staff"].values())
+
+    for frame, following in zip(keyframes, keyframes[1:]):
+        state = apply_event_delta(decode_checkpoint(encode_checkpoint(frame)), events, following["tick"] - 1)
+        assert state["keyframe_tick"] == frame["tick"]
+        assert {s["id"]: s["room"] for s in state["staff"]} == {sid: s[0] for sid, s in following["staff"].items()}
+        assert {p["id"]: p["state"] for p in state["patients"]} == {pid: p[1] for pid, p in following["patients"].items()}
+
+    # Il checkpoint conserva la posizione dello staff: una run ripresa emette gli stessi fotogrammi
+    checkpoints = []
+    create_engine(scenario).run(on_checkpoint=checkpoints.append, checkpoint_interval=100)
+    resumed = create_engine(scenario, backend=backend)
+    resumed.restore(checkpoints[1])
+    tail = []
+    resumed.run(on_keyframe=tail.append, keyframe_interval=50)
+    assert json.dumps(tail) == json.dumps(keyframes[2:])
+
+def test_state_of_run_without_summary_is_not_available():
+    """ Run completate salvate senza riepilogo (prima dei fotogrammi): 404, non un errore interno """
+    db = MemoryDatabase()
+    previous, main.db = main.db, db
+    try:
+        run_id = str(asyncio.run(db.simulation_runs.insert_one({"status": "COMPLETED", "log_level": "FULL"})).inserted_id)
+        status, body = asyncio.run(asgi_request(main.app, "GET", f"/runs/{run_id}/state", "tick=10"))
+        assert status == 404 and "non disponibile" in json.loads(body)["detail"]
+    finally:
+        main.db = previous
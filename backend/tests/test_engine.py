@@ -4,7 +4,7 @@ import sys
 # Aggiungiamo il parent folder al sys.path per importare `src`
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.engine.simulator import HAISimulatorEngine
+from src.engine.simulator import HAISimulatorEngine, stepwise_decay
 from src.engine.models import ScenarioInput
 
 def get_base_scenario():
@@ -70,3 +70,195 @@ def test_hygiene_success_rate():
     
     success_low = sum(1 for e in log_low if e.get("msg") in ["WASH_IN_SUCCESS", "WASH_OUT_SUCCESS"])
     assert success_low == 0 # 0 successi
+
+def test_progress_segments_do_not_alter_log():
+    """ L'avanzamento a segmenti (usato dai job asincroni) produce lo stesso log della run continua """
+    scenario = get_base_scenario()
+    log_plain = HAISimulatorEngine(scenario).run()
+
+    ticks = []
+    log_segmented = HAISimulatorEngine(scenario).run(on_progress=ticks.append, progress_interval=7)
+
+    assert ticks[-1] == scenario["simulation"]["max_ticks"]
+    assert ticks == sorted(ticks)
+    assert log_plain == log_segmented
+
+def test_progress_callback_can_cancel():
+    """ Il callback di avanzamento interrompe la run sollevando SimulationCancelled """
+    from src.engine.simulator import SimulationCancelled
+
+    def stop_at_20(tick):
+        if tick >= 20:
+            raise SimulationCancelled()
+
+    engine = HAISimulatorEngine(get_base_scenario())
+    try:
+        engine.run(on_progress=stop_at_20, progress_interval=10)
+        assert False, "La run doveva essere cancellata"
+    except SimulationCancelled:
+        pass
+    assert engine.env.now == 20
+
+def test_log_levels_share_dynamics_and_counters():
+    """ I livelli di log ridotti non cambiano la dinamica: i contatori coincidono con gli eventi del livello FULL """
+    scenario = get_base_scenario()
+    scenario["pathogen"]["transmission_prob"] = 1.0
+    scenario["hygiene"]["base_compliance"] = 0.1
+    scenario["simulation"]["max_ticks"] = 500
+
+    full = HAISimulatorEngine(scenario)
+    log = full.run()
+    summary_full = full.summary()
+    assert summary_full.visits == sum(1 for e in log if e["type"] == "MOVE")
+    assert summary_full.hygiene_fail == sum(1 for e in log if e.get("msg") in ["WASH_IN_FAIL", "WASH_OUT_FAIL"])
+    assert summary_full.infection_ticks == [e["t"] for e in log if e["type"] == "INFECTION"]
+
+    epidemic = HAISimulatorEngine(scenario, log_level="EPIDEMIC_ONLY")
+    summary_epi = epidemic.run()
+    assert {e["type"] for e in epidemic.event_log} <= {"START", "INFECTION", "END"}
+
+    counters = HAISimulatorEngine(scenario, log_level="COUNTERS")
+    summary_cnt = counters.run()
+    assert len(counters.event_log) == 0
+
+    for s in (summary_epi, summary_cnt):
+        assert s.model_dump(exclude={"log_level", "events_logged"}) == summary_full.model_dump(exclude={"log_level", "events_logged"})
+
+def test_ward_layout_and_double_rooms():
+    """ Reparti con stanze DOUBLE: indice stanza -> occupanti, staff confinato nel proprio reparto, id univoci """
+    scenario = get_base_scenario()
+    scenario["hospital"] = {
+        "rooms": 0,
+        "wards": [
+            { "id": "MED", "rooms": 2, "room_type": "DOUBLE", "isolation_ids": ["MED_R_02"] },
+            { "id": "SURG", "rooms": 3 },
+        ]
+    }
+    scenario["staffing"] = [
+        { "role": "NURSE", "count": 2, "ward": "MED" },
+        { "role": "NURSE", "count": 1, "ward": "SURG" },
+        { "role": "NURSE", "count": 1 },
+    ]
+    scenario["patients"] = [
+        { "id": "P_INDEX", "room": "MED_R_01", "state": "INFECTED", "susceptibility": 1.0 },
+        { "id": "P_BED_2", "room": "MED_R_01", "state": "SUSCEPTIBLE", "susceptibility": 1.0 },
+        { "id": "P_SURG", "room": "SURG_R_03", "state": "SUSCEPTIBLE", "susceptibility": 1.0 },
+    ]
+    scenario["pathogen"]["transmission_prob"] = 1.0
+    scenario["hygiene"]["base_compliance"] = 0.0
+    scenario["simulation"]["max_ticks"] = 300
+
+    engine = HAISimulatorEngine(scenario)
+    assert list(engine.wards) == ["MED", "SURG"]
+    assert engine.rooms["MED_R_01"].type == "DOUBLE"
+    assert engine.rooms["MED_R_02"].type == "ISOLATION"
+    assert [p.id for p in engine.room_patients["MED_R_01"]] == ["P_INDEX", "P_BED_2"]
+    assert engine.room_patients["SURG_R_01"] == ()
+    assert [s.id for s in engine.staff_agents] == ["MED_NURSE_1", "MED_NURSE_2", "SURG_NURSE_1", "NURSE_1"]
+
+    log = engine.run()
+    for e in log:
+        if e["type"] == "MOVE" and e["agent_id"].startswith("MED_"):
+            assert e["room"].startswith("MED_")
+        if e["type"] == "MOVE" and e["agent_id"].startswith("SURG_"):
+            assert e["room"].startswith("SURG_")
+
+    # Il compagno di stanza del paziente indice viene toccato a ogni visita e si infetta
+    assert engine.patients["P_BED_2"].state == "INFECTED"
+
+
+def test_stepwise_decay_closed_form():
+    """ La forma chiusa del decadimento a scalini coincide con il ciclo tick per tick (soglia 0.01 inclusa) """
+    for load in (0.005, 0.02, 1.0, 250.0, 10000.0):
+        for factor in (0.0, 0.5, 0.8845, 0.9984):
+            for steps in (0, 1, 7, 500):
+                expected = load
+                for _ in range(steps):
+                    if expected > 0.01:
+                        expected *= factor
+                assert abs(stepwise_decay(load, factor, steps) - expected) <= 1e-12 * max(1.0, load)
+
+def test_lazy_decay_matches_stepwise():
+    """
+    LAZY applica gli stessi fattori a scalini solo al contatto: senza pazienti suscettibili
+    (nessuna estrazione legata alle cariche) gli eventi sono identici e le cariche finali
+    coincidono entro 1e-4 relativo. EXACT (esponenziale continuo) resta entro qualche punto
+    percentuale, per la differenza tra 1 - 0.693/h e 2^(-1/h) sui tick di emivita delle mani.
+    """
+    results = {}
+    for mode in ("STEPWISE", "LAZY", "EXACT"):
+        scenario = get_base_scenario()
+        scenario["patients"] = [p for p in scenario["patients"] if p["state"] != "SUSCEPTIBLE"]
+        scenario["simulation"]["max_ticks"] = 200
+        scenario["simulation"]["decay_mode"] = mode
+        engine = HAISimulatorEngine(scenario)
+        log = engine.run()
+        loads = [r.load for r in engine.rooms.values()] + [s.load for s in engine.staff_agents]
+        results[mode] = (log.to_list(), loads)
+
+    stepwise_log, stepwise_loads = results["STEPWISE"]
+    for mode, tolerance in (("LAZY", 1e-4), ("EXACT", 0.1)):
+        log, loads = results[mode]
+        assert log == stepwise_log
+        for lazy, step in zip(loads, stepwise_loads):
+            assert abs(lazy - step) <= tolerance * max(step, 0.01)
+
+def test_exact_decay_half_life():
+    """ In modalità EXACT una carica non toccata si dimezza esattamente dopo un'emivita """
+    scenario = get_base_scenario()
+    scenario["simulation"]["decay_mode"] = "EXACT"
+    engine = HAISimulatorEngine(scenario)
+    room = engine.rooms["R_02"]
+    room.load = 1000.0
+    engine.sync_loads(engine.surface_half_life_ticks)
+    assert abs(room.load - 500.0) < 1e-9
+
+def test_early_stop_on_absorbing_state_and_thresholds():
+    """ L'arresto allo stato assorbente non cambia l'esito epidemico; soglie e condizioni da codice fermano la run """
+    rooms = [f"W{w}_R_{r:02d}" for w in (1, 2) for r in range(1, 11)]
+    scenario = {
+      "scenario_meta": { "name": "Early Stop", "seed": 1 },
+      "hospital": { "rooms": 0, "wards": [{ "id": w, "rooms": 10, "room_type": "DOUBLE" } for w in ("W1", "W2")] },
+      "staffing": [
+        { "role": "NURSE", "count": 3, "ward": "W1", "compliance_modifier": 0.9 },
+        { "role": "NURSE", "count": 3, "ward": "W2", "compliance_modifier": 0.9 },
+        { "role": "DOC", "count": 1, "compliance_modifier": 0.8 },
+        { "role": "CLEANER", "count": 1, "cleaning_efficacy": 0.85 }
+      ],
+      "patients": [
+        { "id": f"P_{i:03d}", "room": rooms[i // 2], "state": "INFECTED" if i % 20 == 0 else "SUSCEPTIBLE",
+          "susceptibility": 0.9, "viral_load": 10000.0 if i % 20 == 0 else 0.0 }
+        for i in range(40)
+      ],
+      "pathogen": { "transmission_prob": 0.3 },
+      "hygiene": { "base_compliance": 0.6 },
+      "simulation": { "max_ticks": 3000, "tick_unit_minutes": 10 }
+    }
+    ScenarioInput(**scenario)
+    full = HAISimulatorEngine(scenario, log_level="COUNTERS")
+    full.run()
+    scenario["simulation"]["early_stop"] = True
+    early = HAISimulatorEngine(scenario)
+    log = early.run(series_interval=100)
+    summary = early.summary()
+    assert summary.stop_reason == "ABSORBING" and summary.ticks_simulated < 3000
+    assert summary.infection_ticks # focolaio prima dell'arresto
+    assert summary.ticks_simulated % early.stop_check_ticks == 0
+    assert (summary.infection_ticks, summary.final_states) == (full.summary().infection_ticks, full.summary().final_states)
+    assert log[-1] == {"t": summary.ticks_simulated, "type": "END", "msg": "Simulation stopped early (ABSORBING)", "reason": "ABSORBING"}
+    assert early.series.t[-1] == summary.ticks_simulated
+
+    scenario = get_base_scenario()
+    scenario["pathogen"]["transmission_prob"] = 1.0
+    scenario["hygiene"]["base_compliance"] = 0.1
+    scenario["simulation"].update(max_ticks=500, stop_when={"infections": 1}, stop_check_ticks=10)
+    engine = HAISimulatorEngine(scenario)
+    engine.run()
+    assert engine.stop_reason == "STOP_WHEN:infections" and engine.counters["infections"] == 1
+    assert engine.env.now - 10 < engine.infection_ticks[0] <= engine.env.now
+
+    del scenario["simulation"]["stop_when"]
+    engine = HAISimulatorEngine(scenario)
+    engine.stop_condition = lambda e: "VISITS" if e.counters["visits"] >= 100 else None
+    engine.run()
+    assert engine.stop_reason == "VISITS" and engine.env.now < 500
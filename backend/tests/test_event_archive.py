@@ -0,0 +1,141 @@
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import os
+import sys
+import zlib
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import jobs, main
+from src.engine import event_archive
+from src.engine.event_archive import EventArchive, decode_block, encode_block, open_archive, write_archive
+from src.engine.eventlog import EventLog
+from src.engine.heap_engine import create_engine
+from src.event_store import CHUNK_COLLECTION, chunk_event_log
+from tests.asgi import asgi_exchange
+from tests.memory_db import MemoryDatabase, SyncDatabase
+from tests.test_heap_engine import get_ward_scenario
+
+
+def ward_log(max_ticks=300):
+    scenario = get_ward_scenario()
+    scenario["simulation"]["max_ticks"] = max_ticks
+    return create_engine(scenario).run()
+
+def test_block_round_trip_with_fractional_ticks_and_extras():
+    """ Un blocco ricostruisce gli stessi dict, anche con tick non interi ed eventi custom """
+    log = EventLog()
+    nurse, room = log.intern("NURSE_1"), log.intern("R_01")
+    log.add(0, "START", "Simulation environment initialized")
+    log.add_move(3, nurse, room, log.intern("NURSE"))
+    log.add_hygiene(3.5, nurse, room, log.intern("WASH_IN_FAIL"))
+    log.add_infection(4.25, nurse, log.intern("P_001"), log.intern("DIRECT_HANDS"))
+    log.add(5, "NOTE", "custom", extra=[1, 2])
+
+    assert list(decode_block(encode_block(log, 0, len(log)))) == list(log)
+    # Blocco parziale: tabella locale con i soli id usati
+    part = decode_block(encode_block(log, 1, 3))
+    assert list(part) == log[1:3]
+    assert sorted(part.strings) == ["NURSE", "NURSE_1", "R_01", "WASH_IN_FAIL"]
+
+def test_archive_file_reads_ranges_through_mmap(tmp_path):
+    """ L'archivio su file (mmap) ridà il log completo e decodifica solo i blocchi del range """
+    log = ward_log()
+    chunks = list(chunk_event_log("run_1", log, chunk_ticks=50))
+    path = tmp_path / "run_1.hailog"
+    with open(path, "wb") as fp:
+        size = write_archive(fp, chunks, meta={"run_id": "run_1"})
+    assert size == path.stat().st_size
+    assert size < log.nbytes() / 4
+
+    with open_archive(str(path)) as archive:
+        assert archive.n_events == len(log) and archive.meta == {"run_id": "run_1"}
+        assert list(archive) == log
+        selected = list(archive.iter_events(from_tick=120, to_tick=180, types={"MOVE", "INFECTION"}))
+        assert selected == [e for e in log if 120 <= e["t"] <= 180 and e["type"] in ("MOVE", "INFECTION")]
+        lines = list(archive.iter_jsonl(to_tick=10))
+        assert [json.loads(line) for line in lines] == [e for e in log if e["t"] <= 10]
+
+def test_archive_endpoint_etag_and_gzip():
+    """ /archive ricompone il log dai chunk; le run completate rispondono 304 a If-None-Match """
+    db = MemoryDatabase()
+    sync_db = SyncDatabase(db)
+    previous, main.db = main.db, db
+    try:
+        scenario = get_ward_scenario()
+        scenario["simulation"]["max_ticks"] = 200
+        engine = create_engine(scenario)
+        run_id = str(sync_db.simulation_runs.insert_one({"status": "RUNNING", "log_level": "FULL"}).inserted_id)
+        with contextlib.redirect_stdout(io.StringIO()):
+            jobs._simulate_and_store(engine, run_id, sync_db, {}, {})
+        assert sync_db.simulation_runs.find_one({"_id": ObjectId(run_id)})["status"] == "COMPLETED"
+
+        status, headers, body = asyncio.run(asgi_exchange(main.app, "GET", f"/runs/{run_id}/archive"))
+        assert status == 200 and "content-encoding" in headers
+        assert list(EventArchive(body)) == engine.event_log
+        etag = headers["etag"]
+
+        status, _, body = asyncio.run(asgi_exchange(main.app, "GET", f"/runs/{run_id}/archive", headers={"If-None-Match": etag}))
+        assert status == 304 and body == b""
+        # L'ETag dipende dalla richiesta: altri parametri, altra rappresentazione
+        status, headers, body = asyncio.run(asgi_exchange(
+            main.app, "GET", f"/runs/{run_id}/events", "types=MOVE", headers={"If-None-Match": etag, "Accept-Encoding": "gzip"},
+        ))
+        assert status == 200 and headers["etag"] != etag and headers["content-encoding"] == "gzip"
+        events = [json.loads(line) for line in gzip.decompress(body).decode().splitlines()]
+        assert events == [e for e in engine.event_log if e["type"] == "MOVE"]
+        status, _, _ = asyncio.run(asgi_exchange(
+            main.app, "GET", f"/runs/{run_id}/events", "types=MOVE", headers={"If-None-Match": headers["etag"]},
+        ))
+        assert status == 304
+    finally:
+        main.db = previous
+
+class FakeZstd:
+    """Sostituto di `zstandard` (zlib con prefisso) per provare la ricompressione senza il pacchetto"""
+
+    class ZstdCompressor:
+        def __init__(self, level=3):
+            pass
+
+        def compress(self, data):
+            return b"Z" + zlib.compress(data)
+
+    class ZstdDecompressor:
+        def decompress(self, data):
+            assert data[:1] == b"Z"
+            return zlib.decompress(data[1:])
+
+def test_fork_archive_recodes_parent_blocks(monkeypatch):
+    """ Fork con codec diverso dalla madre: i blocchi ereditati sono ricompressi, o 409 se il codec manca """
+    db = MemoryDatabase()
+    sync_db = SyncDatabase(db)
+    previous, main.db = main.db, db
+    try:
+        scenario = get_ward_scenario()
+        scenario["simulation"]["max_ticks"] = 200
+        engine = create_engine(scenario)
+        parent_id = str(sync_db.simulation_runs.insert_one({"status": "RUNNING", "log_level": "FULL"}).inserted_id)
+        with contextlib.redirect_stdout(io.StringIO()):
+            jobs._simulate_and_store(engine, parent_id, sync_db, {}, {})
+        assert sync_db[CHUNK_COLLECTION].distinct("codec", {"run_id": parent_id}) == ["zlib"]
+        fork_id = str(sync_db.simulation_runs.insert_one({
+            "status": "COMPLETED", "parent_run_id": parent_id, "fork_tick": 100, "event_codec": "zstd",
+        }).inserted_id)
+
+        status, _, _ = asyncio.run(asgi_exchange(main.app, "GET", f"/runs/{fork_id}/archive"))
+        assert status == 409
+
+        monkeypatch.setattr(event_archive, "zstandard", FakeZstd)
+        status, _, body = asyncio.run(asgi_exchange(main.app, "GET", f"/runs/{fork_id}/archive"))
+        assert status == 200
+        archive = EventArchive(body)
+        assert archive.codec == "zstd" and all(body[b["offset"]:b["offset"] + 1] == b"Z" for b in archive.blocks)
+        assert list(archive) == [e for e in engine.event_log if e["t"] < 100]
+    finally:
+        main.db = previous
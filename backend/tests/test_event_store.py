@@ -0,0 +1,32 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.engine.simulator import HAISimulatorEngine
+from src.event_store import chunk_event_log, chunk_events, chunk_query, filter_events
+from tests.test_engine import get_base_scenario
+
+def test_chunks_preserve_log_and_windows():
+    """ I chunk ricompongono il log originale e rispettano la finestra di tick e la dimensione massima """
+    log = HAISimulatorEngine(get_base_scenario()).run()
+    chunks = list(chunk_event_log("run_1", log, chunk_ticks=10, max_events=8))
+
+    rebuilt = [e for c in chunks for e in chunk_events(c)]
+    assert rebuilt == log
+    assert [c["seq"] for c in chunks] == list(range(len(chunks)))
+    for c in chunks:
+        assert 0 < c["n"] <= 8
+        assert all(c["t_start"] <= e["t"] < c["t_end"] for e in chunk_events(c))
+
+def test_tick_range_selects_only_overlapping_chunks():
+    """ La query di range seleziona i soli chunk che intersecano l'intervallo richiesto """
+    log = HAISimulatorEngine(get_base_scenario()).run()
+    chunks = list(chunk_event_log("run_1", log, chunk_ticks=10))
+
+    query = chunk_query("run_1", from_tick=12, to_tick=25)
+    selected = [c for c in chunks if c["t_end"] > query["t_end"]["$gt"] and c["t_start"] <= query["t_start"]["$lte"]]
+    assert {c["t_start"] for c in selected} == {10, 20}
+
+    events = [e for c in selected for e in filter_events(chunk_events(c), 12, 25, {"MOVE"})]
+    assert events == [e for e in log if 12 <= e["t"] <= 25 and e["type"] == "MOVE"]
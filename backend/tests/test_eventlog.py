@@ -0,0 +1,45 @@
+import os
+import sys
+import pickle
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.engine.eventlog import EventLog
+from src.engine.simulator import HAISimulatorEngine
+from tests.test_engine import get_base_scenario
+
+def test_columnar_events_render_as_legacy_dicts():
+    """ La lettura lazy produce gli stessi dict (chiavi, msg, tipi di `t`) del vecchio log a lista """
+    log = EventLog()
+    nurse, room, role = log.intern("NURSE_1"), log.intern("R_01"), log.intern("NURSE")
+    log.add(0, "START", "Simulation environment initialized")
+    log.add_move(3, nurse, room, role)
+    log.add_hygiene(3, nurse, room, log.intern("WASH_IN_FAIL"))
+    log.add_infection(3, nurse, log.intern("P_001"), log.intern("DIRECT_HANDS"))
+    log.add(4.256, "NOTE", "custom", extra=1)
+
+    assert list(log) == [
+        {"t": 0, "type": "START", "msg": "Simulation environment initialized"},
+        {"t": 3, "type": "MOVE", "msg": "NURSE NURSE_1 visiting R_01", "agent_id": "NURSE_1", "room": "R_01"},
+        {"t": 3, "type": "HYGIENE", "msg": "WASH_IN_FAIL", "agent_id": "NURSE_1", "room": "R_01"},
+        {"t": 3, "type": "INFECTION", "msg": "Patient P_001 infected by NURSE_1",
+         "source": "NURSE_1", "target": "P_001", "mechanism": "DIRECT_HANDS"},
+        {"t": 4.26, "type": "NOTE", "msg": "custom", "extra": 1},
+    ]
+    assert isinstance(log[1]["t"], int)
+    assert log[-1]["type"] == "NOTE"
+    assert log.count_by_type() == {"START": 1, "MOVE": 1, "HYGIENE": 1, "INFECTION": 1, "NOTE": 1}
+
+def test_engine_log_columns_and_pickle():
+    """ Il log del motore è colonnare, compatto e serializzabile """
+    log = HAISimulatorEngine(get_base_scenario()).run()
+    assert isinstance(log, EventLog)
+    assert log.nbytes() <= 25 * len(log)
+
+    results = log.count_results("HYGIENE")
+    assert sum(results.values()) == sum(1 for e in log if e["type"] == "HYGIENE")
+
+    restored = pickle.loads(pickle.dumps(log))
+    assert restored == log
+    restored.add(99, "END", "again")
+    assert len(restored) == len(log) + 1
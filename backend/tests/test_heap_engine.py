@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.engine.heap_engine import HeapSimulatorEngine, create_engine
+from src.engine.models import ScenarioInput
+from src.engine.simulator import HAISimulatorEngine
+from tests.test_engine import get_base_scenario
+
+
+def get_ward_scenario():
+    scenario = get_base_scenario()
+    scenario["hospital"] = {
+        "rooms": 3,
+        "wards": [{ "id": "MED", "rooms": 4, "room_type": "DOUBLE" }],
+    }
+    scenario["staffing"] = [
+        { "role": "NURSE", "count": 3, "ward": "MED", "compliance_modifier": 0.8 },
+        { "role": "DOC", "count": 2 },
+        { "role": "CLEANER", "count": 1 },
+    ]
+    scenario["patients"] = [
+        { "id": "P_INDEX", "room": "MED_R_01", "state": "INFECTED", "susceptibility": 1.0 },
+        { "id": "P_001", "room": "MED_R_01", "state": "SUSCEPTIBLE", "susceptibility": 0.9 },
+        { "id": "P_002", "room": "MED_R_03", "state": "SUSCEPTIBLE", "susceptibility": 0.7 },
+        { "id": "P_003", "room": "R_02", "state": "SUSCEPTIBLE", "susceptibility": 0.5 },
+    ]
+    scenario["pathogen"]["transmission_prob"] = 1.0
+    ScenarioInput(**scenario)
+    return scenario
+
+
+@pytest.mark.parametrize("seed", [1, 7, 42, 1234])
+@pytest.mark.parametrize("decay_mode", ["STEPWISE", "LAZY", "EXACT"])
+@pytest.mark.parametrize("make_scenario", [get_base_scenario, get_ward_scenario])
+def test_heap_matches_simpy_event_sequence(seed, decay_mode, make_scenario):
+    """ Stesso seed e scenario: il backend a heap produce esattamente gli eventi del backend SimPy """
+    scenario = make_scenario()
+    scenario["scenario_meta"]["seed"] = seed
+    scenario["simulation"]["max_ticks"] = 400
+    scenario["simulation"]["decay_mode"] = decay_mode
+
+    simpy_engine = HAISimulatorEngine(scenario)
+    heap_engine = HeapSimulatorEngine(scenario)
+    assert heap_engine.run().to_list() == simpy_engine.run().to_list()
+    assert heap_engine.summary() == simpy_engine.summary()
+
+def test_heap_progress_segments_and_log_levels():
+    """ Avanzamento a segmenti e livelli ridotti: stesso riepilogo del backend SimPy """
+    scenario = get_ward_scenario()
+    scenario["simulation"]["max_ticks"] = 250
+
+    ticks = []
+    heap_log = HeapSimulatorEngine(scenario).run(on_progress=ticks.append, progress_interval=100)
+    assert ticks == [100, 200, 250]
+    assert heap_log.to_list() == HAISimulatorEngine(scenario).run().to_list()
+
+    for level in ("EPIDEMIC_ONLY", "COUNTERS"):
+        assert create_engine(scenario, level, "HEAP").run() == create_engine(scenario, level, "SIMPY").run()
+
+def test_create_engine_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        create_engine(get_base_scenario(), backend="GPU")
@@ -0,0 +1,93 @@
+import asyncio
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+from bson import ObjectId
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import jobs, main
+from src.engine.heap_engine import create_engine
+from src.engine.instrumentation import EngineProfiler
+from src.metrics import Registry, observe_run
+from tests.asgi import asgi_request
+from tests.memory_db import MemoryDatabase, SyncDatabase
+from tests.test_heap_engine import get_ward_scenario
+
+
+@pytest.mark.parametrize("backend", ["SIMPY", "HEAP"])
+@pytest.mark.parametrize("decay_mode", ["STEPWISE", "LAZY"])
+def test_profiler_does_not_change_the_run(backend, decay_mode):
+    """ Con i timer di fase la run produce gli stessi eventi; fasi e contatori tornano con il log """
+    scenario = get_ward_scenario()
+    scenario["simulation"]["max_ticks"] = 300
+    scenario["simulation"]["decay_mode"] = decay_mode
+
+    plain = create_engine(scenario, backend=backend)
+    profiled = create_engine(scenario, backend=backend)
+    profiled.profiler = EngineProfiler()
+    assert profiled.run().to_list() == plain.run().to_list()
+    assert profiled.summary() == plain.summary()
+
+    stats = profiled.profiler.stats(profiled)
+    events = stats["events_by_type"]
+    assert stats["phases"]["visit"]["calls"] == stats["counters"]["visits"] == events["MOVE"]
+    assert stats["phases"]["hygiene"]["calls"] == events["HYGIENE"]
+    assert stats["phases"]["log"]["calls"] == sum(events.values()) - 1 # START è registrato prima della run
+    assert stats["counters"]["rng_draws"] >= 2 * stats["counters"]["visits"]
+    if decay_mode == "STEPWISE":
+        assert stats["counters"]["decay_steps"] == 299
+    else:
+        assert stats["counters"]["decay_entity_updates"] > 0
+    # Strumentazione rimossa a fine run
+    assert "_cross_contaminate" not in vars(profiled) and "add_move" not in vars(profiled.event_log)
+
+def test_metrics_render_prometheus_text():
+    registry = Registry()
+    requests = registry.counter("req_total", "Richieste", ("route",))
+    latency = registry.histogram("lat_seconds", "Latenza", buckets=(0.1, 1.0))
+    requests.inc(route='/runs/{run_id}')
+    requests.inc(2, route='/runs/{run_id}')
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+    text = registry.render()
+    assert 'req_total{route="/runs/{run_id}"} 3' in text
+    assert 'lat_seconds_bucket{le="0.1"} 1' in text
+    assert 'lat_seconds_bucket{le="1.0"} 2' in text
+    assert 'lat_seconds_bucket{le="+Inf"} 3' in text
+    assert "lat_seconds_count 3" in text and "# TYPE lat_seconds histogram" in text
+
+def test_run_stats_profile_and_metrics_endpoints():
+    """ Il worker registra `stats` e il profilo cProfile; l'API li espone su /runs/{id}/profile e /metrics """
+    db = MemoryDatabase()
+    sync_db = SyncDatabase(db)
+    previous, main.db = main.db, db
+    try:
+        scenario = get_ward_scenario()
+        scenario["simulation"]["max_ticks"] = 200
+        run_id = str(sync_db.simulation_runs.insert_one({"status": "RUNNING", "log_level": "FULL"}).inserted_id)
+        with contextlib.redirect_stdout(io.StringIO()):
+            jobs._simulate_and_store(create_engine(scenario), run_id, sync_db, {}, {}, profile="CPROFILE")
+        doc = sync_db.simulation_runs.find_one({"_id": ObjectId(run_id)})
+        stats = doc["stats"]
+        assert doc["has_profile"] and stats["wall_s"] > 0 and stats["cpu_s"] > 0
+        assert stats["engine"]["events_by_type"]["MOVE"] == stats["engine"]["counters"]["visits"]
+        assert {"serialize_events", "write_events", "timeseries", "checkpoints", "keyframes", "profile"} <= set(stats["storage"])
+
+        status, body = asyncio.run(asgi_request(main.app, "GET", f"/runs/{run_id}/profile", "format=text&limit=5"))
+        assert status == 200 and b"_advance" in body
+        status, body = asyncio.run(asgi_request(main.app, "GET", f"/runs/{run_id}/profile"))
+        assert status == 200 and len(body) > 0
+
+        observe_run("COMPLETED", stats)
+        status, body = asyncio.run(asgi_request(main.app, "GET", "/metrics"))
+        text = body.decode()
+        assert status == 200
+        assert 'hai_runs_total{status="COMPLETED"}' in text
+        assert 'hai_engine_events_total{type="MOVE"}' in text
+        assert 'hai_http_requests_total{method="GET",route="/runs/{run_id}/profile",status="200"}' in text
+    finally:
+        main.db = previous
@@ -0,0 +1,76 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import jobs, main
+from src.engine.heap_engine import create_engine
+from src.event_store import CHUNK_COLLECTION, chunk_event_log
+from tests.asgi import asgi_exchange
+from tests.memory_db import MemoryDatabase, SyncDatabase
+from tests.test_heap_engine import get_ward_scenario
+
+
+def parse_sse(body: bytes):
+    """ Messaggi SSE come (event, id, data); commenti e `retry` esclusi """
+    messages = []
+    for block in body.decode().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":") and ": " in line)
+        if "event" in fields:
+            messages.append((fields["event"], fields.get("id"), json.loads(fields["data"])))
+    return messages
+
+def test_live_chunks_match_single_pass_and_stream_resumes():
+    """ I chunk scritti durante la run coincidono con quelli di un'unica passata; /live li ridà in ordine """
+    db = MemoryDatabase()
+    sync_db = SyncDatabase(db)
+    previous, main.db = main.db, db
+    flush_s, jobs.RUN_LIVE_FLUSH_S = jobs.RUN_LIVE_FLUSH_S, 0.0
+    try:
+        scenario = get_ward_scenario()
+        scenario["simulation"]["max_ticks"] = 400
+        engine = create_engine(scenario)
+        run_id = str(sync_db.simulation_runs.insert_one({"status": "RUNNING", "log_level": "FULL"}).inserted_id)
+        with contextlib.redirect_stdout(io.StringIO()):
+            jobs._simulate_and_store(engine, run_id, sync_db, {}, {})
+
+        stored = asyncio.run(db[CHUNK_COLLECTION].find({"run_id": run_id}).sort("seq", 1).to_list(None))
+        expected = list(chunk_event_log(run_id, engine.event_log))
+        assert [{k: c[k] for k in expected[0]} for c in stored] == expected
+        frames = asyncio.run(db[jobs.LIVE_FRAME_COLLECTION].find({"run_id": run_id}).to_list(None))
+        ticks = [f["tick"] for f in frames]
+        assert len(ticks) > 5 and ticks == sorted(set(ticks)) and ticks[-1] == engine.env.now
+        assert frames[-1]["infected"] == engine.state_counts["INFECTED"]
+
+        main.LIVE_BATCH, batch = 3, main.LIVE_BATCH
+        try:
+            status, headers, body = asyncio.run(asgi_exchange(main.app, "GET", f"/runs/{run_id}/live"))
+        finally:
+            main.LIVE_BATCH = batch
+        assert status == 200 and headers["content-type"].startswith("text/event-stream")
+        messages = parse_sse(body)
+        events = [e for kind, _, data in messages if kind == "events" for e in data]
+        assert events == engine.event_log
+        assert [data["tick"] for kind, _, data in messages if kind == "frame"] == ticks
+        assert messages[-1][0] == "end" and messages[-1][2]["status"] == "COMPLETED"
+        # Ogni fotogramma arriva dopo gli eventi dei tick precedenti
+        seen = 0
+        for kind, _, data in messages:
+            if kind == "events":
+                seen = data[-1]["t"]
+            elif kind == "frame":
+                assert seen <= data["tick"]
+
+        # Riconnessione da metà stream: solo il resto
+        middle = len(messages) // 2
+        status, _, body = asyncio.run(asgi_exchange(
+            main.app, "GET", f"/runs/{run_id}/live", headers={"Last-Event-ID": messages[middle][1]},
+        ))
+        assert status == 200 and parse_sse(body) == messages[middle + 1:]
+    finally:
+        main.db = previous
+        jobs.RUN_LIVE_FLUSH_S = flush_s
@@ -0,0 +1,102 @@
+import asyncio
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+from bson import ObjectId
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import jobs, main
+from src.engine.heap_engine import create_engine
+from src.engine.partition import EntityStream, PartitionedEngine, entity_keys, plan_partitions
+from src.event_store import CHUNK_COLLECTION
+from tests.asgi import asgi_request
+from tests.memory_db import MemoryDatabase, SyncDatabase
+from tests.scenarios import ward_scenario
+
+
+def multiward_scenario(decay_mode="STEPWISE", max_ticks=400):
+    """Tre reparti con infermieri dedicati, medici e cleaner su tutto l'ospedale (migrano tra partizioni)"""
+    return ward_scenario([25, 25, 25], nurses=22, doctors=5, cleaners=3, patients=150, max_ticks=max_ticks, decay_mode=decay_mode)
+
+def partitioned_run(scenario, workers, processes):
+    """Log, riepilogo, frame e fotogrammi di una run partizionata con tutti i callback attivi"""
+    frames = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = PartitionedEngine(scenario, workers=workers, processes=processes)
+        log = engine.run(
+            on_progress=lambda t: frames.append(engine.frame()), progress_interval=37,
+            series_interval=25, on_keyframe=frames.append, keyframe_interval=50,
+        )
+    return log.to_list(), engine.summary().model_dump(), frames, engine.series.columns
+
+def test_streams_are_keyed_per_entity_and_counter_based():
+    """ Le estrazioni di una visita dipendono solo da (operatore, visita), non dall'ordine di consumo """
+    keys = entity_keys(42, ["NURSE_0", "NURSE_1", "CLEANER_0"])
+    assert keys == entity_keys(42, ["NURSE_0", "NURSE_1", "CLEANER_0"]) and len(set(keys)) == 3
+    # La chiave dipende solo da (seed, id): un operatore in più non cambia gli stream degli altri
+    assert entity_keys(42, ["NURSE_0", "CLEANER_0", "CLEANER_1"])[:2] == [keys[0], keys[2]]
+    assert entity_keys(-42, ["NURSE_0"])[0] != keys[0]
+    a, b = EntityStream(keys[0]), EntityStream(keys[0])
+    a.begin(7, a.draws(7))
+    first = [a.random() for _ in range(20)] # oltre il primo blocco di parole
+    b.begin(3, b.draws(3))
+    b.random()
+    b.begin(7, b.draws(7))
+    assert [b.random() for _ in range(20)] == first
+    assert all(0.0 <= x < 1.0 for x in first)
+    assert EntityStream(keys[1]).draws(7) != a.draws(7)
+    assert a.choice(["A", "B", "C"]) == ["A", "B", "C"][a.draws(7)[0] % 3]
+
+def test_partitioned_run_is_identical_for_any_worker_count():
+    """ Stessi eventi, riepilogo, serie e fotogrammi con 1, 2 o 3 partizioni, in processo o in processi separati """
+    scenario = multiward_scenario()
+    engine = PartitionedEngine(scenario, workers=3)
+    owner = plan_partitions(engine, 3)
+    assert sorted(set(owner.values())) == [0, 1, 2]
+    assert all(len({owner[rid] for rid in rooms}) == 1 for rooms in engine.wards.values())
+
+    reference = partitioned_run(scenario, 1, False)
+    log, summary = reference[0], reference[1]
+    assert summary["infections"] > 10 and sum(e["type"] == "MOVE" for e in log) == summary["visits"]
+    assert [e["t"] for e in log] == sorted(e["t"] for e in log)
+    assert partitioned_run(scenario, 3, True) == reference
+    assert partitioned_run(scenario, 2, False) == reference
+
+    lazy = multiward_scenario("LAZY")
+    assert partitioned_run(lazy, 3, False) == partitioned_run(lazy, 1, False)
+
+    # L'arresto anticipato legge le cariche raccolte dalle partizioni: stessa decisione per ogni divisione
+    quiet = ward_scenario([25, 25, 25], nurses=15, doctors=3, cleaners=2, patients=80, max_ticks=3000, transmission_prob=0.3, base_compliance=0.6)
+    quiet["simulation"]["early_stop"] = True
+    stopped = partitioned_run(quiet, 3, False)
+    assert stopped == partitioned_run(quiet, 1, False)
+    assert stopped[1]["stop_reason"] == "ABSORBING" and stopped[1]["ticks_simulated"] < 3000
+
+def test_partitioned_backend_through_jobs_and_api():
+    """ Il backend passa da `create_engine` e dal worker; niente provenienza né fork """
+    db = MemoryDatabase()
+    sync_db = SyncDatabase(db)
+    previous, main.db = main.db, db
+    try:
+        scenario = multiward_scenario(max_ticks=200)
+        engine = create_engine(scenario, backend="PARTITIONED")
+        run_id = str(sync_db.simulation_runs.insert_one({"status": "RUNNING", "log_level": "FULL", "engine": "PARTITIONED"}).inserted_id)
+        with contextlib.redirect_stdout(io.StringIO()):
+            jobs._simulate_and_store(engine, run_id, sync_db, {}, {})
+        doc = sync_db.simulation_runs.find_one({"_id": ObjectId(run_id)})
+        assert doc["status"] == "COMPLETED" and doc["event_log_size"] == len(engine.event_log)
+        assert engine.provenance is None
+        for call in (engine.checkpoint, lambda: engine.restore({}), lambda: engine.advance_to(10)):
+            with pytest.raises(ValueError, match="PARTITIONED"):
+                call()
+        chunks = asyncio.run(db[CHUNK_COLLECTION].find({"run_id": run_id}).to_list(None))
+        assert sum(c["n"] for c in chunks) == len(engine.event_log)
+
+        status, _ = asyncio.run(asgi_request(main.app, "POST", f"/runs/{run_id}/fork", "tick=50"))
+        assert status == 400
+    finally:
+        main.db = previous
@@ -0,0 +1,95 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import jobs, main
+from src.checkpoint_store import CHECKPOINT_COLLECTION, decode_checkpoint
+from src.engine.heap_engine import create_engine
+from src.engine.provenance import PROVENANCE_TRAIL, ProvenanceGraph
+from tests.asgi import asgi_request
+from tests.memory_db import MemoryDatabase, SyncDatabase
+from tests.scenarios import ward_scenario
+
+
+def epidemic_scenario(max_ticks=300):
+    """Reparto con igiene scarsa: decine di infezioni e catene lunghe in pochi tick"""
+    return ward_scenario([25], nurses=8, doctors=1, cleaners=1, patients=50, max_ticks=max_ticks)
+
+def rooms_since_wash(log, staff_id, until):
+    """ Stanze dell'operatore dall'ultimo lavaggio riuscito, ricostruite scorrendo il log """
+    trail = []
+    for e in log[:until]:
+        if e.get("agent_id") != staff_id:
+            continue
+        if e["type"] == "MOVE":
+            trail.append(e["room"])
+        elif e["msg"] == "WASH_IN_SUCCESS":
+            trail = [e["room"]]
+        elif e["msg"] == "WASH_OUT_SUCCESS":
+            trail = []
+    return trail[-PROVENANCE_TRAIL:]
+
+def test_trace_agrees_with_event_log():
+    """ Ogni catena parte dall'evento INFECTION, va indietro nel tempo e finisce in un paziente indice """
+    scenario = epidemic_scenario()
+    engine = create_engine(scenario)
+    log = engine.run().to_list()
+    graph = engine.provenance
+    index_cases = {p["id"] for p in scenario["patients"] if p["state"] == "INFECTED"}
+
+    infections = [(i, e) for i, e in enumerate(log) if e["type"] == "INFECTION"]
+    assert len(infections) > 10
+    assert max(len(graph.trace(e["target"])) for _, e in infections) > 5
+    for i, e in infections:
+        chain = graph.trace(e["target"])
+        head = chain[0]
+        assert (head["type"], head["t"], head["staff"], head["patient"]) == ("INFECTION", e["t"], e["source"], e["target"])
+        assert head["rooms_since_wash"] == rooms_since_wash(log, e["source"], i)
+        assert [s["t"] for s in chain] == sorted((s["t"] for s in chain), reverse=True)
+        assert chain[-1]["type"] == "INDEX" and chain[-1]["patient"] in index_cases
+
+    restored = ProvenanceGraph.from_blobs(graph.to_blobs())
+    assert all(restored.trace(e["target"]) == graph.trace(e["target"]) for _, e in infections)
+    assert create_engine(scenario, log_level="COUNTERS").provenance is None
+
+def test_trace_endpoint_follows_fork_into_parent():
+    """ Per un fork, le infezioni precedenti al tick di fork sono risolte nel grafo della run madre """
+    db = MemoryDatabase()
+    sync_db = SyncDatabase(db)
+    previous, main.db = main.db, db
+    try:
+        scenario = epidemic_scenario()
+        parent_id = str(sync_db.simulation_runs.insert_one({"status": "RUNNING", "log_level": "FULL"}).inserted_id)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parent = create_engine(scenario)
+            jobs._simulate_and_store(parent, parent_id, sync_db, {}, {})
+            checkpoint = sync_db[CHECKPOINT_COLLECTION].find_one({"run_id": parent_id, "tick": 144})
+            fork = create_engine(scenario)
+            fork.restore(decode_checkpoint(checkpoint["data"]))
+            fork_id = str(sync_db.simulation_runs.insert_one({
+                "status": "RUNNING", "log_level": "FULL", "parent_run_id": parent_id, "fork_tick": 144,
+            }).inserted_id)
+            jobs._simulate_and_store(fork, fork_id, sync_db, {}, {})
+
+        infected = sorted(parent.provenance.infections, key=lambda pid: parent.provenance.trace(pid)[0]["t"])
+        early = next(pid for pid in infected if 0 < parent.provenance.trace(pid)[0]["t"] < 144)
+        late = next(pid for pid in infected if parent.provenance.trace(pid)[0]["t"] >= 144)
+
+        status, body = asyncio.run(asgi_request(main.app, "GET", f"/runs/{fork_id}/trace/{early}"))
+        assert status == 200
+        assert json.loads(body)["chain"] == json.loads(json.dumps(parent.provenance.trace(early)))
+        # Il fork senza modifiche ripete la run madre: stessa catena, raccordata ai nodi della madre
+        status, body = asyncio.run(asgi_request(main.app, "GET", f"/runs/{fork_id}/trace/{late}"))
+        chain = json.loads(body)["chain"]
+        assert status == 200 and chain == json.loads(json.dumps(parent.provenance.trace(late)))
+        assert json.loads(body)["depth"] == len(chain)
+
+        status, _ = asyncio.run(asgi_request(main.app, "GET", f"/runs/{parent_id}/trace/NOT_A_PATIENT"))
+        assert status == 404
+    finally:
+        main.db = previous
@@ -0,0 +1,56 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.engine.heap_engine import create_engine
+from src.engine.sweep import build_tasks
+from src.run_cache import event_log_digest, run_cache_key, sweep_task_cache_key
+from tests.test_engine import get_base_scenario
+
+
+def test_cache_key_is_canonical():
+    """ La chiave dipende dal contenuto validato, non dall'ordine dei campi né dai default impliciti """
+    scenario = get_base_scenario()
+    reordered = dict(reversed(list(scenario.items())))
+    explicit = get_base_scenario()
+    explicit["simulation"]["decay_mode"] = "STEPWISE"
+    explicit["scenario_id"] = "65f0c0ffee" # campo extra del documento Mongo, ignorato
+
+    key = run_cache_key(scenario)
+    assert len(key) == 64
+    assert run_cache_key(reordered) == key
+    assert run_cache_key(explicit) == key
+
+    reseeded = get_base_scenario()
+    reseeded["scenario_meta"]["seed"] = 43
+    assert run_cache_key(reseeded) != key
+    assert run_cache_key(scenario, "COUNTERS") != key
+
+def test_sweep_task_key_matches_single_run():
+    """ Un task di sweep e una run COUNTERS dello stesso scenario e seed condividono la chiave """
+    tasks = build_tasks(get_base_scenario(), {"hygiene.base_compliance": [0.5, 0.9]}, 2)
+    scenario = get_base_scenario()
+    scenario["scenario_meta"]["seed"] = tasks[0]["seed"]
+    assert sweep_task_cache_key(tasks[0]) == run_cache_key(scenario, "COUNTERS")
+    assert len({sweep_task_cache_key(t) for t in tasks}) == 4
+
+def test_cache_key_changes_with_engine_version(monkeypatch):
+    """ Un cambio di versione del motore invalida le chiavi di ogni backend e dei task di sweep """
+    from src import run_cache
+
+    scenario = get_base_scenario()
+    crn_task = build_tasks(scenario, {"hygiene.base_compliance": [0.5]}, 1, crn=True)[0]
+    before = [run_cache_key(scenario), run_cache_key(scenario, backend="PARTITIONED"), sweep_task_cache_key(crn_task)]
+    monkeypatch.setattr(run_cache, "ENGINE_VERSION", run_cache.ENGINE_VERSION + ".next")
+    after = [run_cache_key(scenario), run_cache_key(scenario, backend="PARTITIONED"), sweep_task_cache_key(crn_task)]
+    assert all(a != b for a, b in zip(before, after))
+
+def test_event_log_digest_is_reproducible():
+    """ Stessa chiave, stesso log: l'impronta coincide tra esecuzioni e backend, e cambia con il seed """
+    scenario = get_base_scenario()
+    digest = event_log_digest(create_engine(scenario).run())
+    assert event_log_digest(create_engine(scenario, backend="HEAP").run()) == digest
+
+    scenario["scenario_meta"]["seed"] = 7
+    assert event_log_digest(create_engine(scenario).run()) != digest
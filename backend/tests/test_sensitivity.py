@@ -0,0 +1,69 @@
+import contextlib
+import io
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.engine.sensitivity import (
+    compare_arms, latin_hypercube, morris_design, morris_effects, morris_points, run_sensitivity, saltelli_design,
+    scale_points, sobol_indices,
+)
+from src.engine.sweep import build_tasks
+from tests.scenarios import ward_scenario
+
+def test_latin_hypercube_and_scaling():
+    """ Un punto per strato in ogni dimensione; i parametri interi coprono tutti i valori """
+    unit = latin_hypercube(20, 3, np.random.default_rng(1))
+    assert unit.shape == (20, 3) and ((unit >= 0) & (unit < 1)).all()
+    for j in range(3):
+        assert sorted(np.floor(unit[:, j] * 20).astype(int)) == list(range(20))
+
+    points = scale_points(unit, [
+        {"path": "hygiene.base_compliance", "low": 0.4, "high": 0.9},
+        {"path": "staffing.CLEANER.count", "low": 1, "high": 4, "integer": True},
+    ])
+    assert all(0.4 <= p["hygiene.base_compliance"] <= 0.9 for p in points)
+    assert sorted({p["staffing.CLEANER.count"] for p in points}) == [1, 2, 3, 4]
+
+def test_indices_on_analytic_function():
+    """ f = x1 + 2 x2 (x3 inerte): Sobol S1 = ST = 1/5, 4/5, 0; effetti di Morris pari ai coefficienti """
+    f = lambda m: m[:, 0] + 2.0 * m[:, 1]
+    a, b, abs_ = saltelli_design(4000, 3, np.random.default_rng(7))
+    first, total = sobol_indices(f(a), f(b), [f(m) for m in abs_])
+    assert np.allclose(first, [0.2, 0.8, 0.0], atol=0.05)
+    assert np.allclose(total, [0.2, 0.8, 0.0], atol=0.05)
+
+    base, steps = morris_design(10, 3, np.random.default_rng(7))
+    values = f(np.array(morris_points(base, steps))).reshape(10, 4)
+    effects = morris_effects(values[:, 0], values[:, 1:], steps)
+    assert np.allclose(effects["mu_star"], [1.0, 2.0, 0.0]) and np.allclose(effects["sigma"], 0.0)
+
+def test_common_random_numbers_reduce_variance():
+    """ Con CRN i bracci condividono gli stream per operatore: differenze appaiate molto meno rumorose """
+    # Scenario piccolo con focolaio frequente: le repliche variano molto tra loro
+    scenario = ward_scenario([25, 5], nurses=9, doctors=2, cleaners=1, patients=40, base_compliance=0.2)
+    tasks = build_tasks(scenario, {"hygiene.base_compliance": [0.2, 0.3]}, replicates=2, crn=True)
+    assert {t["backend"] for t in tasks} == {"PARTITIONED"}
+    assert tasks[0]["seed"] == tasks[2]["seed"] and tasks[0]["seed"] != tasks[1]["seed"]
+
+    # Un cleaner in più: gli operatori già presenti mantengono i loro stream (chiavi per id)
+    arms = {"base": {}, "compliance": {"hygiene.base_compliance": 0.22}, "cleaner": {"staffing.CLEANER.count": 2}}
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = compare_arms(scenario, arms, replicates=4, metric="mean_hand_load", max_workers=1)
+    compliance, cleaner = report["comparisons"]
+    assert report["simulations"] == 12 and compliance["reference"] == "base"
+    assert cleaner["variance_reduction"]["factor"] > 10
+    assert report["variance_reduction"]["equivalent_simulations"] > 5 * report["simulations"]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sensitivity = run_sensitivity(
+            scenario, [{"path": "hygiene.base_compliance", "low": 0.1, "high": 0.6}, {"path": "pathogen.transmission_prob", "low": 0.5, "high": 1.0}],
+            method="MORRIS", samples=3, replicates=2, metric="hygiene_success", max_workers=1,
+        )
+    compliance_effect, transmission_effect = sensitivity["indices"]
+    assert sensitivity["simulations"] == 3 * 3 * 2
+    assert compliance_effect["mu_star"] > transmission_effect["mu_star"]
+    assert sensitivity["variance_reduction"]["factor"] > 1
@@ -0,0 +1,146 @@
+import asyncio
+import contextlib
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import main
+from src.engine.sweep import (
+    CsvRowWriter, StoppingRule, apply_overrides, build_tasks, derive_seed, expand_grid, run_sequential_sweep, run_sweep,
+    run_sweep_task, sequential_report, t_quantile,
+)
+from src.jobs import RunJobManager
+from tests.memory_db import MemoryDatabase
+from tests.test_engine import get_base_scenario
+
+GRID = {
+    "hygiene.base_compliance": [0.2, 0.8],
+    "staffing.CLEANER.count": [0, 2],
+}
+
+def test_grid_and_overrides():
+    """ Prodotto cartesiano della griglia e override per path puntato (anche per ruolo staff) """
+    cells = expand_grid(GRID)
+    assert len(cells) == 4
+
+    scenario = apply_overrides(get_base_scenario(), {"staffing.CLEANER.count": 3, "staffing.DOC.count": 1})
+    counts = {s["role"]: s["count"] for s in scenario["staffing"]}
+    assert counts == {"NURSE": 1, "CLEANER": 3, "DOC": 1}
+
+def test_seeds_are_deterministic_per_task():
+    """ I seed dipendono solo da (seed base, cella, replica), non dall'ordine di esecuzione """
+    tasks_1 = build_tasks(get_base_scenario(), GRID, replicates=3)
+    tasks_2 = build_tasks(get_base_scenario(), dict(reversed(list(GRID.items()))), replicates=3)
+    assert {t["task_key"]: t["seed"] for t in tasks_1} == {t["task_key"]: t["seed"] for t in tasks_2}
+    assert len({t["seed"] for t in tasks_1}) == len(tasks_1)
+    assert derive_seed(42, "{}", 0) == derive_seed(42, "{}", 0)
+
+def test_sweep_resume_skips_finished_tasks(tmp_path):
+    """ Una sweep interrotta riprende dal CSV senza ricalcolare i task già completati """
+    tasks = build_tasks(get_base_scenario(), GRID, replicates=2)
+    writer = CsvRowWriter(str(tmp_path / "sweep.csv"), list(GRID.keys()))
+
+    # Prima metà, poi "interruzione"
+    first = list(run_sweep(tasks[:4], max_workers=2, on_row=writer.write))
+    assert len(first) == 4
+
+    done = writer.done_keys()
+    resumed = list(run_sweep(tasks, done_keys=done, max_workers=2, on_row=writer.write))
+    assert len(resumed) == len(tasks) - 4
+    assert writer.done_keys() == {t["task_key"] for t in tasks}
+
+    # Stesso task -> stessa riga (seed derivato)
+    again = list(run_sweep(tasks[:1], max_workers=1))[0]
+    original = next(r for r in first + resumed if r["task_key"] == tasks[0]["task_key"])
+    assert again["infections"] == original["infections"]
+    assert again["hygiene_success"] == original["hygiene_success"]
+
+def test_sweep_on_shared_executor_bounds_tasks_in_flight():
+    """ Su un pool condiviso la sweep tiene in volo al più `max_workers` task e non lo chiude """
+    tasks = build_tasks(get_base_scenario(), GRID, replicates=2)
+    in_flight, peak = set(), []
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        submit = pool.submit
+
+        def tracked(fn, task):
+            fut = submit(fn, task)
+            in_flight.add(fut)
+            peak.append(len([f for f in in_flight if not f.done()]))
+            return fut
+
+        pool.submit = tracked
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = list(run_sweep(tasks, max_workers=2, executor=pool))
+        assert not pool._shutdown
+    assert sorted(r["task_key"] for r in rows) == sorted(t["task_key"] for t in tasks)
+    assert len(peak) == len(tasks) and max(peak) <= 2
+
+def test_api_sweep_runs_on_shared_task_pool(tmp_path, monkeypatch):
+    """ Le sweep dell'API girano nel pool dei task condiviso, non in uno per richiesta né nella coda delle run """
+    run_jobs = RunJobManager("mongodb://unused", "unused", max_workers=1, task_workers=2)
+    run_jobs.start()
+    submitted = []
+    submit = run_jobs.task_executor.submit
+    monkeypatch.setattr(run_jobs.task_executor, "submit", lambda fn, *args: submitted.append(fn) or submit(fn, *args))
+    run_slots = []
+    monkeypatch.setattr(run_jobs._executor, "submit", lambda fn, *args: run_slots.append(fn))
+    monkeypatch.setattr(main, "db", MemoryDatabase())
+    monkeypatch.setattr(main, "run_jobs", run_jobs)
+    monkeypatch.setattr(main, "SWEEP_EXPORT_DIR", str(tmp_path))
+
+    async def sweep():
+        scenario = get_base_scenario()
+        scenario["simulation"]["max_ticks"] = 100
+        res = await main.db.sweeps.insert_one({"base_scenario": scenario, "grid": GRID, "replicates": 1, "max_workers": 1})
+        await main._execute_sweep(str(res.inserted_id))
+        return await main.db.sweeps.find_one({"_id": res.inserted_id}), res.inserted_id
+
+    try:
+        doc, sweep_id = asyncio.run(sweep())
+    finally:
+        run_jobs.shutdown()
+    assert doc["status"] == "COMPLETED" and doc["completed_tasks"] == 4
+    assert submitted == [run_sweep_task] * 4 and not run_slots
+    assert len(CsvRowWriter(str(tmp_path / f"{sweep_id}.csv"), list(GRID.keys())).done_keys()) == 4
+
+def test_t_quantile_matches_tables():
+    """ Quantili della t di Student contro i valori tabulati (95% bilaterale) """
+    for df, expected in ((1, 12.706), (2, 4.303), (3, 3.182), (9, 2.262), (29, 2.045)):
+        assert abs(t_quantile(0.975, df) - expected) / expected < 2e-3
+
+def test_stopping_rule_grows_replicates_until_precision():
+    """ La regola aggiunge repliche finché la semiampiezza dell'IC non scende alla precisione (o al tetto) """
+    rule = StoppingRule(precision=0.5, metric="infections", min_replicates=4, max_replicates=64)
+    assert rule.target([3.0, 3.0, 3.0, 3.0]) == 4 # varianza nulla: convergenza immediata
+    noisy = [0.0, 4.0, 1.0, 5.0]
+    assert 4 < rule.target(noisy) <= 8 # al più raddoppia
+    assert StoppingRule(precision=1e-6, metric="infections", min_replicates=4, max_replicates=4).target(noisy) == 4
+
+def test_sequential_sweep_is_resumable_and_reports_precision(tmp_path):
+    """ Arresto sequenziale per cella: ripresa a metà con gli stessi blocchi e precisione raggiunta riportata """
+    scenario = get_base_scenario()
+    scenario["pathogen"]["transmission_prob"] = 1.0
+    scenario["hygiene"]["base_compliance"] = 0.1
+    scenario["simulation"]["max_ticks"] = 200
+    grid = {"hygiene.base_compliance": [0.1, 0.9]}
+    rule = StoppingRule(precision=0.2, metric="infections", min_replicates=3, max_replicates=24)
+
+    rows = list(run_sequential_sweep(scenario, grid, rule, max_workers=2))
+    report = sequential_report(grid, rule, rows)
+    assert len(report) == 2 and all(cell["finished"] for cell in report)
+    assert max(cell["replicates"] for cell in report) > 3
+    for cell in report:
+        assert cell["converged"] == (cell["half_width"] <= 0.2)
+        assert cell["converged"] or cell["replicates"] == 24
+    assert len(rows) == sum(cell["replicates"] for cell in report)
+
+    # Ripresa da metà delle righe (come dal CSV): completa le stesse repliche
+    writer = CsvRowWriter(str(tmp_path / "seq.csv"), list(grid.keys()))
+    for row in rows[: len(rows) // 2]:
+        writer.write(row)
+    resumed = list(run_sequential_sweep(scenario, grid, rule, done_rows=writer.rows(), max_workers=2))
+    assert {r["task_key"] for r in rows[: len(rows) // 2] + resumed} == {r["task_key"] for r in rows}
+    assert sequential_report(grid, rule, writer.rows() + resumed) == report
@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.engine.heap_engine import create_engine
+from src.engine.timeseries import SERIES_METRICS, TimeSeries, downsample
+from tests.test_heap_engine import get_ward_scenario
+
+
+def test_engine_series_match_counters():
+    """ Le serie non alterano la run e sono coerenti con contatori e stato finale """
+    scenario = get_ward_scenario()
+    scenario["simulation"]["max_ticks"] = 250
+    plain = create_engine(scenario).run().to_list()
+
+    engine = create_engine(scenario, backend="HEAP")
+    assert engine.run(series_interval=20).to_list() == plain
+
+    series = engine.series
+    assert list(series.t) == [0, 20, 40, 60, 80, 100, 120, 140, 160, 180, 200, 220, 240, 250]
+    assert sum(series.columns["hygiene_success"]) == engine.counters["hygiene_success"]
+    assert sum(series.columns["hygiene_fail"]) == engine.counters["hygiene_fail"]
+    summary = engine.summary()
+    assert series.columns["infected"][-1] == summary.final_states.get("INFECTED", 0)
+    assert series.columns["susceptible"][0] == 3
+    assert series.columns["max_room_load"][-1] == summary.max_room_load
+
+def test_lazy_series_read_decayed_loads():
+    """ In LAZY i campioni leggono le cariche decadute senza modificarle """
+    scenario = get_ward_scenario()
+    scenario["simulation"]["max_ticks"] = 200
+    scenario["simulation"]["decay_mode"] = "LAZY"
+    plain = create_engine(scenario).run().to_list()
+    engine = create_engine(scenario)
+    assert engine.run(series_interval=1).to_list() == plain
+    assert abs(engine.series.columns["mean_room_load"][-1] - engine.summary().mean_room_load) < 1e-12
+
+def test_series_blob_roundtrip_and_downsample():
+    series = TimeSeries(1)
+    for tick in range(10):
+        series.append(tick, {m: float(tick) for m in SERIES_METRICS})
+    restored = TimeSeries.from_blobs(1, series.to_blobs())
+    assert restored.t == series.t and restored.columns == series.columns
+
+    # 10 campioni in 4 bucket da 3 (l'ultimo con un solo campione)
+    out = downsample(restored.t, restored.columns, 4, ["infected"])
+    assert out["bucket_samples"] == 3
+    assert out["t"] == [0, 3, 6, 9]
+    assert out["series"]["infected"] == {"min": [0, 3, 6, 9], "max": [2, 5, 8, 9], "mean": [1, 4, 7, 9]}
+    assert downsample(restored.t, restored.columns, 100)["bucket_samples"] == 1
@@ -20,8 +20,25 @@ interface RunLog {
   ticks_simulated: number;
   event_log_size: number;
   events: any[];
+  live?: boolean;
 }
 
+// Segue lo stream SSE della run: eventi e fotogrammi arrivano mentre il worker simula
+const followRun = (runId: string, onEvents: (events: any[]) => void, onFrame: (frame: any) => void) =>
+  new Promise<string>((resolve, reject) => {
+    const source = new EventSource(`${API_BASE}/runs/${runId}/live`);
+    source.addEventListener('events', e => onEvents(JSON.parse((e as MessageEvent).data)));
+    source.addEventListener('frame', e => onFrame(JSON.parse((e as MessageEvent).data)));
+    source.addEventListener('end', e => {
+      source.close();
+      resolve(JSON.parse((e as MessageEvent).data).status);
+    });
+    // Il browser si riconnette da solo (Last-Event-ID); si abbandona solo se lo stream è chiuso
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) reject(new Error('Stream live interrotto'));
+    };
+  });
+
 function App() {
   const [scenarios, setScenarios] = useState<ScenarioMeta[]>([]);
   const [selectedScenario, setSelectedScenario] = useState<string | null>(null);
@@ -49,9 +66,20 @@ function App() {
       const runResp = await axios.post(`${API_BASE}/scenarios/${selectedScenario}/run`);
       const runId = runResp.data.run_id;
 
-      // 2. Fetch i risultati
+      // 2. Stream live: il viewer anima gli eventi già ricevuti mentre la run prosegue
+      setActiveRun({ id: runId, scenario_id: selectedScenario, timestamp: '', ticks_simulated: 0, event_log_size: 0, events: [], live: true });
+      const runStatus = await followRun(
+        runId,
+        events => setActiveRun(run => run && { ...run, events: [...run.events, ...events], event_log_size: run.event_log_size + events.length }),
+        frame => setActiveRun(run => run && { ...run, ticks_simulated: frame.tick }),
+      );
+      if (runStatus !== 'COMPLETED') {
+        throw new Error(`Run terminata con stato ${runStatus}`);
+      }
+
+      // 3. Header finale (gli eventi sono già arrivati dallo stream)
       const dataResp = await axios.get(`${API_BASE}/runs/${runId}`);
-      setActiveRun(dataResp.data);
+      setActiveRun(run => run && { ...run, ...dataResp.data, events: run.events, live: false });
     } catch (e) {
       console.error(e);
       alert("Errore nell'esecuzione della simulazione!");
@@ -120,7 +148,9 @@ function App() {
         <div className="glass-panel" style={{ padding: '1.5rem', minHeight: '600px' }}>
           {activeRun ? (
             <div>
-              <h2 style={{ color: '#10b981' }}>✔️ Simulazione Completata! (ID: {activeRun.id})</h2>
+              <h2 style={{ color: activeRun.live ? '#3b82f6' : '#10b981' }}>
+                {activeRun.live ? `Simulazione in corso... (ID: ${activeRun.id})` : `✔️ Simulazione Completata! (ID: ${activeRun.id})`}
+              </h2>
               <div style={{ display: 'grid', gridTemplateColumns: 'repeat(3, 1fr)', gap: '1rem', marginTop: '1.5rem' }}>
                 <div style={{ background: 'rgba(0,0,0,0.2)', padding: '1rem', borderRadius: '8px' }}>
                   <div style={{ color: '#94a3b8', fontSize: '0.875rem' }}>Ticks Simulati</div>